@@ -0,0 +1,6 @@
+"""
+Helper modules for the FastAPI backend in `api/index.py`.
+
+The leading underscore keeps Vercel from deploying this package as its own
+serverless function; `index.py` puts `api/` on `sys.path` and imports from here.
+"""
@@ -0,0 +1,233 @@
+"""
+Server-side analysis worker: drains `raw_corpus` rows with `is_analyzed = FALSE`.
+
+Rows are claimed through the `claim_analysis_batch` Postgres function, which takes a
+time-limited lease with `FOR UPDATE SKIP LOCKED`, so any number of workers can run
+side by side without scoring the same row twice. A crashed worker's lease simply
+expires and the row becomes claimable again. Failed rows get their lease pushed out
+by an exponential backoff and are retried until `max_attempts` is reached.
+
+Batches are scored with `sentiment.analyze_items`, the same path as
+/api/analyze_batch, so the worker reads and fills the shared LLM result cache and
+packs short items. The Supabase client is synchronous, so every DB call runs in
+a thread.
+"""
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from . import rollups
+from .llm_cache import LLMCache
+from .sentiment import analyze_items
+
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+
+def is_leased(row, now=None):
+    """
+    True while an analysis worker holds the row (a parked failure has no owner).
+    """
+    expires = row.get("lease_expires_at")
+    if not row.get("lease_owner") or not expires:
+        return False
+    if not isinstance(expires, datetime):
+        expires = datetime.fromisoformat(str(expires).replace("Z", "+00:00"))
+    return expires > (now or utc_now())
+
+
+class AnalysisWorker:
+    """
+    Long-lived claim -> score -> persist loop.
+
+    `client` is a Supabase client (service role) or anything with the same
+    `table()` / `rpc()` surface, such as the in-memory stand-in in `bench/fakes.py`.
+    By default batches go through `analyze_items` with `cache` (a fresh LLMCache
+    when None); `analyze(item)` -> row or None instead scores items one by one,
+    at most `concurrency` at a time (the benches use it).
+    """
+
+    def __init__(self, client, analyze=None, worker_id=None, batch_size=20,
+                 concurrency=10, lease_seconds=120, max_attempts=3, backoff_base=5.0,
+                 backoff_max=600.0, idle_sleep=5.0, cache=None, packed=True):
+        self.client = client
+        self.analyze = analyze
+        self.cache = cache if cache is not None or analyze is not None else LLMCache()
+        self.packed = packed
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.idle_sleep = idle_sleep
+        self.stats = {"claimed": 0, "analyzed": 0, "failed": 0, "lost_leases": 0, "batches": 0}
+        self._stopping = False
+
+    def stop(self):
+        self._stopping = True
+
+    async def run_forever(self):
+        """
+        Keeps draining; sleeps `idle_sleep` seconds whenever the queue is empty.
+        """
+        while not self._stopping:
+            processed = await self.run_once()
+            if not processed:
+                await asyncio.sleep(self.idle_sleep)
+
+    async def drain(self, ids=None):
+        """
+        Processes batches until nothing claimable is left (among `ids`, when
+        given), then returns the stats.
+        """
+        while not self._stopping and await self.run_once(ids):
+            pass
+        return self.stats
+
+    async def run_once(self, ids=None):
+        """
+        Claims one batch (only rows in `ids`, when given), scores it and persists
+        the outcome. Returns the number of rows claimed (0 when the queue is empty).
+        """
+        items = await asyncio.to_thread(self._claim, ids)
+        if not items:
+            return 0
+        self.stats["claimed"] += len(items)
+        self.stats["batches"] += 1
+
+        succeeded = await self._score(items)
+        scored = {res["corpus_id"] for res in succeeded}
+        failed = [item for item in items if item["id"] not in scored]
+
+        persisted = await asyncio.to_thread(self._persist, succeeded, failed, items)
+        self.stats["analyzed"] += persisted
+        self.stats["failed"] += len(failed)
+        self.stats["lost_leases"] += len(succeeded) - persisted
+        return len(items)
+
+    async def _score(self, items):
+        """
+        sentiment_results rows for the items that could be scored.
+        """
+        if self.analyze is None:
+            try:
+                results, _ = await analyze_items(items, self.cache, self.client, packed=self.packed)
+                return results
+            except Exception as e:
+                print(f"Worker {self.worker_id}: batch analysis raised: {e}")
+                return []
+
+        window = asyncio.Semaphore(self.concurrency)
+
+        async def score(item):
+            async with window:
+                try:
+                    return await self.analyze(item)
+                except Exception as e:
+                    print(f"Worker {self.worker_id}: analysis raised for {item['id']}: {e}")
+                    return None
+
+        return [res for res in await asyncio.gather(*[score(item) for item in items]) if res]
+
+    # --- DB side (runs in threads) ---
+
+    def _claim(self, ids=None):
+        params = {
+            "p_worker": self.worker_id,
+            "p_limit": self.batch_size,
+            "p_lease_seconds": self.lease_seconds,
+            "p_max_attempts": self.max_attempts,
+        }
+        if ids is not None:
+            params["p_ids"] = list(ids)
+        res = self.client.rpc("claim_analysis_batch", params).execute()
+        return res.data or []
+
+    def _persist(self, succeeded, failed, items):
+        """
+        Writes the outcome for the rows this worker still holds the lease on.
+        A row whose lease expired and was claimed by another worker is left to
+        that worker, so it never gets a second result. Returns the number of
+        results written.
+        """
+        persisted = 0
+        if succeeded:
+            res = self.client.table("raw_corpus").update({
+                "is_analyzed": True,
+                "lease_owner": None,
+                "lease_expires_at": None,
+                "last_error": None,
+            }).in_("id", [r["corpus_id"] for r in succeeded]).eq("lease_owner", self.worker_id).execute()
+            held = {r["id"] for r in (res.data or [])}
+            kept = [r for r in succeeded if r["corpus_id"] in held]
+            if kept:
+                try:
+                    self.client.table("sentiment_results").insert(kept).execute()
+                except Exception:
+                    # Hand the rows back so they are claimed and scored again
+                    self.client.table("raw_corpus").update({
+                        "is_analyzed": False,
+                    }).in_("id", list(held)).execute()
+                    raise
+                rollups.apply(self.client, items, kept)
+            persisted = len(kept)
+
+        # Park failures until their backoff elapses; rows that hit max_attempts stay parked for good
+        by_attempt = {}
+        for item in failed:
+            by_attempt.setdefault(item.get("analysis_attempts", 1), []).append(item["id"])
+        for attempts, ids in by_attempt.items():
+            retry_at = utc_now() + timedelta(seconds=self.backoff(attempts))
+            self.client.table("raw_corpus").update({
+                "lease_owner": None,
+                "lease_expires_at": retry_at.isoformat(),
+                "last_error": "analysis failed",
+            }).in_("id", ids).eq("lease_owner", self.worker_id).execute()
+        return persisted
+
+    def backoff(self, attempts):
+        return min(self.backoff_base * (2 ** max(attempts - 1, 0)), self.backoff_max)
+
+
+# --- Job tracking (used by the API) ---
+
+def create_job(client, stock_code, user_id=None, service=None):
+    """
+    Registers an analysis job for the pending rows of a stock that no earlier job
+    holds. The job row is created with `client` (the user's, under RLS); the rows
+    are tagged server-side with `service` (service role, defaults to `client`) so
+    progress can be counted. Returns {"job_id", "total"}.
+    """
+    service = service or client
+    job = {"stock_code": stock_code}
+    if user_id:
+        job["user_id"] = user_id
+    created = client.table("analysis_jobs").insert(job).execute()
+    job_id = created.data[0]["id"]
+    tagged = service.rpc("tag_analysis_job", {"p_job": job_id, "p_stock": stock_code}).execute()
+    total = int(tagged.data or 0)
+    if total:
+        service.table("analysis_jobs").update({"total": total}).eq("id", job_id).execute()
+    return {"job_id": job_id, "total": total}
+
+
+def job_progress(client, job_id, max_attempts=3, service=None):
+    """
+    Returns {"job_id", "state", "total", "done", "failed"}; state is "running" or "done".
+    The job must be visible to `client` (RLS: its owner); the rows are counted
+    with `service` (defaults to `client`). Raises LookupError for an unknown job.
+    """
+    owned = client.table("analysis_jobs").select("id").eq("id", job_id).limit(1).execute()
+    if not owned.data:
+        raise LookupError(f"Unknown analysis job {job_id}")
+    res = (service or client).rpc("analysis_job_progress", {"p_job": job_id, "p_max_attempts": max_attempts}).execute()
+    row = (res.data or [{}])[0]
+    total, done, failed = int(row.get("total") or 0), int(row.get("done") or 0), int(row.get("failed") or 0)
+    state = "done" if done + failed >= total else "running"
+    return {"job_id": job_id, "state": state, "total": total, "done": done, "failed": failed}
+
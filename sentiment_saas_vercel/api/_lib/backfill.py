@@ -0,0 +1,169 @@
+"""
+Historical backfill of news and research reports into raw_corpus.
+
+fetch_raw keeps only the newest 20 news / 10 reports of the last 10 days. The
+backfill takes everything the sources return for a symbol within a date range:
+
+- AkShare has no paging for these endpoints (one call returns the symbol's whole
+  frame), so each (symbol, source) costs one throttled, retried upstream call,
+  and memory is bounded by one symbol's frame. Its rows are written oldest first
+  in chunks of `chunk_rows`.
+- Each chunk is deduplicated like fetch_raw (fingerprint + near-dup SimHash) and
+  written with one ignore-duplicates upsert, then checkpointed in
+  `backfill_state` as a publish-time cursor. A crashed run resumes from the
+  cursor; re-sent boundary rows are absorbed by the unique fingerprint key.
+- Rows land with is_analyzed = FALSE, so the analysis workers pick them up as one
+  bulk queue. claim_analysis_batch takes the newest rows first, so live rows are
+  not held up behind history, and ingestion never waits on the LLM.
+"""
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from . import ingest
+from .near_dup import NearDupIndex
+
+CHUNK_ROWS = int(os.environ.get("BACKFILL_CHUNK_ROWS", "500"))
+MIN_INTERVAL = float(os.environ.get("BACKFILL_MIN_INTERVAL", "2"))  # seconds between upstream calls
+
+# source name -> (AkShare fetcher, frame -> rows); same shapes as ingest.SOURCES
+SOURCES = ingest.SOURCES
+
+
+class Throttle:
+    """
+    Spaces calls at least `min_interval` seconds apart across threads.
+    """
+
+    def __init__(self, min_interval, sleep=time.sleep):
+        self.min_interval = min_interval
+        self.sleep = sleep
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.min_interval
+        if delay > 0:
+            self.sleep(delay)
+
+
+class Backfill:
+    """
+    Checkpointed (symbol, source) backfill over [start, end] (dates, inclusive).
+
+    `client` is a service-role Supabase client or the stand-in in `bench/fakes.py`.
+    """
+
+    def __init__(self, client, sources=None, chunk_rows=CHUNK_ROWS, min_interval=MIN_INTERVAL,
+                 max_retries=3, near_dups=None, sleep=time.sleep):
+        self.client = client
+        self.sources = sources or SOURCES
+        self.chunk_rows = chunk_rows
+        self.throttle = Throttle(min_interval, sleep)
+        self.max_retries = max_retries
+        self.near_dups = near_dups or NearDupIndex()
+        self.sleep = sleep
+        self.stats = {"fetches": 0, "chunks": 0, "rows_seen": 0, "inserted": 0,
+                      "near_duplicates": 0, "skipped": 0, "failed": 0}
+
+    def run(self, stock_codes, start, end):
+        """
+        Backfills every symbol in turn. Returns {"<code>/<source>": state row}.
+        """
+        report = {}
+        for code in dict.fromkeys(stock_codes):
+            for name in self.sources:
+                report[f"{code}/{name}"] = self.run_source(code, name, start, end)
+        return report
+
+    def run_source(self, stock_code, name, start, end):
+        """
+        Backfills one (symbol, source), resuming from its checkpoint. A range that
+        is already done is skipped; a different range starts over.
+        """
+        start, end = _as_date(start), _as_date(end)
+        state = self._load_state(stock_code, name)
+        same_range = state and state.get("range_start") == start.isoformat() and state.get("range_end") == end.isoformat()
+        if same_range and state.get("status") == "done":
+            self.stats["skipped"] += 1
+            return state
+        if not same_range:
+            state = {"stock_code": stock_code, "source": name, "range_start": start.isoformat(),
+                     "range_end": end.isoformat(), "cursor": None, "rows_seen": 0, "rows_inserted": 0}
+        state.update(status="running", last_error=None)
+
+        fetch, convert = self.sources[name]
+        try:
+            frame = self._fetch(fetch, stock_code)
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"Backfill {stock_code}/{name} failed: {e}")
+            return self._save_state({**state, "status": "failed", "last_error": str(e)})
+
+        since = datetime.fromisoformat(state["cursor"]) if state.get("cursor") else datetime.combine(start, datetime.min.time())
+        until = datetime.combine(end + timedelta(days=1), datetime.min.time())
+        records = convert(frame, stock_code, since, limit=None, until=until)
+        del frame
+        records.sort(key=lambda r: r["publish_time"])
+
+        self.near_dups.refresh(self.client, stock_code)
+        for offset in range(0, len(records), self.chunk_rows):
+            chunk = records[offset:offset + self.chunk_rows]
+            rows, near = ingest.dedupe(chunk, self.near_dups)
+            try:
+                inserted = ingest.store(self.client, rows) if rows else []
+            except Exception as e:
+                # The chunk's hashes are indexed but its rows are not stored
+                self.near_dups.forget(stock_code)
+                self.stats["failed"] += 1
+                print(f"Backfill {stock_code}/{name} stopped at {state['cursor']}: {e}")
+                return self._save_state({**state, "status": "failed", "last_error": str(e)})
+            state["cursor"] = chunk[-1]["publish_time"]
+            state["rows_seen"] += len(chunk)
+            state["rows_inserted"] += len(inserted)
+            self.stats["chunks"] += 1
+            self.stats["rows_seen"] += len(chunk)
+            self.stats["inserted"] += len(inserted)
+            self.stats["near_duplicates"] += near
+            self._save_state(state)
+        return self._save_state({**state, "status": "done"})
+
+    # --- Upstream ---
+
+    def _fetch(self, fetch, stock_code):
+        for attempt in range(self.max_retries + 1):
+            self.throttle.wait()
+            self.stats["fetches"] += 1
+            try:
+                return fetch(stock_code)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.throttle.min_interval * 2 ** (attempt + 1)
+                print(f"Backfill fetch for {stock_code} failed ({e}), retrying in {delay:g}s")
+                self.sleep(delay)
+
+    # --- Checkpoints ---
+
+    def _load_state(self, stock_code, name):
+        res = (
+            self.client.table("backfill_state").select("*")
+            .eq("stock_code", stock_code).eq("source", name).limit(1).execute()
+        )
+        return (res.data or [None])[0]
+
+    def _save_state(self, state):
+        row = {key: state.get(key) for key in (
+            "stock_code", "source", "range_start", "range_end", "cursor", "rows_seen", "rows_inserted",
+            "status", "last_error")}
+        row["updated_at"] = datetime.now().astimezone().isoformat()
+        self.client.table("backfill_state").upsert(row, on_conflict="stock_code,source").execute()
+        return row
+
+
+def _as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value))
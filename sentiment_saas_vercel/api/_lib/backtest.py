@@ -0,0 +1,333 @@
+"""
+Vectorized sentiment/price analytics behind /api/backtest.
+
+Everything runs on `(N, T)` arrays: N symbols on one shared trading calendar of T
+bars, NaN where a symbol has no bar or no analyzed items. Weight settings add a
+leading axis `(G, N, T)`, and lags or horizons add a lag axis, so a whole
+portfolio and a whole grid go through a handful of NumPy operations.
+
+- `align_prices` / `align_sentiment`: price histories and sentiment_daily rows onto
+  the calendar. Rollup days without a bar (weekends, holidays) count towards the
+  next bar.
+- `combine`: per-source daily means, weighted the way the dashboard weights them.
+  A source without items that day drops out of the average.
+- `lead_lag`: Pearson correlation of the signal with returns k bars later
+  (k > 0: sentiment leads price, k < 0: price leads sentiment).
+- `event_study`: mean cumulative returns after strong positive/negative days,
+  against the unconditional drift over the same horizons.
+- `backtest_grid`: long/short on the sign of the signal past a threshold, equal
+  weight across active names, for every (news_weight, guba_weight) pair.
+
+Rollup days are the CST date of publication, which includes news published after
+the 15:00 close, so positions enter `delay` bars after the signal day (default 1)
+to avoid trading on news that was not out yet.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .indicators import rounded_column
+
+TRADING_DAYS = 252
+SOURCES = ("news", "guba")
+# Upper bound on G x N x T elements per grid chunk (float64), to bound memory
+GRID_CHUNK_ELEMENTS = 4_000_000
+
+
+# --- Alignment ---
+
+def align_prices(histories, days):
+    """
+    `histories`: list of (dates, close) arrays per symbol. Returns (calendar (T,),
+    close (N, T)) over the last `days` bars of the union of all dates.
+    """
+    dates = [np.asarray(d, dtype="datetime64[D]") for d, _ in histories]
+    calendar = np.unique(np.concatenate(dates)) if dates else np.array([], dtype="datetime64[D]")
+    calendar = calendar[-days:] if days > 0 else calendar[:0]
+    close = np.full((len(histories), len(calendar)), np.nan)
+    if not len(calendar):
+        return calendar, close
+    rows = np.concatenate([np.full(len(d), i) for i, d in enumerate(dates)])
+    flat_dates = np.concatenate(dates)
+    flat_close = np.concatenate([np.asarray(c, dtype=np.float64) for _, c in histories])
+    keep = flat_dates >= calendar[0]
+    pos = np.searchsorted(calendar, flat_dates[keep])
+    close[rows[keep], pos] = flat_close[keep]
+    return calendar, close
+
+
+def align_sentiment(rows, codes, calendar):
+    """
+    sentiment_daily rows -> {source: (score_sum (N, T), item_count (N, T))}.
+    """
+    index = {code: i for i, code in enumerate(codes)}
+    shape = (len(codes), len(calendar))
+    out = {source: (np.zeros(shape), np.zeros(shape)) for source in SOURCES}
+    if not rows or not len(calendar):
+        return out
+    stock = np.array([index.get(r["stock_code"], -1) for r in rows])
+    day = np.array([str(r["day"])[:10] for r in rows], dtype="datetime64[D]")
+    source = np.array([r["source"] for r in rows])
+    score_sum = np.array([r["score_sum"] for r in rows], dtype=np.float64)
+    item_count = np.array([r["item_count"] for r in rows], dtype=np.float64)
+    pos = np.searchsorted(calendar, day)
+    valid = (stock >= 0) & (day >= calendar[0]) & (pos < len(calendar))
+    for name, (sums, counts) in out.items():
+        m = valid & (source == name)
+        np.add.at(sums, (stock[m], pos[m]), score_sum[m])
+        np.add.at(counts, (stock[m], pos[m]), item_count[m])
+    return out
+
+
+def combine(sentiment, weights):
+    """
+    Weighted daily signal for each (news_weight, guba_weight) row of `weights`
+    (shape (G, 2)) -> (G, N, T), NaN on days without items from a weighted source.
+    """
+    weights = np.asarray(weights, dtype=np.float64).reshape(-1, 2)
+    num = np.zeros((len(weights),) + sentiment["news"][0].shape)
+    den = np.zeros_like(num)
+    for k, name in enumerate(SOURCES):
+        sums, counts = sentiment[name]
+        present = counts > 0
+        mean = np.divide(sums, counts, out=np.zeros_like(sums), where=present)
+        w = weights[:, k, None, None]
+        num += w * mean
+        den += w * present
+    return np.divide(num, den, out=np.full_like(num, np.nan), where=den > 0)
+
+
+# --- Building blocks ---
+
+def daily_returns(close):
+    """
+    Close-to-close return realized on each bar (NaN on the first bar and around gaps).
+    """
+    out = np.full(close.shape, np.nan)
+    out[..., 1:] = close[..., 1:] / close[..., :-1] - 1
+    return out
+
+
+def offsets(x, lo, hi):
+    """
+    Stack of `x` shifted along the last axis: result[..., j, t] = x[..., t + lo + j]
+    for j in 0..hi-lo, NaN past either end.
+    """
+    pad_lo, pad_hi = max(-lo, 0), max(hi, 0)
+    padded = np.pad(x, [(0, 0)] * (x.ndim - 1) + [(pad_lo, pad_hi)], constant_values=np.nan)
+    windows = sliding_window_view(padded, x.shape[-1], axis=-1)  # (..., pad_lo + pad_hi + 1, T)
+    return windows[..., lo + pad_lo:hi + pad_lo + 1, :]
+
+
+def nan_mean(x, axis=-1):
+    """
+    Mean over the finite entries along `axis`; NaN (without a warning) where none are.
+    """
+    finite = np.isfinite(x)
+    count = finite.sum(axis=axis)
+    total = np.where(finite, x, 0.0).sum(axis=axis)
+    return np.divide(total, count, out=np.full(np.shape(total), np.nan), where=count > 0)
+
+
+def nan_corr(x, y, axis=-1, min_obs=10):
+    """
+    Pearson correlation over the pairwise-finite entries along `axis`.
+    Returns (corr, n); corr is NaN where fewer than `min_obs` pairs remain.
+    """
+    mask = np.isfinite(x) & np.isfinite(y)
+    n = mask.sum(axis=axis)
+    safe_n = np.maximum(n, 1)
+    x0, y0 = np.where(mask, x, 0.0), np.where(mask, y, 0.0)
+    dx = np.where(mask, x0 - np.expand_dims(x0.sum(axis=axis) / safe_n, axis), 0.0)
+    dy = np.where(mask, y0 - np.expand_dims(y0.sum(axis=axis) / safe_n, axis), 0.0)
+    cov = (dx * dy).sum(axis=axis)
+    var = (dx * dx).sum(axis=axis) * (dy * dy).sum(axis=axis)
+    corr = np.divide(cov, np.sqrt(var), out=np.full(cov.shape, np.nan), where=(var > 0) & (n >= min_obs))
+    return corr, n
+
+
+def forward_fill(signal, hold):
+    """
+    Carries each signal forward for up to `hold` bars (1 = that bar only).
+    """
+    t = np.arange(signal.shape[-1])
+    last = np.maximum.accumulate(np.where(np.isfinite(signal), t, -1), axis=-1)
+    filled = np.take_along_axis(signal, np.maximum(last, 0), axis=-1)
+    return np.where((last >= 0) & (t - last < hold), filled, np.nan)
+
+
+# --- Analyses ---
+
+def lead_lag(signal, close, max_lag=5, min_obs=10):
+    """
+    Correlation of signal(t) with the return realized on bar t + k, k in
+    [-max_lag, max_lag]: per symbol (N, L), pooled over all symbols (L,), and the
+    cross-sectional mean of the per-symbol values (L,).
+    """
+    returns = offsets(daily_returns(close), -max_lag, max_lag)  # (N, L, T)
+    s = np.broadcast_to(signal[:, None, :], returns.shape)
+    per_symbol, _ = nan_corr(s, returns, min_obs=min_obs)
+    # Pooled: demean per symbol first, so level differences between stocks don't count
+    s_dm = np.moveaxis(s - nan_mean(s, axis=-1)[..., None], 1, 0).reshape(returns.shape[1], -1)
+    r_dm = np.moveaxis(returns - nan_mean(returns, axis=-1)[..., None], 1, 0).reshape(returns.shape[1], -1)
+    pooled, n = nan_corr(s_dm, r_dm, min_obs=min_obs)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t_stat = pooled * np.sqrt((n - 2) / (1 - pooled ** 2))
+    mean_corr = nan_mean(per_symbol, axis=0)
+    return {
+        "lags": np.arange(-max_lag, max_lag + 1),
+        "pooled": pooled,
+        "t_stat": t_stat,
+        "observations": n,
+        "mean_per_symbol": mean_corr,
+        "per_symbol": per_symbol,
+    }
+
+
+def event_study(signal, close, threshold=0.5, horizons=10, delay=1):
+    """
+    Mean cumulative log return from entry (close of bar t + delay) to h bars later,
+    h = 1..horizons, after days with signal >= threshold ("positive") or
+    <= -threshold ("negative"), plus the unconditional mean over all bars.
+    """
+    log_close = np.log(close)
+    ahead = offsets(log_close, delay, delay + horizons)      # (N, H + 1, T)
+    cumulative = ahead[:, 1:, :] - ahead[:, :1, :]          # (N, H, T)
+    finite = np.isfinite(cumulative)
+
+    def mean_where(mask):
+        m = mask[:, None, :] & finite
+        count = m.sum(axis=(0, 2))
+        total = np.where(m, cumulative, 0.0).sum(axis=(0, 2))
+        return np.divide(total, count, out=np.full(total.shape, np.nan), where=count > 0), count
+
+    pos, n_pos = mean_where(signal >= threshold)
+    neg, n_neg = mean_where(signal <= -threshold)
+    base, _ = mean_where(np.ones(signal.shape, dtype=bool))
+    return {
+        "horizons": np.arange(1, horizons + 1),
+        "positive": pos, "negative": neg, "baseline": base,
+        "positive_events": int((signal >= threshold).sum()), "negative_events": int((signal <= -threshold).sum()),
+        "positive_observations": n_pos, "negative_observations": n_neg,
+    }
+
+
+def backtest_grid(sentiment, close, weights, threshold=0.3, hold=1, delay=1, cost_bps=10.0):
+    """
+    Long/short backtest for every (news_weight, guba_weight) row of `weights`.
+
+    On each bar, names whose (carried-forward) signal is >= threshold are held
+    long and <= -threshold short, equally weighted (1 / active names each), for the
+    return from the close of bar t + delay to the next close. Costs are `cost_bps`
+    per unit of weight traded. Returns per-setting metrics as arrays of length G.
+    """
+    weights = np.asarray(weights, dtype=np.float64).reshape(-1, 2)
+    n, t = close.shape
+    # Return earned by a position decided on bar t
+    forward = offsets(daily_returns(close), delay + 1, delay + 1)[:, 0, :]
+    tradable = np.isfinite(forward)
+    forward = np.where(tradable, forward, 0.0)
+    cost = cost_bps / 1e4
+
+    chunk = max(1, GRID_CHUNK_ELEMENTS // max(n * t, 1))
+    parts = []
+    for start in range(0, len(weights), chunk):
+        signal = forward_fill(combine(sentiment, weights[start:start + chunk]), hold)
+        position = np.where(np.abs(signal) >= threshold, np.sign(signal), 0.0) * tradable
+        active = (position != 0).sum(axis=1)                                   # (g, T)
+        position /= np.maximum(active, 1)[:, None, :]
+        traded = np.abs(np.diff(position, axis=-1, prepend=0.0)).sum(axis=1)   # (g, T)
+        parts.append(((position * forward).sum(axis=1) - cost * traded, active, traded))
+    daily, active, traded = (np.concatenate(p) for p in zip(*parts))
+    return _metrics(weights, daily, active, traded)
+
+
+def _metrics(weights, daily, active, traded):
+    """
+    Return statistics over all bars (flat days count as zero return); hit rate
+    and averages over the bars with open positions.
+    """
+    bars = daily.shape[1]
+    invested = active > 0
+    days = invested.sum(axis=1)
+    safe = np.maximum(days, 1)
+    mean = daily.mean(axis=1) if bars else np.zeros(len(weights))
+    std = daily.std(axis=1, ddof=1) if bars > 1 else np.zeros(len(weights))
+    equity = np.cumprod(1 + daily, axis=1)
+    drawdown = equity / np.maximum(np.maximum.accumulate(equity, axis=1), 1) - 1
+    return {
+        "news_weight": weights[:, 0],
+        "guba_weight": weights[:, 1],
+        "sharpe": np.divide(mean, std, out=np.full(mean.shape, np.nan), where=std > 0) * np.sqrt(TRADING_DAYS),
+        "total_return": equity[:, -1] - 1 if bars else np.zeros(len(weights)),
+        "annual_return": mean * TRADING_DAYS,
+        "max_drawdown": drawdown.min(axis=1) if bars else np.zeros(len(weights)),
+        "hit_rate": np.where(invested, daily > 0, False).sum(axis=1) / safe,
+        "days_invested": days,
+        "avg_names": np.where(invested, active, 0).sum(axis=1) / safe,
+        "avg_turnover": traded.sum(axis=1) / safe,
+    }
+
+
+def weight_grid(news_weights, guba_weights):
+    """
+    Every (news, guba) pair with at least one non-zero weight, shape (G, 2).
+    """
+    news, guba = np.meshgrid(np.asarray(news_weights, float), np.asarray(guba_weights, float), indexing="ij")
+    pairs = np.column_stack([news.ravel(), guba.ravel()])
+    return pairs[(pairs > 0).any(axis=1)]
+
+
+# --- Endpoint payload ---
+
+BACKTEST_COLUMNS = ["news_weight", "guba_weight", "sharpe", "total_return", "annual_return", "max_drawdown",
+                    "hit_rate", "days_invested", "avg_names", "avg_turnover"]
+
+
+def evaluate(codes, histories, rollup_rows, days, weights=(0.7, 0.3), grid=None, max_lag=5, horizons=10,
+             event_threshold=0.5, threshold=0.3, hold=1, delay=1, cost_bps=10.0):
+    """
+    Runs all three analyses for `codes` (aligned with `histories`) and returns a
+    JSON-ready dict. `weights` drive the lead-lag and event study; `grid` (G, 2)
+    the backtest. Backtest rows are sorted by Sharpe, best first.
+    """
+    calendar, close = align_prices(histories, days)
+    sentiment = align_sentiment(rollup_rows, codes, calendar)
+    signal = combine(sentiment, [weights])[0]
+
+    ll = lead_lag(signal, close, max_lag)
+    events = event_study(signal, close, event_threshold, horizons, delay)
+    grid = np.asarray(grid if grid is not None else [weights], dtype=np.float64).reshape(-1, 2)
+    results = backtest_grid(sentiment, close, grid, threshold, hold, delay, cost_bps)
+
+    order = np.argsort(np.where(np.isfinite(results["sharpe"]), -results["sharpe"], np.inf), kind="stable")
+    columns = [rounded_column(results[col][order], 4) for col in BACKTEST_COLUMNS]
+    rows = [list(row) for row in zip(*columns)]
+    has_signal = np.isfinite(signal).any(axis=1)
+    return {
+        "symbols": len(codes),
+        "symbols_with_sentiment": int(has_signal.sum()),
+        "bars": len(calendar),
+        "start": str(calendar[0]) if len(calendar) else None,
+        "end": str(calendar[-1]) if len(calendar) else None,
+        "lead_lag": {
+            "lags": ll["lags"].tolist(),
+            "pooled": rounded_column(ll["pooled"], 4),
+            "t_stat": rounded_column(ll["t_stat"], 2),
+            "observations": ll["observations"].tolist(),
+            "mean_per_symbol": rounded_column(ll["mean_per_symbol"], 4),
+            "per_symbol": {code: rounded_column(ll["per_symbol"][i], 4) for i, code in enumerate(codes) if has_signal[i]},
+        },
+        "event_study": {
+            "horizons": events["horizons"].tolist(),
+            "positive": rounded_column(events["positive"], 5),
+            "negative": rounded_column(events["negative"], 5),
+            "baseline": rounded_column(events["baseline"], 5),
+            "positive_events": events["positive_events"],
+            "negative_events": events["negative_events"],
+        },
+        "backtest": {
+            "columns": BACKTEST_COLUMNS,
+            "rows": rows,
+            "best": dict(zip(BACKTEST_COLUMNS, rows[0])) if rows else None,
+        },
+    }
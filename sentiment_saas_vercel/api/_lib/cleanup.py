@@ -0,0 +1,197 @@
+"""
+Incremental raw_corpus / sentiment_results cleanup behind /api/cleanup_data.
+
+Runs as a stream of bounded pages instead of loading a whole stock:
+- raw_corpus and sentiment_results are each scanned with keyset pagination on `id`
+  within `created_at > high-water mark`, so a repeat run only reads rows added since
+  the previous one. Marks live in `cleanup_state`; they are set slightly before the
+  scan started, so rows committed while it was running are picked up next time.
+  Users may only read that table, so the marks are written with `state_client`
+  (the service role).
+- Duplicate titles in a page are resolved against every row with that title
+  (newest publish_time wins); deletes and resets go out in chunks small enough
+  for PostgREST's URL limit.
+- English summaries are spotted with a regex letter count rather than a
+  per-character loop.
+- The two scans are independent and run side by side, as do the chunked
+  lookups/deletes within a page (`supabase_pool.parallel`).
+- A `full` run also drops llm_cache entries from older prompt versions.
+"""
+import re
+import time
+from datetime import datetime, timedelta, timezone
+
+from .supabase_pool import concurrently, parallel
+
+PAGE_SIZE = 500
+CHUNK_SIZE = 100  # ids / titles per `in_` filter
+HIGH_WATER_SLACK = timedelta(minutes=1)
+EPOCH = "1970-01-01T00:00:00+00:00"
+
+_ASCII_LETTERS = re.compile(r"[A-Za-z]")
+
+
+def is_english(summary):
+    """
+    More than half ASCII letters (and longer than 10 characters) counts as English.
+    """
+    summary = summary or ""
+    return len(summary) > 10 and len(_ASCII_LETTERS.findall(summary)) / len(summary) > 0.5
+
+
+def chunks(values, size=CHUNK_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def keyset_pages(make_query, page_size=PAGE_SIZE):
+    """
+    Yields pages of `make_query()` ordered by id, each starting after the last id seen.
+    """
+    last_id = None
+    while True:
+        query = make_query()
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        page = query.order("id").limit(page_size).execute().data or []
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        last_id = page[-1]["id"]
+
+
+def load_state(client, stock_code):
+    res = client.table("cleanup_state").select("*").eq("stock_code", stock_code).limit(1).execute()
+    return (res.data or [{}])[0]
+
+
+def save_state(client, stock_code, corpus_high_water, results_high_water):
+    """
+    A failed write is logged, not raised: without the marks the next run rescans.
+    """
+    try:
+        client.table("cleanup_state").upsert({
+            "stock_code": stock_code,
+            "corpus_high_water": corpus_high_water,
+            "results_high_water": results_high_water,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }, on_conflict="stock_code").execute()
+    except Exception as e:
+        print(f"Cleanup state write failed for {stock_code}: {e}")
+
+
+def _newest_first(row):
+    return (row.get("publish_time") is not None, row.get("publish_time") or "", row["id"])
+
+
+def remove_duplicates(client, stock_code, page, handled):
+    """
+    Deletes every row sharing a title with `page` except the newest. `handled` holds
+    titles already resolved during this run. Returns the number of rows deleted.
+    """
+    titles = {r["title"] for r in page} - handled
+    handled |= titles
+    lookups = parallel(*[
+        (lambda part=part: client.table("raw_corpus").select("id, title, publish_time")
+         .eq("stock_code", stock_code).in_("title", part).execute())
+        for part in chunks(titles)
+    ])
+    groups = {}
+    for res in lookups:
+        for r in res.data or []:
+            groups.setdefault(r["title"], []).append(r)
+    doomed = []
+    for group in groups.values():
+        group.sort(key=_newest_first, reverse=True)
+        doomed.extend(r["id"] for r in group[1:])
+
+    # sentiment_results.corpus_id has no ON DELETE CASCADE; drop the children first
+    parallel(*[lambda part=part: client.table("sentiment_results").delete().in_("corpus_id", part).execute()
+               for part in chunks(doomed)])
+    parallel(*[lambda part=part: client.table("raw_corpus").delete().in_("id", part).execute()
+               for part in chunks(doomed)])
+    return len(doomed)
+
+
+def reset_english(client, page, cache=None):
+    """
+    Deletes English summaries in a page of sentiment_results and flags their corpus
+    rows for re-analysis. Returns (deleted, reset).
+    """
+    bad = [r for r in page if is_english(r.get("summary"))]
+    corpus_ids = list({r["corpus_id"] for r in bad})
+
+    def reset(part):
+        client.table("raw_corpus").update({"is_analyzed": False}).in_("id", part).execute()
+        if cache is not None:
+            # Forget the rejected results so re-analysis really calls the model again
+            rejected = client.table("raw_corpus").select("stock_code, source, title, content").in_("id", part).execute()
+            cache.invalidate(client, [cache.key_for(item) for item in (rejected.data or [])])
+
+    parallel(
+        *[lambda part=part: client.table("sentiment_results").delete().in_("id", part).execute()
+          for part in chunks([r["id"] for r in bad])],
+        *[lambda part=part: reset(part) for part in chunks(corpus_ids)],
+    )
+    return len(bad), len(corpus_ids)
+
+
+def run_cleanup(client, stock_code, cache=None, full=False, page_size=PAGE_SIZE, state_client=None):
+    """
+    Cleans one stock. `full` ignores the high-water marks and rescans everything,
+    and purges LLM cache entries of older prompt versions. `state_client` writes
+    the marks (defaults to `client`).
+    """
+    started = time.monotonic()
+    next_mark = (datetime.now(timezone.utc) - HIGH_WATER_SLACK).isoformat()
+    state = {} if full else load_state(client, stock_code)
+
+    # 1. Duplicate titles among corpus rows added since the last run
+    def scan_corpus():
+        scanned = deleted = 0
+        handled = set()
+        corpus_pages = keyset_pages(lambda: (
+            client.table("raw_corpus").select("id, title, publish_time")
+            .eq("stock_code", stock_code).gt("created_at", state.get("corpus_high_water") or EPOCH)
+        ), page_size)
+        for page in corpus_pages:
+            scanned += len(page)
+            deleted += remove_duplicates(client, stock_code, page, handled)
+        return scanned, deleted
+
+    # 2. English summaries among results added since the last run
+    def scan_results():
+        scanned = deleted = reset = 0
+        result_pages = keyset_pages(lambda: (
+            client.table("sentiment_results").select("id, corpus_id, summary, raw_corpus!inner(stock_code)")
+            .eq("raw_corpus.stock_code", stock_code).gt("created_at", state.get("results_high_water") or EPOCH)
+        ), page_size)
+        for page in result_pages:
+            scanned += len(page)
+            page_deleted, page_reset = reset_english(client, page, cache)
+            deleted += page_deleted
+            reset += page_reset
+        return scanned, deleted, reset
+
+    # Deleting a duplicate and resetting an English result never conflict (at worst
+    # a reset hits a row that is gone), so the scans run side by side
+    (corpus_scanned, deleted_duplicates), (results_scanned, deleted_english, reset_count) = (
+        concurrently(scan_corpus, scan_results)
+    )
+
+    save_state(state_client or client, stock_code, next_mark, next_mark)
+    purged = cache.purge_stale_versions(client) if full and cache is not None else 0
+    elapsed = time.monotonic() - started
+    scanned = corpus_scanned + results_scanned
+    return {
+        "deleted_duplicates": deleted_duplicates,
+        "deleted_english_summaries": deleted_english,
+        "reset_for_reanalysis": reset_count,
+        "purged_cache_entries": purged,
+        "rows_scanned": scanned,
+        "rows_per_second": round(scanned / elapsed, 1) if elapsed > 0 else None,
+        "elapsed": round(elapsed, 3),
+        "incremental": bool(state),
+    }
@@ -0,0 +1,121 @@
+"""
+Cache + single-flight generation for the technical-analysis commentary.
+
+Commentary only depends on the indicator snapshot, so it is keyed on
+(stock code, last bar date, indicator vector rounded to 3 significant digits,
+signals). A request waits for the model up to its own budget (`wait`), since a
+serverless instance may be frozen once the response is sent; past the budget it
+gets the previous text for that stock ("stale") or "pending". Concurrent requests
+for the same key share one generation task. A failed generation is remembered for
+`retry_after` seconds ("unavailable"), so requests don't each start a paid call,
+and a generation that never finished is restarted after `max_age` seconds.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import time
+from collections import OrderedDict
+
+
+def _significant(value, digits=3):
+    if value is None or not isinstance(value, (int, float)) or not math.isfinite(value) or value == 0:
+        return value
+    return round(value, digits - 1 - int(math.floor(math.log10(abs(value)))))
+
+
+def commentary_key(stock_code, last_date, values, signals):
+    payload = {
+        "code": stock_code,
+        "date": str(last_date),
+        "values": {k: _significant(v) for k, v in sorted(values.items())},
+        "signals": dict(sorted(signals.items())),
+    }
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()[:24]
+
+
+class CommentaryCache:
+    """
+    In-process LRU of finished commentary plus the in-flight generation tasks.
+    `generate(stock_code, values, signals)` is the coroutine that calls the model;
+    it should raise on failure so errors are not cached.
+    """
+
+    def __init__(self, generate, max_entries=1024, retry_after=60.0, max_age=180.0):
+        self.generate = generate
+        self.max_entries = max_entries
+        self.retry_after = retry_after
+        self.max_age = max_age
+        self._done = OrderedDict()   # key -> text
+        self._latest = {}            # stock code -> most recent text (served while refreshing)
+        self._inflight = {}          # key -> (asyncio.Task, started at)
+        self._failed = OrderedDict()  # key -> monotonic time the next attempt is allowed
+        self.stats = {"hits": 0, "joins": 0, "generations": 0, "failures": 0, "suppressed": 0}
+
+    async def get(self, stock_code, last_date, values, signals, wait=0):
+        """
+        Returns (status, text): "ready", "stale", "pending" or "unavailable".
+        With `wait` > 0, waits up to that many seconds for a generation to finish.
+        """
+        key = commentary_key(stock_code, last_date, values, signals)
+        if key in self._done:
+            self.stats["hits"] += 1
+            self._done.move_to_end(key)
+            return "ready", self._done[key]
+
+        now = time.monotonic()
+        stale = self._latest.get(stock_code)
+        if self._failed.get(key, 0) > now:
+            self.stats["suppressed"] += 1
+            return ("stale", stale) if stale else ("unavailable", "AI分析暂不可用")
+
+        task, started = self._inflight.get(key, (None, 0))
+        if task is not None and now - started > self.max_age:
+            # Left over from a frozen instance or a hung call
+            task.cancel()
+            task = None
+        if task is None:
+            task = self._start(key, stock_code, values, signals)
+        else:
+            self.stats["joins"] += 1
+
+        if wait > 0:
+            try:
+                return "ready", await asyncio.wait_for(asyncio.shield(task), wait)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                if task.cancelled():
+                    return ("stale", stale) if stale else ("pending", "")
+                raise
+            except Exception:
+                return ("stale", stale) if stale else ("unavailable", "AI分析暂不可用")
+
+        return ("stale", stale) if stale else ("pending", "")
+
+    def _start(self, key, stock_code, values, signals):
+        self.stats["generations"] += 1
+        task = asyncio.ensure_future(self.generate(stock_code, values, signals))
+        self._inflight[key] = (task, time.monotonic())
+
+        def finished(t):
+            if self._inflight.get(key, (None,))[0] is t:
+                self._inflight.pop(key)
+            if t.cancelled():
+                return
+            if t.exception() is not None:
+                self.stats["failures"] += 1
+                print(f"Technical commentary failed for {stock_code}: {t.exception()}")
+                self._failed[key] = time.monotonic() + self.retry_after
+                self._failed.move_to_end(key)
+                while len(self._failed) > self.max_entries:
+                    self._failed.popitem(last=False)
+                return
+            self._failed.pop(key, None)
+            self._done[key] = t.result()
+            self._latest[stock_code] = t.result()
+            while len(self._done) > self.max_entries:
+                self._done.popitem(last=False)
+
+        task.add_done_callback(finished)
+        return task
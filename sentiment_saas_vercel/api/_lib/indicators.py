@@ -0,0 +1,283 @@
+"""
+Vectorized technical indicator engine (MA / MACD / RSI / KDJ).
+
+Replaces the per-indicator `ta` objects and the `iterrows` payload loop in
+/api/technical_indicators. Inputs are contiguous float64 arrays shaped `(T,)` for one
+symbol or `(N, T)` for N symbols (left-padded with NaN when histories differ in length).
+Outputs follow the `ta` conventions with `fillna=False`, so values match the old path:
+
+- MA5/10/20: simple rolling mean, NaN until the window is full
+- MACD(12, 26, 9): EMAs with `adjust=False`, DEA starts at the first valid DIF
+- RSI(14): Wilder smoothing (alpha = 1/14) of up/down moves
+- KDJ(9, 3): K = raw stochastic, D = 3-bar mean of K, J = 3K - 2D
+
+`compute(..., with_state=True)` also returns the recursion state at the last bar, and
+`update(state, close, high, low)` advances it by one bar without recomputing the window.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+MA_WINDOWS = (5, 10, 20)
+MACD_FAST, MACD_SLOW, MACD_SIGNAL = 12, 26, 9
+RSI_WINDOW = 14
+KDJ_WINDOW, KDJ_SMOOTH = 9, 3
+
+# Output columns and the decimals the API rounds them to
+ROUNDING = {
+    "close": 2,
+    "ma5": 2, "ma10": 2, "ma20": 2,
+    "macd_dif": 4, "macd_dea": 4, "macd_hist": 4,
+    "rsi": 2,
+    "k": 2, "d": 2, "j": 2,
+}
+
+
+# --- Primitives (operate on the last axis) ---
+
+def rolling_mean(x, window):
+    out = np.full(x.shape, np.nan)
+    if x.shape[-1] >= window:
+        out[..., window - 1:] = sliding_window_view(x, window, axis=-1).mean(axis=-1)
+    return out
+
+
+def rolling_min(x, window):
+    out = np.full(x.shape, np.nan)
+    if x.shape[-1] >= window:
+        out[..., window - 1:] = sliding_window_view(x, window, axis=-1).min(axis=-1)
+    return out
+
+
+def rolling_max(x, window):
+    out = np.full(x.shape, np.nan)
+    if x.shape[-1] >= window:
+        out[..., window - 1:] = sliding_window_view(x, window, axis=-1).max(axis=-1)
+    return out
+
+
+def ewm(x, alpha, min_periods):
+    """
+    `pandas.Series.ewm(alpha=..., adjust=False, min_periods=...).mean()` for
+    left-NaN-padded input. The recursion is stepped once per bar but vectorized
+    across all symbols, so a portfolio costs the same Python overhead as one stock.
+
+    Returns (values, last_value, valid_count) so callers can keep the state.
+    """
+    x = np.atleast_2d(x)
+    out = np.full(x.shape, np.nan)
+    state = np.full(x.shape[0], np.nan)
+    count = np.zeros(x.shape[0], dtype=np.int64)
+    decay = 1.0 - alpha
+    for t in range(x.shape[1]):
+        col = x[:, t]
+        valid = ~np.isnan(col)
+        state = np.where(np.isnan(state), col, np.where(valid, alpha * col + decay * state, state))
+        count += valid
+        out[:, t] = np.where(valid & (count >= min_periods), state, np.nan)
+    return out, state, count
+
+
+def pad_left(series, length=None):
+    """
+    Stacks 1-D histories of different lengths into one `(N, T)` array,
+    right-aligned on the latest bar and NaN-padded on the left.
+    """
+    length = length or max(len(x) for x in series)
+    out = np.full((len(series), length), np.nan)
+    for i, x in enumerate(series):
+        x = np.asarray(x, dtype=np.float64)[-length:]
+        if len(x):
+            out[i, -len(x):] = x
+    return out
+
+
+def span_alpha(span):
+    return 2.0 / (span + 1.0)
+
+
+# --- Engine ---
+
+def compute(close, high, low, with_state=False):
+    """
+    Computes every indicator in one pass.
+
+    Returns a dict of arrays with the same leading shape as `close`
+    (plus the recursion state when `with_state` is True).
+    """
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    high = np.ascontiguousarray(high, dtype=np.float64)
+    low = np.ascontiguousarray(low, dtype=np.float64)
+    squeeze = close.ndim == 1
+    close2, high2, low2 = np.atleast_2d(close), np.atleast_2d(high), np.atleast_2d(low)
+
+    out = {"close": close2}
+    for w in MA_WINDOWS:
+        out[f"ma{w}"] = rolling_mean(close2, w)
+
+    ema_fast, fast_last, fast_n = ewm(close2, span_alpha(MACD_FAST), MACD_FAST)
+    ema_slow, slow_last, slow_n = ewm(close2, span_alpha(MACD_SLOW), MACD_SLOW)
+    dif = ema_fast - ema_slow
+    dea, dea_last, dea_n = ewm(dif, span_alpha(MACD_SIGNAL), MACD_SIGNAL)
+    out["macd_dif"], out["macd_dea"], out["macd_hist"] = dif, dea, dif - dea
+
+    diff = np.diff(close2, axis=-1, prepend=np.nan)
+    pad = np.isnan(close2)
+    # Like `ta`, the first bar's missing diff counts as a zero move
+    up = np.where(pad, np.nan, np.where(diff > 0, diff, 0.0))
+    down = np.where(pad, np.nan, np.where(diff < 0, -diff, 0.0))
+    ema_up, up_last, up_n = ewm(up, 1.0 / RSI_WINDOW, RSI_WINDOW)
+    ema_down, down_last, _ = ewm(down, 1.0 / RSI_WINDOW, RSI_WINDOW)
+    out["rsi"] = _rsi(ema_up, ema_down)
+
+    lowest = rolling_min(low2, KDJ_WINDOW)
+    highest = rolling_max(high2, KDJ_WINDOW)
+    out["k"] = _stoch(close2, lowest, highest)
+    out["d"] = rolling_mean(out["k"], KDJ_SMOOTH)
+    out["j"] = 3 * out["k"] - 2 * out["d"]
+
+    if squeeze:
+        out = {name: arr[0] for name, arr in out.items()}
+    if not with_state:
+        return out
+
+    state = [
+        {
+            "ema_fast": float(fast_last[i]), "ema_slow": float(slow_last[i]), "dea": float(dea_last[i]),
+            "n_close": int(fast_n[i]), "n_dif": int(dea_n[i]),
+            "ema_up": float(up_last[i]), "ema_down": float(down_last[i]), "n_rsi": int(up_n[i]),
+            # Trailing windows for the rolling indicators
+            "closes": _tail_list(close2[i], max(MA_WINDOWS) - 1),
+            "highs": _tail_list(high2[i], KDJ_WINDOW - 1),
+            "lows": _tail_list(low2[i], KDJ_WINDOW - 1),
+            "ks": _tail_list(out["k"][i] if not squeeze else out["k"], KDJ_SMOOTH - 1),
+        }
+        for i in range(close2.shape[0])
+    ]
+    return out, (state[0] if squeeze else state)
+
+
+def update(state, close, high, low):
+    """
+    Advances one symbol's indicators by a single new bar.
+    Returns (values, new_state); `state` comes from `compute(..., with_state=True)`.
+    """
+    s = dict(state)
+    prev_close = s["closes"][-1] if s["closes"] else np.nan
+    closes = (s["closes"] + [close])[-max(MA_WINDOWS):]
+    highs = (s["highs"] + [high])[-KDJ_WINDOW:]
+    lows = (s["lows"] + [low])[-KDJ_WINDOW:]
+
+    values = {"close": close}
+    for w in MA_WINDOWS:
+        window = closes[-w:]
+        values[f"ma{w}"] = float(np.mean(window)) if len(window) == w and not np.isnan(window).any() else np.nan
+
+    n_close = s["n_close"]
+    s["ema_fast"], s["n_close"], fast = _ewm_step(s["ema_fast"], n_close, close, span_alpha(MACD_FAST), MACD_FAST)
+    s["ema_slow"], _, slow = _ewm_step(s["ema_slow"], n_close, close, span_alpha(MACD_SLOW), MACD_SLOW)
+    dif = fast - slow
+    s["dea"], s["n_dif"], dea = _ewm_step(s["dea"], s["n_dif"], dif, span_alpha(MACD_SIGNAL), MACD_SIGNAL)
+    values["macd_dif"], values["macd_dea"], values["macd_hist"] = dif, dea, dif - dea
+
+    move = close - prev_close if not np.isnan(prev_close) else 0.0
+    n_rsi = s["n_rsi"]
+    s["ema_up"], s["n_rsi"], ema_up = _ewm_step(s["ema_up"], n_rsi, max(move, 0.0), 1.0 / RSI_WINDOW, RSI_WINDOW)
+    s["ema_down"], _, ema_down = _ewm_step(s["ema_down"], n_rsi, max(-move, 0.0), 1.0 / RSI_WINDOW, RSI_WINDOW)
+    values["rsi"] = float(_rsi(np.array(ema_up), np.array(ema_down)))
+
+    if len(lows) == KDJ_WINDOW:
+        k = float(_stoch(np.array(close), np.array(min(lows)), np.array(max(highs))))
+    else:
+        k = np.nan
+    ks = (s["ks"] + [k])[-KDJ_SMOOTH:]
+    d = float(np.mean(ks)) if len(ks) == KDJ_SMOOTH and not np.isnan(ks).any() else np.nan
+    values["k"], values["d"], values["j"] = k, d, 3 * k - 2 * d
+
+    s["closes"] = closes[-(max(MA_WINDOWS) - 1):]
+    s["highs"], s["lows"] = highs[-(KDJ_WINDOW - 1):], lows[-(KDJ_WINDOW - 1):]
+    s["ks"] = ks[-(KDJ_SMOOTH - 1):]
+    return values, s
+
+
+# --- Signals and payloads ---
+
+def signals(latest, prev):
+    """
+    Turns the last two bars into the dashboard's signal labels.
+    `latest` / `prev` map indicator name -> float or `(N,)` array; returns the same shape of labels.
+    """
+    cur = {k: np.asarray(v, dtype=np.float64) for k, v in latest.items()}
+    old = {k: np.asarray(v, dtype=np.float64) for k, v in prev.items()}
+    with np.errstate(invalid="ignore"):
+        ma_trend = np.select(
+            [(cur["ma5"] > cur["ma10"]) & (cur["ma10"] > cur["ma20"]),
+             (cur["ma5"] < cur["ma10"]) & (cur["ma10"] < cur["ma20"])],
+            ["多头排列", "空头排列"], "震荡整理")
+        macd_signal = np.select(
+            [(old["macd_dif"] < old["macd_dea"]) & (cur["macd_dif"] > cur["macd_dea"]),
+             (old["macd_dif"] > old["macd_dea"]) & (cur["macd_dif"] < cur["macd_dea"]),
+             cur["macd_dif"] > cur["macd_dea"]],
+            ["金叉", "死叉", "持续多头"], "持续空头")
+        rsi_signal = np.select([cur["rsi"] > 70, cur["rsi"] < 30], ["超买", "超卖"], "中性")
+        kdj_signal = np.select(
+            [(cur["k"] > 80) | (cur["j"] > 100), (cur["k"] < 20) | (cur["j"] < 0)],
+            ["超买", "超卖"], "中性")
+    out = {"ma_trend": ma_trend, "macd_signal": macd_signal, "rsi_signal": rsi_signal, "kdj_signal": kdj_signal}
+    if ma_trend.ndim == 0:
+        return {k: str(v) for k, v in out.items()}
+    return {k: v.tolist() for k, v in out.items()}
+
+
+def rounded_column(values, decimals):
+    """
+    Rounds a whole column at once and maps NaN to None for JSON.
+    """
+    arr = np.round(np.asarray(values, dtype=np.float64), decimals)
+    out = arr.astype(object)
+    out[np.isnan(arr)] = None
+    return out.tolist()
+
+
+def chart_payload(dates, ind, rows=30):
+    """
+    Builds the `chart_data` list from the last `rows` bars, one column at a time.
+    """
+    cols = {"date": [str(d)[:10] for d in dates[-rows:]]}
+    for name, decimals in ROUNDING.items():
+        cols[name] = rounded_column(ind[name][-rows:], decimals)
+    keys = list(cols)
+    return [dict(zip(keys, row)) for row in zip(*cols.values())]
+
+
+def latest_values(ind, index=-1):
+    """
+    Rounded indicator values of a single symbol at one bar (default: the latest).
+    """
+    return {name: rounded_column([ind[name][index]], decimals)[0] for name, decimals in ROUNDING.items()}
+
+
+# --- Helpers ---
+
+def _rsi(ema_up, ema_down):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(ema_down == 0, 100.0, 100.0 - 100.0 / (1.0 + ema_up / ema_down))
+
+
+def _stoch(close, lowest, highest):
+    span = highest - lowest
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # A flat window has no defined position; report NaN instead of inf
+        return np.where(span > 0, 100.0 * (close - lowest) / span, np.nan)
+
+
+def _ewm_step(last, count, x, alpha, min_periods):
+    # Like `ewm`: a missing bar keeps the state but has no value of its own
+    if np.isnan(x):
+        return last, count, np.nan
+    value = x if np.isnan(last) else alpha * x + (1.0 - alpha) * last
+    count += 1
+    return value, count, (value if count >= min_periods else np.nan)
+
+
+def _tail_list(arr, n):
+    return [float(v) for v in np.asarray(arr)[-n:]] if n > 0 else []
@@ -0,0 +1,204 @@
+"""
+raw_corpus ingestion pipeline behind /api/fetch_raw.
+
+Every (stock code, source) pair is fetched concurrently on a thread pool, each
+with its own timeout, so one slow AkShare endpoint is dropped instead of holding
+up (or failing) the rest. Frames are converted column-wise: timestamps are parsed
+with one `pd.to_datetime` per frame instead of `strptime` per row. Duplicates are
+handled by near_dup: exact copies by the database's fingerprint key, reworded
+copies by the in-memory SimHash index.
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+
+from .metrics import FETCH_ERRORS, in_context, record
+from .near_dup import fingerprint, simhash, to_signed
+
+SOURCE_TIMEOUT = float(os.environ.get("FETCH_SOURCE_TIMEOUT", "15"))
+LOOKBACK_DAYS = 10
+
+
+def fetch_news(stock_code):
+    import akshare as ak
+    return ak.stock_news_em(symbol=stock_code)
+
+
+def fetch_reports(stock_code):
+    import akshare as ak
+    return ak.stock_research_report_em(symbol=stock_code)
+
+
+def _column(df, name, default):
+    if name in df.columns:
+        return df[name].fillna(default).astype(str)
+    import pandas as pd
+    return pd.Series(default, index=df.index, dtype=object)
+
+
+def _timestamps(values, fmt, now):
+    """
+    Parses a column in one pass; unparseable values fall back to `now`, as before.
+    """
+    import pandas as pd
+    return pd.to_datetime(values.astype(str), format=fmt, errors="coerce").fillna(pd.Timestamp(now))
+
+
+def _records(df, stock_code, source, titles, contents, pub, since, until=None):
+    keep = pub >= since
+    if until is not None:
+        keep &= pub < until
+    keep = keep.to_numpy()
+    return [
+        {
+            "stock_code": stock_code,
+            "source": source,
+            "title": title,
+            "content": content,
+            "publish_time": ts,
+            "is_analyzed": False,
+        }
+        for title, content, ts in zip(
+            titles[keep], contents[keep], pub[keep].dt.strftime("%Y-%m-%dT%H:%M:%S")
+        )
+    ]
+
+
+def news_records(df, stock_code, since, now=None, limit=20, until=None):
+    """
+    东方财富 news (latest `limit`, all when None) -> raw_corpus rows.
+    """
+    if limit:
+        df = df.head(limit)
+    if df.empty:
+        return []
+    pub = _timestamps(_column(df, "发布时间", ""), "%Y-%m-%d %H:%M:%S", now or datetime.now())
+    titles = _column(df, "新闻标题", "No Title")
+    contents = _column(df, "新闻内容", "")
+    contents = contents.where(contents != "", titles)
+    return _records(df, stock_code, "news", titles, contents, pub, since, until)
+
+
+def report_records(df, stock_code, since, now=None, limit=10, until=None):
+    """
+    Research reports (latest `limit`, all when None) -> raw_corpus rows.
+    """
+    if limit:
+        df = df.head(limit)
+    if df.empty:
+        return []
+    pub = _timestamps(_column(df, "日期", ""), "%Y-%m-%d", now or datetime.now())
+    titles = _column(df, "报告名称", "研报")
+    contents = "[" + _column(df, "研究机构", "") + "] " + titles + " - 评级: " + _column(df, "评级", "")
+    return _records(df, stock_code, "report", titles, contents, pub, since, until)
+
+
+# source name -> (AkShare fetcher, frame -> rows)
+SOURCES = {
+    "news": (fetch_news, news_records),
+    "report": (fetch_reports, report_records),
+}
+
+
+async def fetch_records(stock_codes, executor, sources=None, timeout=SOURCE_TIMEOUT, since=None):
+    """
+    Fetches every source for every code concurrently.
+    Returns (records, errors) where errors maps "code/source" to a message.
+    """
+    sources = sources or SOURCES
+    since = since or datetime.now() - timedelta(days=LOOKBACK_DAYS)
+    loop = asyncio.get_running_loop()
+
+    async def one(code, name, fetch, convert):
+        started = time.perf_counter()
+        try:
+            df = await asyncio.wait_for(loop.run_in_executor(executor, fetch, code), timeout)
+            record("fetch", time.perf_counter() - started)
+            return convert(df, code, since), None
+        except asyncio.TimeoutError:
+            # The pool thread finishes in the background; its result is discarded
+            FETCH_ERRORS.inc(source=name)
+            return [], f"timed out after {timeout:g}s"
+        except Exception as e:
+            FETCH_ERRORS.inc(source=name)
+            return [], str(e)
+
+    jobs = [(code, name) for code in stock_codes for name in sources]
+    outcomes = await asyncio.gather(*[one(code, name, *sources[name]) for code, name in jobs])
+
+    records, errors = [], {}
+    for (code, name), (rows, error) in zip(jobs, outcomes):
+        if error:
+            print(f"{name} fetch error for {code}: {error}")
+            errors[f"{code}/{name}"] = error
+        records.extend(rows)
+    return records, errors
+
+
+async def ingest(client, stock_codes, executor, sources=None, timeout=SOURCE_TIMEOUT, near_dups=None):
+    """
+    Fetches, drops exact duplicates (title fingerprint) and, given a NearDupIndex,
+    reworded copies of headlines already stored; then writes everything in one
+    upsert that ignores rows whose (stock_code, fingerprint) already exists.
+    Returns {"new_items", "inserted_ids", "near_duplicates", "per_stock", "source_errors"}.
+    """
+    stock_codes = list(dict.fromkeys(stock_codes))
+    loop = asyncio.get_running_loop()
+    # The near-dup index catches up on stored titles while the sources are fetched
+    refreshes = [
+        loop.run_in_executor(executor, in_context(near_dups.refresh), client, code) for code in stock_codes
+    ] if near_dups is not None else []
+    (records, errors), *_ = await asyncio.gather(
+        fetch_records(stock_codes, executor, sources, timeout), *refreshes
+    )
+
+    rows, near = dedupe(records, near_dups)
+    try:
+        inserted = await loop.run_in_executor(executor, in_context(lambda: store(client, rows))) if rows else []
+    except Exception:
+        # The rows' hashes are indexed but the rows are not stored
+        if near_dups is not None:
+            for code in {r["stock_code"] for r in rows}:
+                near_dups.forget(code)
+        raise
+
+    per_stock = {code: 0 for code in stock_codes}
+    for r in inserted:
+        per_stock[r["stock_code"]] += 1
+    return {"new_items": len(inserted), "inserted_ids": [r["id"] for r in inserted], "near_duplicates": near,
+            "per_stock": per_stock, "source_errors": errors}
+
+
+def dedupe(records, near_dups=None):
+    """
+    Drops repeated titles (same fingerprint) and, given a NearDupIndex, reworded
+    copies of titles it already holds. Returns (rows with fingerprint and simhash,
+    number of titles the index matched, identical hashes included).
+    """
+    rows, seen, near = {}, set(), 0
+    for r in records:
+        fp = fingerprint(r["title"])
+        if (r["stock_code"], fp) in seen:
+            continue
+        seen.add((r["stock_code"], fp))
+        value = simhash(r["title"])
+        match = near_dups.match_or_add(r["stock_code"], value) if near_dups is not None else None
+        if match is not None:
+            near += 1
+            continue
+        rows[(r["stock_code"], fp)] = {**r, "fingerprint": fp, "simhash": to_signed(value)}
+    return list(rows.values()), near
+
+
+def store(client, rows):
+    """
+    One upsert that skips rows whose (stock_code, fingerprint) already exists.
+    Returns the inserted rows.
+    """
+    res = (
+        client.table("raw_corpus")
+        .upsert(rows, on_conflict="stock_code,fingerprint", ignore_duplicates=True)
+        .execute()
+    )
+    return res.data or []
@@ -0,0 +1,195 @@
+"""
+Local Chinese financial sentiment lexicon scorer (first tier before the LLM).
+
+All lexicon terms, negators and intensifiers are compiled into one Aho-Corasick
+automaton, so a title is scanned once regardless of lexicon size; overlapping hits
+resolve leftmost-longest ("不及预期" beats "预期"). A negator or intensifier within
+a few characters before a term (same clause) flips or scales it; single-character
+ones ("不", "微", "超") only count right before the term or the next modifier, and
+ordinary words that contain them ("未来", "微软") are matched as blockers first. Scores are
+squashed into [-1, 1]; confidence grows with the amount of evidence and shrinks
+when positive and negative hits disagree, so the cascade only trusts clear calls.
+"""
+import math
+import os
+from collections import deque
+
+# term -> polarity weight
+POSITIVE = {
+    "涨停": 1.0, "大涨": 0.9, "暴涨": 1.0, "飙升": 0.9, "上涨": 0.6, "走高": 0.5, "反弹": 0.5, "拉升": 0.6,
+    "新高": 0.7, "创新高": 0.8, "突破": 0.5, "利好": 0.9, "重大利好": 1.0, "超预期": 0.9, "好于预期": 0.8,
+    "预增": 0.8, "扭亏": 0.8, "扭亏为盈": 0.9, "增长": 0.5, "同比增长": 0.6, "大增": 0.8, "翻倍": 0.8,
+    "盈利": 0.4, "净利润增长": 0.7, "营收增长": 0.6, "买入": 0.8, "增持": 0.7, "强烈推荐": 0.9, "推荐": 0.5,
+    "优于大市": 0.7, "跑赢": 0.6, "上调": 0.6, "上调评级": 0.8, "目标价上调": 0.8, "回购": 0.6, "分红": 0.4,
+    "中标": 0.6, "签约": 0.4, "订单饱满": 0.7, "获批": 0.6, "量产": 0.4, "放量": 0.3, "景气": 0.5,
+    "看好": 0.6, "看多": 0.7, "乐观": 0.5, "向好": 0.5, "改善": 0.4, "复苏": 0.5, "稳健": 0.3, "龙头": 0.3,
+    "资金流入": 0.5, "北向资金增持": 0.7, "机构调研": 0.2, "高送转": 0.6, "业绩亮眼": 0.8, "牛市": 0.7,
+}
+NEGATIVE = {
+    "跌停": -1.0, "大跌": -0.9, "暴跌": -1.0, "重挫": -0.9, "下跌": -0.6, "走低": -0.5, "跳水": -0.8,
+    "闪崩": -1.0, "新低": -0.7, "创新低": -0.8, "破发": -0.7, "跌破": -0.6, "利空": -0.9, "不及预期": -0.9,
+    "低于预期": -0.8, "预减": -0.8, "预亏": -0.9, "亏损": -0.7, "首亏": -0.8, "续亏": -0.8, "下滑": -0.6,
+    "下降": -0.4, "同比下降": -0.6, "大降": -0.8, "腰斩": -0.9, "卖出": -0.8, "减持": -0.7, "清仓": -0.8,
+    "减持计划": -0.7, "下调": -0.6, "下调评级": -0.8, "目标价下调": -0.8, "谨慎": -0.3,
+    "问询": -0.5, "问询函": -0.6, "监管函": -0.6, "立案": -0.9, "立案调查": -1.0, "处罚": -0.8,
+    "违规": -0.7, "造假": -1.0, "退市": -1.0, "风险警示": -0.8, "诉讼": -0.5, "冻结": -0.7, "质押": -0.3,
+    "爆雷": -1.0, "违约": -0.9, "商誉减值": -0.7, "减值": -0.5, "承压": -0.5, "看空": -0.7, "悲观": -0.5,
+    "疲软": -0.5, "低迷": -0.5, "恶化": -0.7, "资金流出": -0.5, "解禁": -0.4, "熊市": -0.7, "踩雷": -0.9,
+}
+NEGATORS = ["不", "未", "没有", "无", "非", "并未", "尚未", "否认", "难以", "不会", "不再"]
+INTENSIFIERS = {
+    "大幅": 1.5, "显著": 1.4, "明显": 1.3, "持续": 1.2, "进一步": 1.2, "超": 1.2, "强劲": 1.4,
+    "小幅": 0.6, "略": 0.6, "微": 0.5, "稍": 0.6, "有所": 0.8, "或": 0.7, "或将": 0.7, "可能": 0.7, "拟": 0.9,
+    "非常": 1.3,
+}
+# Words that contain a negator/intensifier character without being one; leftmost-longest
+# matching consumes them so "未来业绩增长" is not read as "未 ... 增长"
+BLOCKERS = [
+    "无人机", "无线", "无锡", "无论", "未来", "不断", "不少", "不仅", "不同", "不过", "非洲", "非农",
+    "非银", "微软", "微信", "微博", "微盘", "微电子", "超市", "超级", "超导", "超声", "或者", "拟定",
+]
+CLAUSE_BREAKS = set("，。；！？,.;!?、:：|/\n")
+MODIFIER_WINDOW = 4  # characters a negator/intensifier may precede its term by
+
+NEGATION_DISCOUNT = 0.6
+
+# Minimum confidence for the cascade to keep a lexicon score instead of asking the LLM
+CONFIDENCE_THRESHOLD = float(os.environ.get("LEXICON_CONFIDENCE", "0.6"))
+
+
+class Automaton:
+    """
+    Aho-Corasick automaton over str patterns, each carrying a payload.
+    """
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]  # state -> [(pattern length, payload)]
+        for pattern, payload in patterns.items():
+            state = 0
+            for ch in pattern:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = nxt
+            self.out[state].append((len(pattern), payload))
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def matches(self, text):
+        """
+        Leftmost-longest, non-overlapping (start, end, payload) matches.
+        """
+        goto, fail, out = self.goto, self.fail, self.out
+        found = []
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, payload in out[state]:
+                found.append((i + 1 - length, i + 1, payload))
+        found.sort(key=lambda m: (m[0], m[0] - m[1]))
+        chosen, end = [], 0
+        for start, stop, payload in found:
+            if start >= end:
+                chosen.append((start, stop, payload))
+                end = stop
+        return chosen
+
+
+def _compile():
+    patterns = {t: ("word", 0.0) for t in BLOCKERS}
+    patterns.update({t: ("neg", 0.0) for t in NEGATORS})
+    patterns.update({t: ("int", w) for t, w in INTENSIFIERS.items()})
+    patterns.update({t: ("term", w) for t, w in POSITIVE.items()})
+    patterns.update({t: ("term", w) for t, w in NEGATIVE.items()})
+    return Automaton(patterns)
+
+
+_AUTOMATON = _compile()
+
+
+def score_text(text):
+    """
+    Returns (score, confidence, matched terms) for one text.
+    """
+    text = text or ""
+    hits = _AUTOMATON.matches(text)
+    pos = neg = 0.0
+    negated = False
+    terms = []
+    modifiers = []  # (end, clause, kind, weight, start) of negators/intensifiers since the last term
+    clause = [0] * (len(text) + 1)  # clause index at each position
+    for i, ch in enumerate(text):
+        clause[i + 1] = clause[i] + (ch in CLAUSE_BREAKS)
+    for start, stop, (kind, weight) in hits:
+        if modifiers and modifiers[-1][0] - modifiers[-1][4] == 1 and modifiers[-1][0] != start:
+            # A single-character modifier not directly followed by this hit
+            modifiers.pop()
+        if kind == "word":
+            continue
+        if kind != "term":
+            modifiers.append((stop, clause[stop], kind, weight, start))
+            continue
+        value = weight
+        for end, mclause, mkind, mweight, _ in modifiers:
+            if mclause == clause[start] and start - end <= MODIFIER_WINDOW:
+                negated |= mkind == "neg"
+                value = -0.8 * value if mkind == "neg" else value * mweight
+        modifiers = []
+        if value > 0:
+            pos += value
+        elif value < 0:
+            neg -= value
+        if value:
+            terms.append(text[start:stop])
+
+    total = pos + neg
+    if total == 0:
+        return 0.0, 0.0, terms
+    net = pos - neg
+    score = math.tanh(net)
+    agreement = abs(net) / total
+    evidence = 1 - math.exp(-total / 0.6)
+    # Negated phrasing ("否认违规", "未大幅下滑") is where a lexicon is least reliable
+    confidence = agreement * evidence * (NEGATION_DISCOUNT if negated else 1.0)
+    return round(score, 3), round(confidence, 3), terms
+
+
+def score_texts(texts):
+    """
+    Batch form of score_text.
+    """
+    return [score_text(t) for t in texts]
+
+
+def term_spans(text):
+    """
+    (start, end) of every lexicon term in `text` (negators/intensifiers excluded).
+    """
+    return [(start, stop) for start, stop, (kind, _) in _AUTOMATON.matches(text or "") if kind == "term"]
+
+
+def confident(confidence, threshold=None):
+    return confidence >= (CONFIDENCE_THRESHOLD if threshold is None else threshold)
+
+
+def summarize(score, terms):
+    tone = "偏多" if score > 0.1 else "偏空" if score < -0.1 else "中性"
+    hits = "、".join(dict.fromkeys(terms)) if terms else "无明显情绪词"
+    return f"[词典] 情绪{tone}，命中: {hits}"
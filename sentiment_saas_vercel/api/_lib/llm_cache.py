@@ -0,0 +1,140 @@
+"""
+Content-hash keyed cache of LLM sentiment results.
+
+The key is a SHA-256 over (prompt version, source, the text `prompt.fit` sends),
+so the same headline filed under several stock codes and repeated research-report
+blurbs reuse one model call, while a long article trimmed around one stock's
+code is keyed by what that stock's prompt actually contained. Results that
+`cleanup_data` rejects are invalidated so their re-analysis really reaches the
+model. Two tiers:
+
+- local: per-process LRU dict (warm serverless instances, the worker)
+- shared: the `llm_cache` table, read with one `in_` query per batch and written
+  with one upsert, so every instance benefits from every other instance's calls.
+  Users may only read it; writes go through the service-role `writer` client.
+
+Bumping the prompt changes `PROMPT_VERSION`, which changes every key; a full
+cleanup_data run drops the stale rows (`purge_stale_versions`).
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from . import prompt
+from .sentiment import PROMPT_VERSION
+
+
+def content_key(source, text, version=PROMPT_VERSION):
+    """
+    `text` is the item's prompt text (already normalized by prompt.fit).
+    """
+    raw = "\x1f".join([version, source or "", text])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Two-tier result cache. `client` arguments are Supabase clients; pass None to
+    use the local tier only. `writer`, when given, is a zero-argument callable
+    returning the client for shared-tier writes (None skips them); otherwise
+    writes use the `client` passed in, as the service-role worker does.
+    """
+
+    def __init__(self, max_local=4096, table="llm_cache", version=PROMPT_VERSION, writer=None):
+        self.max_local = max_local
+        self.table = table
+        self.version = version
+        self.writer = writer
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key_for(self, item):
+        """
+        Trimming depends on the stock (sentences quoting its code are kept), so
+        `item` needs stock_code as well as source/title/content.
+        """
+        return content_key(item.get("source"), prompt.fit(item, record=False).text, self.version)
+
+    def get_many(self, client, keys):
+        """
+        Returns {key: {"score", "summary"}} for every key found in either tier.
+        """
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                value = self._local.get(key)
+                if value is not None:
+                    self._local.move_to_end(key)
+                    found[key] = value
+                else:
+                    missing.append(key)
+
+        if missing and client is not None:
+            try:
+                res = client.table(self.table).select("key, score, summary").in_("key", missing).execute()
+                remote = {r["key"]: {"score": r["score"], "summary": r["summary"]} for r in (res.data or [])}
+                self._remember(remote)
+                found.update(remote)
+            except Exception as e:
+                # The cache is an optimization; a failing shared tier only costs model calls
+                print(f"LLM cache read failed: {e}")
+        return found
+
+    def put_many(self, client, entries):
+        """
+        Stores {key: {"score", "summary"}} in both tiers.
+        """
+        self._remember(entries)
+        client = self._write_client(client)
+        if client is None or not entries:
+            return
+        rows = [
+            {"key": key, "prompt_version": self.version, "score": v["score"], "summary": v["summary"]}
+            for key, v in entries.items()
+        ]
+        try:
+            client.table(self.table).upsert(rows, on_conflict="key").execute()
+        except Exception as e:
+            print(f"LLM cache write failed: {e}")
+
+    def invalidate(self, client, keys):
+        """
+        Drops keys from both tiers (e.g. results that cleanup_data rejected).
+        """
+        keys = list(keys)
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+        client = self._write_client(client)
+        if client is not None and keys:
+            try:
+                client.table(self.table).delete().in_("key", keys).execute()
+            except Exception as e:
+                print(f"LLM cache invalidate failed: {e}")
+
+    def purge_stale_versions(self, client):
+        """
+        Deletes shared entries written under any other prompt version.
+        Returns the number of entries deleted.
+        """
+        client = self._write_client(client)
+        if client is None:
+            return 0
+        try:
+            res = client.table(self.table).delete().neq("prompt_version", self.version).execute()
+            return len(res.data or [])
+        except Exception as e:
+            print(f"LLM cache purge failed: {e}")
+            return 0
+
+    def _write_client(self, client):
+        return self.writer() if self.writer is not None else client
+
+    def _remember(self, entries):
+        with self._lock:
+            for key, value in entries.items():
+                self._local[key] = value
+                self._local.move_to_end(key)
+            while len(self._local) > self.max_local:
+                self._local.popitem(last=False)
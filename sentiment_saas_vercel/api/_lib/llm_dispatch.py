@@ -0,0 +1,308 @@
+"""
+Shared dispatcher for every DeepSeek call (sentiment scoring, packed scoring,
+technical commentary, the analysis worker).
+
+- One pooled `AsyncOpenAI` client per API key / base URL (per event loop), instead
+  of a new client and TLS handshake per item.
+- An AIMD concurrency window per event loop (its waiters share that loop's
+  Condition): +1/limit per healthy call, halved on 429 / 5xx / timeouts, trimmed
+  when latency climbs well above its running baseline.
+- `Retry-After` on a 429 pauses every caller, not just the one that was throttled.
+- Token buckets (estimated prompt + output tokens per minute) per API key and per
+  user; user buckets that have refilled are dropped once there are many of them.
+- Failures are retried with backoff and finally raised as `LLMUnavailable`, so
+  callers can report them instead of silently dropping the item.
+- Each attempt is recorded as an "llm" stage with its outcome and token usage.
+"""
+import asyncio
+import contextvars
+import os
+import random
+import re
+import threading
+import time
+
+from .metrics import LLM_CALLS, LLM_TOKENS, record
+
+DEFAULT_BASE_URL = "https://api.deepseek.com/v1"
+
+# User on whose behalf the current request calls the LLM (set by API handlers)
+current_llm_user = contextvars.ContextVar("current_llm_user", default=None)
+
+_CJK = re.compile(r"[　-鿿＀-￯]")
+
+
+class LLMUnavailable(Exception):
+    """Raised when a call still fails after all retries."""
+
+
+def estimate_tokens(text):
+    """
+    Rough token count: ~1 token per CJK character, ~4 characters per token otherwise.
+    """
+    text = text or ""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class TokenBucket:
+    """
+    Refills `rate_per_minute` tokens per minute up to `capacity`; `acquire` waits
+    until the requested cost is available.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self, cost):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            cost = min(cost, self.capacity)
+            if self.tokens >= cost:
+                self.tokens -= cost
+                return 0.0
+            return (cost - self.tokens) / self.rate
+
+    def is_full(self):
+        """
+        True once the bucket has refilled; it then behaves exactly like a new one.
+        """
+        with self._lock:
+            return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+    async def acquire(self, cost):
+        while True:
+            wait = self._take(cost)
+            if wait <= 0:
+                return
+            await asyncio.sleep(min(wait, 5.0))
+
+
+class AIMDWindow:
+    """
+    Concurrency limit that grows additively while calls are healthy and shrinks
+    multiplicatively on overload signals.
+    """
+
+    def __init__(self, initial=8, minimum=1, maximum=64, decrease=0.5, latency_factor=2.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.in_flight = 0
+        self.baseline = None
+        self.samples = 0
+        self._last_cut = 0.0
+
+    def has_room(self):
+        return self.in_flight < int(self.limit)
+
+    def on_success(self, latency):
+        self.samples += 1
+        if self.baseline is None:
+            self.baseline = latency
+        slow = self.samples > 10 and latency > self.latency_factor * self.baseline
+        self.baseline += 0.05 * (latency - self.baseline)
+        if slow:
+            self.limit = max(self.minimum, self.limit * 0.9)
+        else:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_overload(self):
+        # One cut per window's worth of time, so a burst of 429s doesn't collapse it to 1
+        now = time.monotonic()
+        if now - self._last_cut > 1.0:
+            self.limit = max(self.minimum, self.limit * self.decrease)
+            self._last_cut = now
+
+
+class LLMDispatcher:
+    def __init__(self, api_key, base_url=DEFAULT_BASE_URL, initial_limit=8, max_limit=64,
+                 max_retries=3, timeout=60.0, key_tokens_per_minute=None, user_tokens_per_minute=None,
+                 max_user_buckets=1024):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.initial_limit = initial_limit
+        self.max_limit = max_limit
+        self.max_user_buckets = max_user_buckets
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.key_bucket = TokenBucket(key_tokens_per_minute or int(os.environ.get("LLM_KEY_TPM", "1000000")))
+        self.user_tpm = user_tokens_per_minute or int(os.environ.get("LLM_USER_TPM", "200000"))
+        self.user_buckets = {}
+        self.paused_until = 0.0
+        self.stats = {"calls": 0, "retries": 0, "rate_limited": 0, "server_errors": 0, "timeouts": 0, "failed": 0}
+        self._loop_state = {}  # id(loop) -> (loop, client, condition, window)
+        self._guard = threading.Lock()
+
+    # --- Public API ---
+
+    async def chat(self, messages, user=None, **kwargs):
+        """
+        `client.chat.completions.create(messages=..., **kwargs)` through the window,
+        buckets and retry policy. Returns the completion or raises LLMUnavailable.
+        """
+        import openai
+
+        user = user or current_llm_user.get()
+        cost = sum(estimate_tokens(m.get("content", "")) for m in messages) + kwargs.get("max_tokens", 300)
+        await self.key_bucket.acquire(cost)
+        if user:
+            await self._user_bucket(user).acquire(cost)
+
+        client, cond, window = self._state()
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_pause()
+            async with cond:
+                await cond.wait_for(window.has_room)
+                window.in_flight += 1
+            started = time.monotonic()
+            outcome = "failed"
+            try:
+                self.stats["calls"] += 1
+                completion = await client.chat.completions.create(messages=messages, **kwargs)
+                window.on_success(time.monotonic() - started)
+                outcome = "ok"
+                _count_tokens(completion)
+                return completion
+            except openai.RateLimitError as e:
+                self.stats["rate_limited"] += 1
+                outcome = "rate_limited"
+                window.on_overload()
+                self._pause(_retry_after(e))
+                last_error = e
+            except openai.APITimeoutError as e:
+                self.stats["timeouts"] += 1
+                outcome = "timeout"
+                window.on_overload()
+                last_error = e
+            except openai.APIStatusError as e:
+                if e.status_code < 500:
+                    self.stats["failed"] += 1
+                    raise LLMUnavailable(str(e)) from e
+                self.stats["server_errors"] += 1
+                outcome = "server_error"
+                window.on_overload()
+                last_error = e
+            except openai.APIConnectionError as e:
+                self.stats["server_errors"] += 1
+                outcome = "server_error"
+                last_error = e
+            finally:
+                record("llm", time.monotonic() - started)
+                LLM_CALLS.inc(outcome=outcome)
+                async with cond:
+                    window.in_flight -= 1
+                    cond.notify_all()
+            if attempt < self.max_retries:
+                self.stats["retries"] += 1
+                await asyncio.sleep(min(0.5 * 2 ** attempt, 8.0) * (0.5 + random.random()))
+        self.stats["failed"] += 1
+        raise LLMUnavailable(str(last_error))
+
+    def cap(self, limit):
+        """
+        Caps in-flight calls per event loop (the worker jobs' --concurrency).
+        """
+        with self._guard:
+            self.max_limit = limit
+            for _, _, _, window in self._loop_state.values():
+                window.maximum = limit
+                window.limit = min(window.limit, float(limit))
+
+    def snapshot(self):
+        with self._guard:
+            windows = [state[3] for state in self._loop_state.values() if not state[0].is_closed()]
+        return {**self.stats, "limit": round(sum(w.limit for w in windows), 2),
+                "in_flight": sum(w.in_flight for w in windows)}
+
+    # --- Internals ---
+
+    def _state(self):
+        from openai import AsyncOpenAI
+        loop = asyncio.get_running_loop()
+        with self._guard:
+            state = self._loop_state.get(id(loop))
+            if state is None or state[0] is not loop:
+                # Loops that have finished (asyncio.run per job, tests) take their clients with them
+                for key in [k for k, s in self._loop_state.items() if s[0].is_closed()]:
+                    del self._loop_state[key]
+                # Retries are ours; the SDK's own retries would hide 429s from the window
+                client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url,
+                                     timeout=self.timeout, max_retries=0)
+                window = AIMDWindow(initial=min(self.initial_limit, self.max_limit), maximum=self.max_limit)
+                state = (loop, client, asyncio.Condition(), window)
+                self._loop_state[id(loop)] = state
+            return state[1:]
+
+    def _user_bucket(self, user):
+        with self._guard:
+            bucket = self.user_buckets.get(user)
+            if bucket is None:
+                if len(self.user_buckets) >= self.max_user_buckets:
+                    for idle in [u for u, b in self.user_buckets.items() if b.is_full()]:
+                        del self.user_buckets[idle]
+                bucket = self.user_buckets[user] = TokenBucket(self.user_tpm)
+            return bucket
+
+    def _pause(self, seconds):
+        if seconds:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def _wait_for_pause(self):
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def cached_prompt_tokens(usage):
+    """
+    Prompt tokens served from the provider's prefix cache: DeepSeek reports
+    `prompt_cache_hit_tokens`, OpenAI `prompt_tokens_details.cached_tokens`.
+    """
+    hit = getattr(usage, "prompt_cache_hit_tokens", None)
+    if hit is None:
+        hit = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+    return hit or 0
+
+
+def _count_tokens(completion):
+    usage = getattr(completion, "usage", None)
+    if usage is not None:
+        LLM_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, kind="prompt")
+        LLM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, kind="completion")
+        LLM_TOKENS.inc(cached_prompt_tokens(usage), kind="cached")
+
+
+def _retry_after(error):
+    try:
+        value = error.response.headers.get("retry-after")
+        return min(float(value), 60.0) if value is not None else 1.0
+    except (AttributeError, TypeError, ValueError):
+        return 1.0
+
+
+_dispatchers = {}
+_dispatchers_lock = threading.Lock()
+
+
+def get_dispatcher(api_key=None, base_url=None):
+    """
+    Process-wide dispatcher for the configured key/base URL (read at call time,
+    so benchmarks can point it at a mock server).
+    """
+    api_key = api_key or os.environ.get("DEEPSEEK_API_KEY")
+    base_url = base_url or os.environ.get("DEEPSEEK_BASE_URL", DEFAULT_BASE_URL)
+    with _dispatchers_lock:
+        dispatcher = _dispatchers.get((api_key, base_url))
+        if dispatcher is None:
+            dispatcher = _dispatchers[(api_key, base_url)] = LLMDispatcher(api_key, base_url)
+        return dispatcher
@@ -0,0 +1,239 @@
+"""
+Per-request stage timings and process-wide Prometheus metrics.
+
+Code on the request path wraps its expensive steps in `stage("db" | "llm" |
+"parse" | "fetch")` (or calls `record`). Each sample lands in two places:
+
+- the current request's `RequestTimings` (a ContextVar, so asyncio tasks and -
+  via `in_context` - worker threads started by the request share it), which
+  `TimingMiddleware` turns into a `Server-Timing` header;
+- the `stage_duration_seconds` histogram, served with the other metrics in the
+  Prometheus text format by /api/metrics.
+
+Stages can overlap (parallel queries, concurrent LLM calls), so their durations
+may add up to more than `total`. For streamed responses the header only covers
+the work done before the first byte. Metrics are per instance: on Vercel each
+warm function instance reports its own.
+"""
+import contextvars
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+# --- Metric types ---
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{self._labels(key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render_value(self, key, state):
+        counts, total, n = state
+        lines = [f"{self.name}_bucket{self._labels(key, {'le': bound})} {c}" for bound, c in zip(self.buckets, counts)]
+        lines.append(f"{self.name}_bucket{self._labels(key, {'le': '+Inf'})} {n}")
+        lines.append(f"{self.name}_sum{self._labels(key)} {round(total, 6)}")
+        lines.append(f"{self.name}_count{self._labels(key)} {n}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._add(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self):
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time to the first response byte, per route.", ["route", "method", "status"])
+STAGE_SECONDS = REGISTRY.histogram(
+    "stage_duration_seconds", "Time spent per stage (db, llm, parse, fetch).", ["stage"])
+LLM_CALLS = REGISTRY.counter("llm_calls_total", "LLM call attempts by outcome.", ["outcome"])
+LLM_TOKENS = REGISTRY.counter("llm_tokens_total", "LLM tokens reported in completion usage.", ["kind"])
+PROMPT_TRIMMED_TOKENS = REGISTRY.counter(
+    "prompt_trimmed_tokens_total", "Estimated item tokens dropped to fit the per-item prompt budget.")
+PARSE_FAILURES = REGISTRY.counter(
+    "llm_parse_failures_total", "LLM replies (single) or packed entries (packed_item) that could not be parsed.", ["kind"])
+FETCH_ERRORS = REGISTRY.counter("data_source_errors_total", "Failed or timed-out data-source fetches.", ["source"])
+LLM_WINDOW = REGISTRY.gauge("llm_dispatch", "LLM dispatcher state (in_flight, concurrency limit).", ["field"])
+
+
+# --- Request timings ---
+
+class RequestTimings:
+    """
+    Stage totals for one request; shared by its tasks and worker threads.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}  # name -> [seconds, count]
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, count=1):
+        with self._lock:
+            entry = self.stages.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += count
+
+    def server_timing(self):
+        with self._lock:
+            parts = [f'{name};dur={seconds * 1000:.1f};desc="{count}x"'
+                     for name, (seconds, count) in self.stages.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+def record(name, seconds, count=1):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds, count)
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def in_context(fn):
+    """
+    Binds `fn` to the caller's context, for work handed to a thread pool
+    (run_in_executor / submit do not carry ContextVars over by themselves).
+    """
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+# --- ASGI middleware ---
+
+class TimingMiddleware:
+    """
+    Opens a RequestTimings per HTTP request, adds `Server-Timing` to the response
+    and observes `http_request_duration_seconds`. With PROFILE_REQUESTS=1, a request
+    carrying `X-Profile: 1` is also sampled by the profiler and answered with an
+    `X-Profile-File` header naming the collapsed-stack output.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        session = None
+        if os.environ.get("PROFILE_REQUESTS") == "1" and (b"x-profile", b"1") in scope.get("headers", []):
+            from .profiler import ProfileSession
+            session = ProfileSession(scope.get("path", "")).start()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                route = getattr(scope.get("route"), "path", "unmatched")
+                REQUEST_SECONDS.observe(time.perf_counter() - timings.started, route=route,
+                                        method=scope.get("method", ""), status=message["status"])
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.server_timing().encode()))
+                if session is not None:
+                    headers.append((b"x-profile-file", session.path.name.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            if session is not None:
+                session.stop()
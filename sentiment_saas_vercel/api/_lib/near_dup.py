@@ -0,0 +1,165 @@
+"""
+Exact and near-duplicate detection for raw_corpus titles.
+
+- `fingerprint`: SHA-256 of the normalized title. raw_corpus has a unique index on
+  (stock_code, fingerprint), so ingestion is one upsert with `ignore_duplicates`
+  and concurrent fetches can't race duplicates in.
+- `simhash`: 64-bit SimHash over the title's character bigrams (punctuation and
+  spacing dropped). Outlets rewording the same headline land within a few bits of
+  each other, while a one-character change such as 涨停/跌停 alters two features.
+- `NearDupIndex`: per-stock in-memory SimHash index, split into 4 bands of 16 bits.
+  Two hashes within `max_distance` <= 3 bits must agree on at least one band, so a
+  lookup only compares against the hashes sharing a band. It is loaded from the
+  `simhash` column, a page at a time, and then refreshed incrementally past a
+  created_at high-water mark.
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from .text import normalize_text
+
+_NON_WORD = re.compile(r"[\W_]+")
+_BITS = np.arange(64, dtype=np.uint64)
+BANDS = 4
+BAND_BITS = 64 // BANDS
+SHINGLE = 2
+PAGE_SIZE = 1000  # PostgREST's default row cap
+
+
+def fingerprint(title):
+    return hashlib.sha256(normalize_text(title).lower().encode("utf-8")).hexdigest()
+
+
+def simhash(text):
+    """
+    64-bit SimHash of a short text, using overlapping character bigrams as
+    features (single characters let antonymous headlines collide).
+    """
+    chars = _NON_WORD.sub("", normalize_text(text).lower())
+    if not chars:
+        return 0
+    shingles = [chars[i:i + SHINGLE] for i in range(max(1, len(chars) - SHINGLE + 1))]
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in shingles],
+        dtype=np.uint64,
+    )
+    bits = ((hashes[:, None] >> _BITS) & np.uint64(1)).astype(np.int64)
+    votes = (2 * bits - 1).sum(axis=0)
+    return int(((votes > 0).astype(np.uint64) << _BITS).sum())
+
+
+def to_signed(value):
+    """
+    Unsigned 64-bit hash -> Postgres bigint.
+    """
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class _StockIndex:
+    def __init__(self):
+        self.bands = [dict() for _ in range(BANDS)]  # band value -> set of hashes
+        self.high_water = None  # newest created_at loaded from the database
+        self.refreshed = 0.0
+
+    def add(self, value):
+        for i, band in enumerate(self.bands):
+            band.setdefault((value >> (i * BAND_BITS)) & 0xFFFF, set()).add(value)
+
+    def find(self, value, max_distance):
+        for i, band in enumerate(self.bands):
+            for other in band.get((value >> (i * BAND_BITS)) & 0xFFFF, ()):
+                if hamming(value, other) <= max_distance:
+                    return other
+        return None
+
+
+class NearDupIndex:
+    """
+    Per-stock SimHash index over the last `window_days` of raw_corpus. Stocks are
+    kept in an LRU of `max_stocks`; each is refreshed at most every `refresh_seconds`.
+    """
+
+    def __init__(self, max_distance=3, window_days=30, refresh_seconds=30, max_stocks=512):
+        self.max_distance = max_distance
+        self.window_days = window_days
+        self.refresh_seconds = refresh_seconds
+        self.max_stocks = max_stocks
+        self._stocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _stock(self, stock_code):
+        with self._lock:
+            index = self._stocks.get(stock_code)
+            if index is None:
+                index = self._stocks[stock_code] = _StockIndex()
+                while len(self._stocks) > self.max_stocks:
+                    self._stocks.popitem(last=False)
+            self._stocks.move_to_end(stock_code)
+            return index
+
+    def refresh(self, client, stock_code, page_size=PAGE_SIZE):
+        """
+        Loads rows created since the last refresh (or the whole window on first use),
+        `page_size` rows per request.
+        """
+        index = self._stock(stock_code)
+        if client is None or time.monotonic() - index.refreshed < self.refresh_seconds:
+            return
+        since = index.high_water or (datetime.now(timezone.utc) - timedelta(days=self.window_days)).isoformat()
+        rows, start = [], 0
+        try:
+            while True:
+                # One batch upsert shares a created_at, so page by offset rather than by timestamp
+                page = (
+                    client.table("raw_corpus").select("simhash, created_at")
+                    .eq("stock_code", stock_code).gt("created_at", since)
+                    .order("created_at").order("id").range(start, start + page_size - 1).execute()
+                ).data or []
+                rows.extend(page)
+                if len(page) < page_size:
+                    break
+                start += page_size
+        except Exception as e:
+            # Exact dedupe still happens in the database; only near-dup recall suffers
+            print(f"Near-dup index refresh failed for {stock_code}: {e}")
+            return
+        with self._lock:
+            for row in rows:
+                if row.get("simhash") is not None:
+                    index.add(to_unsigned(row["simhash"]))
+                index.high_water = row["created_at"]
+            index.refreshed = time.monotonic()
+
+    def forget(self, stock_code):
+        """
+        Drops a stock's index (e.g. after hashes were added for rows that never got
+        stored); the next refresh reloads it from the database.
+        """
+        with self._lock:
+            self._stocks.pop(stock_code, None)
+
+    def match_or_add(self, stock_code, value):
+        """
+        Returns an indexed hash within `max_distance` of `value`, or indexes
+        `value` and returns None if there is none.
+        """
+        index = self._stock(stock_code)
+        with self._lock:
+            match = index.find(value, self.max_distance)
+            if match is None:
+                index.add(value)
+            return match
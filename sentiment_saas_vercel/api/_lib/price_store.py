@@ -0,0 +1,346 @@
+"""
+Local OHLCV history store shared by /api/stock_price and /api/technical_indicators.
+
+Each symbol is kept as a directory holding versions of its `.npy` column files
+plus a small `meta.json` naming the current version. A save writes a new version
+and then swaps `meta.json` in with one atomic rename, so a reader never mixes
+columns from two saves. Columns are memory-mapped on read, so a `tail(days)` slice
+never touches AkShare once the symbol is fresh. Refreshes only ask AkShare for
+bars from the last stored date onwards, and the overlapping bar is used to detect
+a qfq re-adjustment (ex-dividend / split), in which case the whole series is
+rebuilt. Freshness follows the exchange's trading calendar, so holidays do not
+count as sessions.
+"""
+import json
+import os
+import pathlib
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from .metrics import FETCH_ERRORS, stage
+
+# AkShare `stock_zh_a_hist` column names -> stored column names
+COLUMN_MAP = {
+    "日期": "date",
+    "开盘": "open",
+    "收盘": "close",
+    "最高": "high",
+    "最低": "low",
+    "成交量": "volume",
+    "成交额": "amount",
+    "振幅": "amplitude",
+    "涨跌幅": "change_pct",
+    "涨跌额": "change_amt",
+    "换手率": "turnover",
+}
+FLOAT_COLUMNS = ["open", "close", "high", "low", "amount", "amplitude", "change_pct", "change_amt", "turnover"]
+COLUMNS = ["date", "volume"] + FLOAT_COLUMNS
+
+CST = timezone(timedelta(hours=8))
+MARKET_CLOSE_HOUR = 15
+# Relative close difference on the overlapping bar that counts as a qfq re-adjustment
+QFQ_TOLERANCE = 1e-4
+# A failed trading-calendar download is retried after this long (weekdays stand in meanwhile)
+CALENDAR_RETRY = timedelta(hours=1)
+
+
+def is_trading_day(day, trade_dates=None):
+    """
+    `trade_dates` is a sorted datetime64[D] array of sessions; days outside its
+    range (or without one) count as sessions on Monday to Friday.
+    """
+    if trade_dates is not None and len(trade_dates):
+        d = np.datetime64(day, "D")
+        if trade_dates[0] <= d <= trade_dates[-1]:
+            return bool(trade_dates[np.searchsorted(trade_dates, d)] == d)
+    return day.weekday() < 5
+
+
+def last_session_close(now=None, trade_dates=None):
+    """
+    Returns the most recent A-share session close (15:00 CST on a trading day).
+    Bars fetched after this instant are final until the next close.
+    """
+    now = (now or datetime.now(CST)).astimezone(CST)
+    close = now.replace(hour=MARKET_CLOSE_HOUR, minute=0, second=0, microsecond=0)
+    if now < close:
+        close -= timedelta(days=1)
+    while not is_trading_day(close.date(), trade_dates):
+        close -= timedelta(days=1)
+    return close
+
+
+def akshare_trade_dates():
+    """
+    Default calendar: SSE trading days from AkShare (published through the current year).
+    """
+    import akshare as ak
+    df = ak.tool_trade_date_hist_sina()
+    return np.asarray(df["trade_date"].astype(str).str[:10], dtype="datetime64[D]")
+
+
+def akshare_fetcher(symbol, start_date=None):
+    """
+    Default upstream: forward-adjusted daily bars from AkShare.
+    `start_date` is inclusive, formatted YYYYMMDD.
+    """
+    import akshare as ak
+    if start_date:
+        return ak.stock_zh_a_hist(symbol=symbol, period="daily", adjust="qfq", start_date=start_date)
+    return ak.stock_zh_a_hist(symbol=symbol, period="daily", adjust="qfq")
+
+
+def frame_to_columns(df):
+    """
+    Converts an AkShare history frame into contiguous column arrays.
+    """
+    df = df.rename(columns=COLUMN_MAP)
+    cols = {"date": np.asarray(df["date"].astype(str).str[:10], dtype="datetime64[D]")}
+    cols["volume"] = np.ascontiguousarray(df["volume"].to_numpy(dtype=np.int64))
+    for name in FLOAT_COLUMNS:
+        cols[name] = np.ascontiguousarray(df[name].to_numpy(dtype=np.float64))
+    return cols
+
+
+class PriceStore:
+    """
+    Per-symbol price history backed by memory-mapped column files.
+
+    - `tail(symbol, days)` serves the last N bars, refreshing at most once per session close.
+    - Concurrent callers for the same symbol share one upstream fetch.
+    - If AkShare fails and a stored series exists, the stale series is served.
+    - `calendar` returns the trading days (None: weekdays only); it is kept in
+      `root/trade_dates.npy` and reloaded once today passes its last day.
+    """
+
+    def __init__(self, root, fetcher=akshare_fetcher, max_cached=256, calendar=akshare_trade_dates):
+        self.root = pathlib.Path(root)
+        self.fetcher = fetcher
+        self.max_cached = max_cached
+        self.calendar = calendar
+        self._cache = OrderedDict()  # symbol -> (columns, checked_at)
+        self._locks = {}
+        self._guard = threading.Lock()
+        self._trade_dates = None
+        self._calendar_tried = None
+        self._calendar_lock = threading.Lock()
+        self.upstream_fetches = 0
+
+    # --- Public API ---
+
+    def tail(self, symbol, days):
+        """
+        Returns the last `days` bars as a DataFrame with English column names
+        and `date` formatted as YYYY-MM-DD.
+        """
+        import pandas as pd
+        cols = self.history(symbol)
+        sliced = {name: np.asarray(arr[-days:]) if days > 0 else np.asarray(arr[:0]) for name, arr in cols.items()}
+        df = pd.DataFrame({name: sliced[name] for name in COLUMNS})
+        df["date"] = np.datetime_as_string(sliced["date"], unit="D")
+        return df[["date", "open", "close", "high", "low", "volume", "amount", "amplitude", "change_pct", "change_amt", "turnover"]]
+
+    def history(self, symbol):
+        """
+        Returns the full column dict for a symbol, refreshing it first if stale.
+        """
+        cached = self._cached(symbol)
+        if cached and not self._is_stale(cached[1]):
+            return cached[0]
+
+        with self._lock_for(symbol):
+            # Another caller may have refreshed while we waited on the lock
+            cached = self._cached(symbol) or self._load(symbol)
+            if cached and not self._is_stale(cached[1]):
+                self._remember(symbol, cached)
+                return cached[0]
+            cols = self._refresh(symbol, cached[0] if cached else None)
+            return cols
+
+    def rebuild(self, symbol):
+        """
+        Drops the stored series and downloads the full history again.
+        """
+        with self._lock_for(symbol):
+            return self._refresh(symbol, None)
+
+    def trade_dates(self):
+        """
+        The trading calendar as a sorted datetime64[D] array, or None while it is
+        unavailable (see `CALENDAR_RETRY`).
+        """
+        today = np.datetime64(datetime.now(CST).date(), "D")
+        dates = self._trade_dates
+        if self.calendar is None or (dates is not None and today <= dates[-1]):
+            return dates
+        with self._calendar_lock:
+            dates = self._trade_dates
+            if dates is not None and today <= dates[-1]:
+                return dates
+            now = datetime.now(CST)
+            if self._calendar_tried and now - self._calendar_tried < CALENDAR_RETRY:
+                return dates
+            self._calendar_tried = now
+            path = self.root / "trade_dates.npy"
+            if dates is None:
+                try:
+                    dates = np.load(path)
+                except (OSError, ValueError):
+                    dates = None
+                if dates is not None and len(dates) and today <= dates[-1]:
+                    self._trade_dates = dates
+                    return dates
+            try:
+                fresh = np.sort(np.asarray(self.calendar(), dtype="datetime64[D]"))
+                if not len(fresh):
+                    raise ValueError("empty trading calendar")
+                self.root.mkdir(parents=True, exist_ok=True)
+                tmp = self.root / f".trade_dates.{os.getpid()}.npy.tmp"
+                with open(tmp, "wb") as f:
+                    np.save(f, fresh)
+                os.replace(tmp, path)
+                dates = fresh
+            except Exception as e:
+                # A stale calendar still knows the past holidays
+                print(f"Trading calendar refresh failed, weekdays count as sessions: {e}")
+            self._trade_dates = dates if dates is not None and len(dates) else None
+            return self._trade_dates
+
+    # --- Internals ---
+
+    def _lock_for(self, symbol):
+        with self._guard:
+            lock = self._locks.get(symbol)
+            if lock is None:
+                lock = self._locks[symbol] = threading.Lock()
+            return lock
+
+    def _cached(self, symbol):
+        with self._guard:
+            entry = self._cache.get(symbol)
+            if entry:
+                self._cache.move_to_end(symbol)
+            return entry
+
+    def _remember(self, symbol, entry):
+        with self._guard:
+            self._cache[symbol] = entry
+            self._cache.move_to_end(symbol)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+
+    def _is_stale(self, checked_at):
+        return checked_at < last_session_close(trade_dates=self.trade_dates())
+
+    def _dir(self, symbol):
+        return self.root / symbol
+
+    def _load(self, symbol):
+        path = self._dir(symbol)
+        try:
+            meta = json.loads((path / "meta.json").read_text())
+            rows = meta["rows"]
+            version = path / meta["version"]
+            cols = {name: np.load(version / f"{name}.npy", mmap_mode="r") for name in COLUMNS}
+        except (OSError, ValueError, KeyError):
+            return None
+        if any(len(arr) < rows for arr in cols.values()):
+            return None
+        cols = {name: arr[:rows] for name, arr in cols.items()}
+        return cols, datetime.fromisoformat(meta["checked_at"])
+
+    def _save(self, symbol, cols, checked_at):
+        """
+        Writes every column into a new version directory, then renames a new
+        meta.json over the old one. The previous version is kept for readers that
+        read the old meta.json just before the swap; older ones are deleted (open
+        memory maps keep their pages).
+        """
+        path = self._dir(symbol)
+        version = f"v{time.time_ns()}-{os.getpid()}"
+        (path / version).mkdir(parents=True)
+        for name in COLUMNS:
+            with open(path / version / f"{name}.npy", "wb") as f:
+                np.save(f, np.ascontiguousarray(cols[name]))
+        try:
+            previous = json.loads((path / "meta.json").read_text()).get("version")
+        except (OSError, ValueError):
+            previous = None
+        meta_tmp = path / f".meta.{version}.tmp"
+        meta_tmp.write_text(json.dumps({"version": version, "rows": int(len(cols["date"])),
+                                        "checked_at": checked_at.isoformat()}))
+        # Swapped last, so a torn write leaves readers on the previous complete version
+        os.replace(meta_tmp, path / "meta.json")
+        self._prune(path, {version, previous})
+
+    def _prune(self, path, keep):
+        for child in path.iterdir():
+            if child.is_dir() and child.name.startswith("v") and child.name not in keep:
+                shutil.rmtree(child, ignore_errors=True)
+
+    def _fetch(self, symbol, start_date=None):
+        self.upstream_fetches += 1
+        try:
+            with stage("fetch"):
+                df = self.fetcher(symbol, start_date)
+        except Exception:
+            FETCH_ERRORS.inc(source="prices")
+            raise
+        if df is None or df.empty:
+            return None
+        return frame_to_columns(df)
+
+    def _refresh(self, symbol, stored):
+        """
+        Brings `stored` up to date (or downloads from scratch when None),
+        persists the result and returns the memory-mapped columns.
+        """
+        checked_at = datetime.now(CST)
+        try:
+            if stored is None or len(stored["date"]) == 0:
+                cols = self._fetch(symbol)
+                if cols is None:
+                    raise ValueError(f"No price history for {symbol}")
+            else:
+                cols = self._append_increment(symbol, stored)
+        except Exception as e:
+            if stored is None:
+                raise
+            print(f"Price refresh failed for {symbol}, serving stored history: {e}")
+            return stored
+
+        self._save(symbol, cols, checked_at)
+        entry = self._load(symbol)
+        self._remember(symbol, entry)
+        return entry[0]
+
+    def _append_increment(self, symbol, stored):
+        # Anchor on the second-to-last bar: the last one may be an intraday snapshot,
+        # but the one before it is final and its qfq close must not have moved
+        anchor = len(stored["date"]) - 2 if len(stored["date"]) > 1 else 0
+        anchor_date = stored["date"][anchor]
+        fresh = self._fetch(symbol, start_date=str(anchor_date).replace("-", ""))
+        if fresh is None:
+            return {name: np.asarray(arr) for name, arr in stored.items()}
+
+        at_anchor = np.flatnonzero(fresh["date"] == anchor_date)
+        if len(at_anchor):
+            old_close = float(stored["close"][anchor])
+            new_close = float(fresh["close"][at_anchor[0]])
+            if abs(new_close - old_close) > QFQ_TOLERANCE * max(abs(old_close), 1e-9):
+                print(f"qfq re-adjustment detected for {symbol}, rebuilding history")
+                full = self._fetch(symbol)
+                if full is None:
+                    raise ValueError(f"No price history for {symbol}")
+                return full
+
+        newer = fresh["date"] > anchor_date
+        return {
+            name: np.concatenate([np.asarray(stored[name][:anchor + 1]), fresh[name][newer]])
+            for name in COLUMNS
+        }
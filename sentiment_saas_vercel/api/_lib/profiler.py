@@ -0,0 +1,85 @@
+"""
+Opt-in sampling profiler for single requests (stdlib only).
+
+A background thread snapshots every thread's stack (`sys._current_frames`) at a
+fixed interval and counts collapsed stacks ("outer;inner;leaf count" lines, the
+input format of flamegraph.pl / speedscope). Enabled per request by
+TimingMiddleware when PROFILE_REQUESTS=1 and the request sends `X-Profile: 1`;
+output goes to PROFILE_DIR. Samples are process-wide, so requests running at
+the same time show up in each other's profiles.
+"""
+import os
+import pathlib
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_DIR = pathlib.Path(os.environ.get("PROFILE_DIR", "/tmp/stocksentiment/profiles"))
+SAMPLE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+MAX_DEPTH = 64
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({pathlib.Path(code.co_filename).name}:{frame.f_lineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+
+class ProfileSession:
+    """
+    One profiled request: `path` is known up front so it can go into a response
+    header; the file is written by `stop()`.
+    """
+
+    def __init__(self, route):
+        slug = route.strip("/").replace("/", "_") or "root"
+        self.path = PROFILE_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{slug}-{time.perf_counter_ns() % 10**6}.folded"
+        self.profiler = SamplingProfiler()
+
+    def start(self):
+        self.profiler.start()
+        return self
+
+    def stop(self):
+        self.profiler.stop()
+        try:
+            PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(self.profiler.collapsed())
+        except OSError as e:
+            print(f"Could not write profile {self.path}: {e}")
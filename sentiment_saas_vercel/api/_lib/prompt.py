@@ -0,0 +1,208 @@
+"""
+Prompt construction and per-item token accounting for sentiment scoring.
+
+- Byte-stable prefix: the system prompts and instruction headers are constants
+  with no per-request values, and everything item-specific goes at the end of the
+  user message. Every call therefore starts with the same bytes, which DeepSeek's
+  context (prefix) cache bills as cache hits.
+- Item text is NFKC-normalized with whitespace collapsed, and the title is not
+  repeated when the content already starts with it (news rows often do).
+- Content over `ITEM_TOKEN_BUDGET` is trimmed by sentence salience: lead
+  sentences, sentences quoting the stock code and sentences with lexicon
+  sentiment terms are kept first, in their original order, with "……" marking
+  each gap. Everything it looks at comes from the item row, so every process
+  (API, worker, scheduler, backfill) trims an item to the same bytes and so
+  computes the same llm_cache key.
+- `split_usage` divides a completion's reported usage over the items it scored,
+  for the token columns stored with each sentiment_results row.
+"""
+import bisect
+import os
+import re
+from collections import namedtuple
+
+from . import lexicon
+from .llm_dispatch import cached_prompt_tokens, estimate_tokens
+from .metrics import PROMPT_TRIMMED_TOKENS
+from .text import normalize_text
+
+SYSTEM_PROMPT = "你是一位专业的金融情感分析师。分析以下财经文本的情绪倾向。请用中文回复，格式为JSON: { \"score\": 浮点数(-1到1, -1极度看空, 0中性, 1极度看多), \"summary\": \"一句话中文解释分析理由\" }"
+USER_TEMPLATE = "请分析以下内容的情绪: {text}"
+
+# Packed mode: several items per request, answered as one JSON array
+PACKED_SYSTEM_PROMPT = "你是一位专业的金融情感分析师。逐条分析用户给出的多条财经文本的情绪倾向。请用中文回复，只输出一个JSON数组，每条文本对应一个元素: [{ \"id\": 编号, \"score\": 浮点数(-1到1, -1极度看空, 0中性, 1极度看多), \"summary\": \"一句话中文解释分析理由\" }]"
+# No item count here: the header is part of the cached prefix
+PACKED_USER_HEADER = "请分析以下每条内容的情绪，编号见行首方括号:"
+
+ITEM_TOKEN_BUDGET = int(os.environ.get("PROMPT_ITEM_TOKENS", "400"))  # per item, title included
+LEAD_SENTENCES = 2
+GAP = "……"
+
+# Everything that shapes the prompt bytes; sentiment.PROMPT_VERSION hashes it
+FINGERPRINT = "\n".join([SYSTEM_PROMPT, USER_TEMPLATE, PACKED_SYSTEM_PROMPT, PACKED_USER_HEADER,
+                         f"budget={ITEM_TOKEN_BUDGET}", f"lead={LEAD_SENTENCES}"])
+
+_SENTENCE = re.compile(r"[^。！？!?；;\n]+[。！？!?；;]*\n?|\n")
+
+ItemText = namedtuple("ItemText", ["text", "tokens", "content_tokens"])
+
+
+def mentions(stock_code):
+    """
+    Strings that identify the stock in a text. Only the code: a name would need
+    a listing that not every process has loaded.
+    """
+    return [stock_code] if stock_code else []
+
+
+def sentences(text):
+    """
+    Splits on Chinese/ASCII sentence ends and newlines. Returns (start, sentence) pairs.
+    """
+    return [(m.start(), m.group()) for m in _SENTENCE.finditer(text) if m.group().strip()]
+
+
+def salience(text, parts, names):
+    """
+    Score per sentence: lead position, stock mentions, sentiment term hits.
+    """
+    starts = [start for start, _ in parts]
+    hits = [0] * len(parts)
+    for start, _ in lexicon.term_spans(text):
+        hits[bisect.bisect_right(starts, start) - 1] += 1
+    scores = []
+    for i, (_, sentence) in enumerate(parts):
+        score = max(LEAD_SENTENCES - i, 0) * 1.5
+        score += 2.0 if any(name in sentence for name in names) else 0.0
+        score += min(hits[i], 3)
+        scores.append(score)
+    return scores
+
+
+def clip(text, budget):
+    """
+    Longest prefix of `text` within `budget` estimated tokens.
+    """
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
+
+
+def trim(text, budget, names=()):
+    """
+    `text` cut to `budget` estimated tokens by sentence salience (see module doc).
+    """
+    if estimate_tokens(text) <= budget:
+        return text
+    parts = sentences(text)
+    scores = salience(text, parts, names)
+    gap = estimate_tokens(GAP)
+    chosen, used = set(), 0
+    for i in sorted(range(len(parts)), key=lambda i: (-scores[i], i)):
+        cost = estimate_tokens(parts[i][1]) + gap
+        if used + cost <= budget:
+            chosen.add(i)
+            used += cost
+    if not chosen:
+        # One sentence longer than the whole budget
+        return clip(parts[0][1] if parts else text, budget - gap) + GAP
+    out, last = [], -1
+    for i in sorted(chosen):
+        if i != last + 1:
+            out.append(GAP)
+        out.append(parts[i][1].strip())
+        last = i
+    if last != len(parts) - 1:
+        out.append(GAP)
+    return "".join(out)
+
+
+def fit(item, budget=ITEM_TOKEN_BUDGET, record=True):
+    """
+    The text sent to the model for an item, within `budget` tokens. Returns an
+    ItemText with its estimated tokens and those of the untrimmed title + content.
+    `record=False` leaves the trimmed-tokens metric alone (cache key lookups).
+    """
+    title = normalize_text(item.get("title"))
+    content = normalize_text(item.get("content"))
+    if title and content.startswith(title):
+        content = content[len(title):].lstrip(" :：-|")
+    full_tokens = estimate_tokens(title) + estimate_tokens(content)
+    head = title + "\n" if content and title else title
+    body = trim(content, max(budget - estimate_tokens(head), 0), mentions(item.get("stock_code")))
+    text = head + body
+    tokens = estimate_tokens(text)
+    if record and tokens < full_tokens:
+        PROMPT_TRIMMED_TOKENS.inc(full_tokens - tokens)
+    return ItemText(text, tokens, full_tokens)
+
+
+def single_messages(text):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": USER_TEMPLATE.format(text=text.text)},
+    ]
+
+
+def packed_messages(texts):
+    # Short positional ids keep the prompt (and the reply) small; one line per item
+    lines = [PACKED_USER_HEADER] + [f"[{i}] " + t.text.replace("\n", " ") for i, t in enumerate(texts, start=1)]
+    return [
+        {"role": "system", "content": PACKED_SYSTEM_PROMPT},
+        {"role": "user", "content": "\n".join(lines)},
+    ]
+
+
+# --- Accounting ---
+
+def _split(total, weights):
+    """
+    Splits an integer total proportionally to `weights` (largest remainder).
+    """
+    weight_sum = sum(weights)
+    if not weights or weight_sum <= 0:
+        return [0] * len(weights)
+    exact = [total * w / weight_sum for w in weights]
+    parts = [int(x) for x in exact]
+    for i in sorted(range(len(weights)), key=lambda i: parts[i] - exact[i])[:total - sum(parts)]:
+        parts[i] += 1
+    return parts
+
+
+def split_usage(completion, messages, texts):
+    """
+    Per-item token columns for the items of one completion. Prompt and cached
+    tokens are divided by each item's share of the prompt (its text plus an equal
+    part of the shared prefix), completion tokens equally. Without reported usage
+    the prompt is estimated and completion/cached tokens are 0.
+    """
+    usage = getattr(completion, "usage", None)
+    prompt_total = getattr(usage, "prompt_tokens", None)
+    if prompt_total is None:
+        prompt_total = sum(estimate_tokens(m["content"]) for m in messages)
+    completion_total = getattr(usage, "completion_tokens", 0) or 0
+    cached_total = cached_prompt_tokens(usage)
+
+    shared = max(sum(estimate_tokens(m["content"]) for m in messages) - sum(t.tokens for t in texts), 0)
+    shares = [t.tokens + shared / len(texts) for t in texts]
+    columns = zip(_split(prompt_total, shares), _split(completion_total, [1] * len(texts)),
+                  _split(cached_total, shares), texts)
+    return [token_columns(p, c, cached, t) for p, c, cached, t in columns]
+
+
+def token_columns(prompt_tokens=0, completion_tokens=0, cached_tokens=0, text=None):
+    """
+    The sentiment_results token columns; all zero for rows that made no model call.
+    """
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cached_tokens": cached_tokens,
+        "content_tokens": text.content_tokens if text else 0,
+        "trimmed_tokens": max(text.content_tokens - text.tokens, 0) if text else 0,
+    }
@@ -0,0 +1,171 @@
+"""
+Per-stock, per-day, per-source sentiment rollups (`sentiment_daily`).
+
+Every writer of sentiment_results (analyze_batch, the streaming variant, the
+analysis worker) also applies the matching deltas through the
+`apply_sentiment_rollup` function, which adds sums/counts and keeps the three most
+decisive summaries per bucket. /api/sentiment_series then reads a few dozen rows
+instead of the whole corpus. `rebuild` recomputes a stock from scratch; cleanup
+uses it after deleting rows, and jobs/rebuild_rollups.py uses it to verify.
+
+Days are the UTC date of `publish_time`, which is the CST wall-clock date the
+rows were ingested with (and what the dashboard has always grouped by).
+"""
+from datetime import datetime
+
+TOP_SUMMARIES = 3
+PAGE_SIZE = 500
+
+
+def _day(publish_time):
+    return str(publish_time or datetime.now().isoformat())[:10]
+
+
+def _bucket(result):
+    if result.get("news_score_raw") is not None:
+        return "news", result["news_score_raw"]
+    if result.get("guba_score_raw") is not None:
+        return "guba", result["guba_score_raw"]
+    return None, None
+
+
+def rollup_deltas(items, results):
+    """
+    Aggregates sentiment_results rows into one delta per (stock_code, day, source).
+    `items` are the raw_corpus rows the results belong to.
+    """
+    by_id = {item["id"]: item for item in items}
+    deltas = {}
+    for res in results:
+        item = by_id.get(res["corpus_id"])
+        source, score = _bucket(res)
+        if item is None or source is None:
+            continue
+        key = (item["stock_code"], _day(item.get("publish_time")), source)
+        delta = deltas.setdefault(key, {
+            "stock_code": key[0], "day": key[1], "source": source,
+            "score_sum": 0.0, "item_count": 0, "top_summaries": [],
+        })
+        delta["score_sum"] += float(score)
+        delta["item_count"] += 1
+        if res.get("summary"):
+            delta["top_summaries"].append({"score": float(score), "summary": res["summary"]})
+    for delta in deltas.values():
+        delta["top_summaries"] = top_summaries(delta["top_summaries"])
+    return list(deltas.values())
+
+
+def top_summaries(entries, n=TOP_SUMMARIES):
+    """
+    Most decisive (largest |score|) summaries first.
+    """
+    return sorted(entries, key=lambda e: abs(e["score"]), reverse=True)[:n]
+
+
+def apply(client, items, results):
+    """
+    Adds the results to the rollups. A failure is logged, not raised: the results
+    are already stored and `rebuild` can always recompute the rollups.
+    """
+    deltas = rollup_deltas(items, results)
+    if not deltas:
+        return
+    try:
+        client.rpc("apply_sentiment_rollup", {"p_rows": deltas}).execute()
+    except Exception as e:
+        print(f"Sentiment rollup update failed: {e}")
+
+
+def compute(client, stock_code, page_size=PAGE_SIZE):
+    """
+    Recomputes a stock's rollups from raw_corpus + sentiment_results.
+    """
+    rows = {}
+    last_id = None
+    while True:
+        query = (
+            client.table("sentiment_results")
+            .select("id, corpus_id, news_score_raw, guba_score_raw, summary, raw_corpus!inner(stock_code, publish_time)")
+            .eq("raw_corpus.stock_code", stock_code)
+        )
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        page = query.order("id").limit(page_size).execute().data or []
+        items = [dict(r["raw_corpus"], id=r["corpus_id"]) for r in page if r.get("raw_corpus")]
+        for delta in rollup_deltas(items, page):
+            key = (delta["day"], delta["source"])
+            if key in rows:
+                rows[key]["score_sum"] += delta["score_sum"]
+                rows[key]["item_count"] += delta["item_count"]
+                rows[key]["top_summaries"] = top_summaries(rows[key]["top_summaries"] + delta["top_summaries"])
+            else:
+                rows[key] = delta
+        if len(page) < page_size:
+            break
+        last_id = page[-1]["id"]
+    return sorted(rows.values(), key=lambda r: (r["day"], r["source"]))
+
+
+def rebuild(client, stock_code):
+    """
+    Replaces a stock's rollup rows with freshly computed ones. Returns them.
+    """
+    fresh = compute(client, stock_code)
+    client.rpc("replace_sentiment_rollup", {"p_stock": stock_code, "p_rows": fresh}).execute()
+    return fresh
+
+
+def load(client, stock_code, since=None):
+    query = client.table("sentiment_daily").select("day, source, score_sum, item_count, top_summaries").eq("stock_code", stock_code)
+    if since:
+        query = query.gte("day", since)
+    return query.order("day").execute().data or []
+
+
+def load_many(client, stock_codes, since=None, page_size=PAGE_SIZE):
+    """
+    Sums and counts (no summaries) for many stocks at once, paged by `range`.
+    """
+    rows = []
+    while True:
+        query = (
+            client.table("sentiment_daily").select("stock_code, day, source, score_sum, item_count")
+            .in_("stock_code", list(stock_codes))
+        )
+        if since:
+            query = query.gte("day", since)
+        page = (
+            query.order("stock_code").order("day").order("source")
+            .range(len(rows), len(rows) + page_size - 1).execute().data or []
+        )
+        rows += page
+        if len(page) < page_size:
+            return rows
+
+
+def merge_with_prices(rollups, prices):
+    """
+    One entry per price bar: close plus per-source daily mean/count and the day's
+    most decisive summary. Days without analyzed items get null sources.
+    """
+    by_day = {}
+    for r in rollups:
+        day = by_day.setdefault(str(r["day"])[:10], {"sources": {}, "top": []})
+        day["sources"][r["source"]] = {
+            "mean": round(r["score_sum"] / r["item_count"], 4) if r["item_count"] else None,
+            "count": r["item_count"],
+        }
+        day["top"].extend(r.get("top_summaries") or [])
+
+    series = []
+    for date, close in zip(prices["date"], prices["close"]):
+        day = by_day.get(date, {"sources": {}, "top": []})
+        top = top_summaries(day["top"], 1)
+        series.append({
+            "date": date,
+            "close": close,
+            "news": day["sources"].get("news"),
+            "guba": day["sources"].get("guba"),
+            "summary": top[0]["summary"] if top else None,
+        })
+    return series
@@ -0,0 +1,166 @@
+"""
+Market-wide ingestion scheduler: fetches and analyzes every portfolio stock once
+for all users, instead of once per user clicking refresh.
+
+Each round claims the most overdue symbols through the `claim_stale_symbols`
+Postgres function. That function takes the distinct `stock_code`s from
+user_portfolios, skips those ingested within `stale_seconds` and orders the rest
+by holders x time since their last ingest (never-ingested symbols first), leasing
+them like `claim_analysis_batch` does so several schedulers can run side by side.
+Claimed symbols go through the same pipeline as /api/fetch_raw, the rows that
+round inserted (and only those, not the backfill queue) are analyzed by an
+embedded AnalysisWorker, and `ingest_state` records per-symbol freshness, which
+the dashboard reads instead of triggering its own fetch.
+"""
+import asyncio
+import os
+import socket
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from . import ingest
+from .analysis_worker import AnalysisWorker
+from .cleanup import chunks
+from .near_dup import NearDupIndex
+from .supabase_pool import parallel
+
+STALE_SECONDS = int(os.environ.get("INGEST_STALE_SECONDS", "900"))
+
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+
+class IngestScheduler:
+    """
+    Long-lived claim -> ingest -> analyze -> record loop.
+
+    `client` is a service-role Supabase client or the stand-in in `bench/fakes.py`;
+    `worker` defaults to an AnalysisWorker on the same client.
+    """
+
+    def __init__(self, client, executor=None, worker=None, scheduler_id=None, batch_size=10,
+                 stale_seconds=STALE_SECONDS, lease_seconds=600, retry_seconds=None, idle_sleep=30.0,
+                 sources=None, timeout=ingest.SOURCE_TIMEOUT, near_dups=None):
+        self.client = client
+        self.executor = executor or ThreadPoolExecutor(max_workers=8, thread_name_prefix="ingest")
+        self.worker = worker or AnalysisWorker(client)
+        self.scheduler_id = scheduler_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.batch_size = batch_size
+        self.stale_seconds = stale_seconds
+        self.lease_seconds = lease_seconds
+        # A symbol whose every source failed is retried after this long, not on the next round
+        self.retry_seconds = retry_seconds if retry_seconds is not None else min(stale_seconds, 300)
+        self.idle_sleep = idle_sleep
+        self.sources = sources or ingest.SOURCES
+        self.timeout = timeout
+        self.near_dups = near_dups or NearDupIndex()
+        self.stats = {"rounds": 0, "symbols": 0, "new_items": 0, "failed_symbols": 0}
+        self._stopping = False
+
+    def stop(self):
+        self._stopping = True
+        self.worker.stop()
+
+    async def run_forever(self):
+        """
+        Keeps the portfolio universe fresh; sleeps `idle_sleep` seconds whenever
+        nothing is due.
+        """
+        while not self._stopping:
+            if not await self.run_once():
+                await asyncio.sleep(self.idle_sleep)
+
+    async def catch_up(self):
+        """
+        Runs rounds until no symbol is due, then returns the stats.
+        """
+        while not self._stopping and await self.run_once():
+            pass
+        return self.stats
+
+    async def run_once(self):
+        """
+        Claims one batch of due symbols, ingests and analyzes them and records
+        their freshness. Returns the number of symbols claimed.
+        """
+        claimed = await asyncio.to_thread(self._claim)
+        if not claimed:
+            return 0
+        codes = [row["stock_code"] for row in claimed]
+        self.stats["rounds"] += 1
+        self.stats["symbols"] += len(codes)
+
+        try:
+            result = await ingest.ingest(self.client, codes, self.executor, self.sources,
+                                         self.timeout, near_dups=self.near_dups)
+        except Exception as e:
+            print(f"Scheduler {self.scheduler_id}: ingest failed for {codes}: {e}")
+            result = {"inserted_ids": [], "per_stock": {}, "source_errors": {f"{code}/{name}": str(e)
+                                                         for code in codes for name in self.sources}}
+        fetched_at = utc_now()
+        self.stats["new_items"] += sum(result["per_stock"].values())
+
+        # New rows are scored once, for every holder; other pending rows are left to the workers
+        ids = result["inserted_ids"]
+        if ids:
+            await self.worker.drain(ids)
+        pending = await asyncio.to_thread(self._pending, ids) if ids else set()
+
+        failed = await asyncio.to_thread(self._record, codes, result, fetched_at, pending)
+        self.stats["failed_symbols"] += len(failed)
+        return len(codes)
+
+    # --- DB side (runs in threads) ---
+
+    def _claim(self):
+        res = self.client.rpc("claim_stale_symbols", {
+            "p_worker": self.scheduler_id,
+            "p_limit": self.batch_size,
+            "p_stale_seconds": self.stale_seconds,
+            "p_lease_seconds": self.lease_seconds,
+        }).execute()
+        return res.data or []
+
+    def _pending(self, ids):
+        """
+        Symbols with rows among `ids` that are still unanalyzed (failed or stopped).
+        Looked up in `chunks` of ids, so no request URL carries a whole round of ids.
+        """
+        pages = parallel(*[
+            lambda part=part: self.client.table("raw_corpus").select("stock_code")
+            .in_("id", part).eq("is_analyzed", False).execute()
+            for part in chunks(ids)
+        ])
+        return {row["stock_code"] for res in pages for row in (res.data or [])}
+
+    def _record(self, codes, result, fetched_at, pending=()):
+        """
+        Writes per-symbol freshness (one upsert per row shape). `last_analyzed_at` only moves
+        for symbols whose new rows were all analyzed. Returns the symbols whose every source
+        failed; they keep their old timestamps and are retried later.
+        """
+        now = utc_now()
+        errors = result["source_errors"]
+        failed, rows = [], []
+        for code in codes:
+            messages = [f"{name}: {errors[f'{code}/{name}']}" for name in self.sources if f"{code}/{name}" in errors]
+            if len(messages) == len(self.sources):
+                failed.append(code)
+                rows.append({"stock_code": code, "last_error": "; ".join(messages),
+                             "lease_owner": None, "updated_at": now.isoformat(),
+                             "lease_expires_at": (now + timedelta(seconds=self.retry_seconds)).isoformat()})
+            else:
+                row = {"stock_code": code, "last_ingested_at": fetched_at.isoformat(),
+                       "new_items": result["per_stock"].get(code, 0),
+                       "last_error": "; ".join(messages) or None,
+                       "lease_owner": None, "lease_expires_at": None, "updated_at": now.isoformat()}
+                if code not in pending:
+                    row["last_analyzed_at"] = now.isoformat()
+                rows.append(row)
+        # PostgREST bulk upserts need one column set per request
+        for keys in {tuple(sorted(row)) for row in rows}:
+            batch = [row for row in rows if tuple(sorted(row)) == keys]
+            self.client.table("ingest_state").upsert(batch, on_conflict="stock_code").execute()
+        return failed
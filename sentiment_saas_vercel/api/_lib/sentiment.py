@@ -0,0 +1,288 @@
+"""
+LLM sentiment scoring for raw_corpus items.
+
+Shared by /api/analyze_batch and the standalone analysis worker.
+"""
+import asyncio
+import hashlib
+import json
+import os
+
+from . import lexicon, prompt
+from .llm_dispatch import estimate_tokens, get_dispatcher
+from .metrics import PARSE_FAILURES, stage
+from .prompt import PACKED_SYSTEM_PROMPT, PACKED_USER_HEADER
+
+MODEL = "deepseek-chat"
+PACK_TOKEN_BUDGET = int(os.environ.get("PACK_TOKEN_BUDGET", "2000"))  # prompt + expected output
+PACK_OUTPUT_TOKENS_PER_ITEM = 60
+PACK_MAX_ITEMS = 20
+
+# Changes whenever the model, prompt text or item budget changes, which retires every cached result
+PROMPT_VERSION = hashlib.sha256(f"{MODEL}\n{prompt.FINGERPRINT}".encode("utf-8")).hexdigest()[:12]
+
+def build_result(item, score, summary, tokens=None):
+    """
+    Shapes a score into a sentiment_results row for the item's source. `tokens`
+    are the row's token columns (see prompt.token_columns); zero when omitted.
+    """
+    source = item['source']
+    return {
+        "corpus_id": item['id'],
+        "news_score_raw": score if source in ['news', 'report'] else None,
+        "guba_score_raw": score if source == 'guba' else None,
+        "summary": summary,
+        **(tokens or prompt.token_columns()),
+    }
+
+
+async def score_item(item, text=None):
+    """
+    Scores one item. Returns (score, summary, cacheable, tokens); `cacheable` is
+    False for the lexicon fallback used when no API key is configured and for
+    unparseable replies. `text` is the item's prompt.fit, if already computed.
+    """
+    api_key = os.environ.get("DEEPSEEK_API_KEY")
+    if not api_key:
+        # Fallback for demo without key: the local lexicon, whatever its confidence
+        print("DEEPSEEK_API_KEY not set, using the lexicon scorer.")
+        score, _, terms = lexicon.score_text(item_text(item))
+        return score, lexicon.summarize(score, terms), False, prompt.token_columns()
+
+    # DeepSeek API Call (pooled client, adaptive concurrency, retries)
+    text = text or prompt.fit(item)
+    messages = prompt.single_messages(text)
+    completion = await get_dispatcher().chat(model=MODEL, messages=messages)
+    tokens = prompt.split_usage(completion, messages, [text])[0]
+    content = completion.choices[0].message.content
+    try:
+        with stage("parse"):
+            clean_content = content.replace("```json", "").replace("```", "").strip()
+            data = json.loads(clean_content)
+            score = data.get('score', 0)
+            summary = data.get('summary', '分析完成')
+    except:
+        PARSE_FAILURES.inc(kind="single")
+        score = 0
+        summary = content[:50] if content else "解析失败"
+        return score, summary, False, tokens
+    return score, summary, True, tokens
+
+
+def item_text(item):
+    """
+    Full, untrimmed title + content (what the lexicon reads).
+    """
+    return f"{item['title']} \n {item['content']}"
+
+
+def pack_items(items, texts=None, budget=PACK_TOKEN_BUDGET, max_items=PACK_MAX_ITEMS):
+    """
+    Greedily groups items so each packed request stays within the token budget
+    (system prompt + item prompt texts + expected per-item output). `texts` maps
+    item id -> prompt.fit; missing entries are computed.
+    """
+    texts = texts if texts is not None else {}
+    overhead = estimate_tokens(PACKED_SYSTEM_PROMPT) + estimate_tokens(PACKED_USER_HEADER) + 5
+    packs, current, used = [], [], overhead
+    for item in items:
+        text = texts.get(item['id']) or texts.setdefault(item['id'], prompt.fit(item))
+        cost = text.tokens + PACK_OUTPUT_TOKENS_PER_ITEM + 4
+        if current and (used + cost > budget or len(current) >= max_items):
+            packs.append(current)
+            current, used = [], overhead
+        current.append(item)
+        used += cost
+    if current:
+        packs.append(current)
+    return packs
+
+
+def parse_packed_reply(content, count):
+    """
+    Extracts {position: (score, summary)} from a packed reply. Entries with a bad
+    id or shape are dropped, so the caller can fall back to single-item scoring.
+    """
+    clean = (content or "").replace("```json", "").replace("```", "").strip()
+    start, end = clean.find("["), clean.rfind("]")
+    if start < 0 or end <= start:
+        return {}
+    try:
+        rows = json.loads(clean[start:end + 1])
+    except ValueError:
+        return {}
+    parsed = {}
+    for row in rows if isinstance(rows, list) else []:
+        try:
+            pos = int(row["id"])
+            score = float(row["score"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 1 <= pos <= count and -1.0 <= score <= 1.0:
+            parsed[pos] = (score, str(row.get("summary") or "分析完成"))
+    return parsed
+
+
+async def score_packed(items, texts=None):
+    """
+    Scores several items with one completion. Returns {item id: (score, summary,
+    True, tokens)} for the items the model answered; missing ids are simply absent.
+    The completion's tokens are shared out over all of `items`, answered or not,
+    so a missed item's single-item retry is accounted on top.
+    """
+    texts = [(texts or {}).get(item['id']) or prompt.fit(item) for item in items]
+    messages = prompt.packed_messages(texts)
+    completion = await get_dispatcher().chat(
+        model=MODEL,
+        messages=messages,
+        max_tokens=PACK_OUTPUT_TOKENS_PER_ITEM * len(items) + 50
+    )
+    tokens = prompt.split_usage(completion, messages, texts)
+    with stage("parse"):
+        parsed = parse_packed_reply(completion.choices[0].message.content, len(items))
+    if len(parsed) < len(items):
+        PARSE_FAILURES.inc(len(items) - len(parsed), kind="packed_item")
+    return {items[pos - 1]['id']: (score, summary, True, tokens[pos - 1]) for pos, (score, summary) in parsed.items()}
+
+
+async def score_stream(items, packed=False):
+    """
+    Scores distinct items, yielding (item, (score, summary, cacheable, tokens) or
+    None) in completion order. In packed mode, anything a packed reply misses is
+    re-scored on its own as soon as that reply arrives.
+    """
+    texts = {}  # item id -> prompt.fit, shared by packing and single-item retries
+
+    async def single(item):
+        try:
+            return "single", (item, await score_item(item, texts.get(item['id'])))
+        except Exception as e:
+            print(f"Analysis failed for {item['id']}: {e}")
+            return "single", (item, None)
+
+    async def pack(group):
+        try:
+            return "pack", (group, await score_packed(group, texts))
+        except Exception as e:
+            print(f"Packed analysis failed for {len(group)} items: {e}")
+            return "pack", (group, {})
+
+    if packed and os.environ.get("DEEPSEEK_API_KEY"):
+        pending = {asyncio.ensure_future(pack(g) if len(g) > 1 else single(g[0])) for g in pack_items(items, texts)}
+    else:
+        pending = {asyncio.ensure_future(single(item)) for item in items}
+
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                kind, payload = task.result()
+                if kind == "single":
+                    yield payload
+                    continue
+                group, answered = payload
+                for item in group:
+                    if item['id'] in answered:
+                        yield item, answered[item['id']]
+                    else:
+                        pending.add(asyncio.ensure_future(single(item)))
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def score_many(items, packed=False):
+    """
+    Scores distinct items; returns a list of (score, summary, cacheable, tokens) or None per item.
+    """
+    answered = {}
+    async for item, out in score_stream(items, packed=packed):
+        answered[item['id']] = out
+    return [answered.get(item['id']) for item in items]
+
+
+async def analyze_single_item(item):
+    """
+    Calls DeepSeek API for sentiment analysis.
+    Outputs in Chinese.
+    """
+    try:
+        score, summary, _, tokens = await score_item(item)
+        return build_result(item, score, summary, tokens)
+    except Exception as e:
+        print(f"Analysis failed for {item['id']}: {e}")
+        return None
+
+
+async def iter_analyzed(items, cache=None, client=None, packed=False, stats=None, cascade=False):
+    """
+    Streaming core of analyze_items: yields (item, sentiment_results row or None)
+    as each item settles - cache hits first, then (with `cascade`) confident lexicon
+    scores, then model results as they complete. Items with identical content share
+    one call. `stats` is filled with {"hits", "lexicon", "misses", "failed"}; fresh
+    model results are written to the cache at the end.
+    """
+    stats = stats if stats is not None else {}
+    keys = {item['id']: cache.key_for(item) if cache else item['id'] for item in items}
+    cached = await asyncio.to_thread(cache.get_many, client, list(set(keys.values()))) if cache else {}
+
+    todo = {}  # key -> items sharing that content; each key is scored once
+    for item in items:
+        hit = cached.get(keys[item['id']])
+        if hit:
+            yield item, build_result(item, hit["score"], hit["summary"])
+        else:
+            todo.setdefault(keys[item['id']], []).append(item)
+    hits = len(items) - sum(len(group) for group in todo.values())
+
+    # Cascade: clear-cut texts are settled locally, only ambiguous ones reach the LLM
+    settled = 0
+    if cascade and todo:
+        scored = lexicon.score_texts([item_text(group[0]) for group in todo.values()])
+        for key, (value, confidence, terms) in zip(list(todo), scored):
+            if lexicon.confident(confidence):
+                summary = lexicon.summarize(value, terms)
+                for item in todo.pop(key):
+                    settled += 1
+                    yield item, build_result(item, value, summary)
+    stats.update(hits=hits, lexicon=settled, misses=len(todo), failed=0)
+
+    fresh = {}
+    try:
+        async for first, out in score_stream([group[0] for group in todo.values()], packed=packed):
+            key = keys[first['id']]
+            if not out:
+                stats["failed"] += len(todo[key])
+                for item in todo[key]:
+                    yield item, None
+                continue
+            value, summary, cacheable, tokens = out
+            if cacheable:
+                fresh[key] = {"score": value, "summary": summary}
+            # The call is accounted once, on the item it was made for
+            for item in todo[key]:
+                yield item, build_result(item, value, summary, tokens if item is first else None)
+    finally:
+        if cache and fresh:
+            await asyncio.to_thread(cache.put_many, client, fresh)
+
+
+async def analyze_items(items, cache=None, client=None, packed=False, cascade=False):
+    """
+    Scores a batch, consulting the LLM result cache (and, with `cascade`, the
+    lexicon) before any model call. Returns (results, {"hits", "lexicon", "misses",
+    "failed"}), where misses counts distinct contents sent to the model and failed
+    counts items that still had no score after the dispatcher's retries; those are
+    left out of `results`.
+    """
+    stats = {}
+    results = [row async for _, row in iter_analyzed(items, cache, client, packed, stats, cascade) if row]
+    return results, stats
+
+
+def cascade_split(stats, total):
+    """
+    Items settled by each tier: {"cache", "lexicon", "llm"}.
+    """
+    cached, local = stats.get("hits", 0), stats.get("lexicon", 0)
+    return {"cache": cached, "lexicon": local, "llm": total - cached - local}
@@ -0,0 +1,185 @@
+"""
+Process-wide A-share code -> name index for /api/stock_info and stock search.
+
+The listing comes from `ak.stock_info_a_code_name()` and is loaded lazily on first
+use, refreshed in the background once the TTL expires, and snapshotted to disk so
+a warm restart can answer immediately without downloading the listing again.
+"""
+import bisect
+import json
+import os
+import pathlib
+import threading
+import time
+from collections import namedtuple
+
+# One immutable generation of the listing; refresh swaps the whole tuple at once
+Listing = namedtuple("Listing", ["codes", "names", "name_order", "sorted_names", "by_code"])
+EMPTY_LISTING = Listing([], [], [], [], {})
+
+def akshare_listing():
+    """
+    Default upstream: the full A-share code/name listing as (codes, names).
+    """
+    import akshare as ak
+    df = ak.stock_info_a_code_name()
+    return df["code"].astype(str).tolist(), df["name"].astype(str).tolist()
+
+
+class StockIndex:
+    """
+    Compact code/name lookup.
+
+    - `codes` / `names` are parallel lists sorted by code, so prefix search is a bisect.
+    - `name_order` holds indices sorted by name for name-prefix search.
+    - Readers take one `Listing` reference, so a concurrent refresh never mixes generations.
+    - A stale index keeps serving while one background thread refreshes it.
+    """
+
+    def __init__(self, snapshot_path, loader=akshare_listing, ttl_seconds=24 * 3600):
+        self.snapshot_path = pathlib.Path(snapshot_path)
+        self.loader = loader
+        self.ttl_seconds = ttl_seconds
+        self.listing = EMPTY_LISTING
+        self.loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    # --- Lookup ---
+
+    def name(self, code):
+        """
+        Returns the stock name, or the code itself when unknown.
+        """
+        return self._ensure_loaded().by_code.get(code, code)
+
+    def names_for(self, codes):
+        """
+        Resolves a whole portfolio in one pass: {code: name}.
+        """
+        by_code = self._ensure_loaded().by_code
+        return {code: by_code.get(code, code) for code in codes}
+
+    def search(self, query, limit=10):
+        """
+        Prefix search over codes and names, then fuzzy matches on names.
+        Returns a list of {code, name}, best matches first.
+        """
+        listing = self._ensure_loaded()
+        query = (query or "").strip()
+        if not query:
+            return []
+
+        hits = []
+        seen = set()
+
+        def add(i):
+            if i not in seen:
+                seen.add(i)
+                hits.append(i)
+
+        # 1. Code prefix (codes are sorted)
+        codes = listing.codes
+        start = bisect.bisect_left(codes, query)
+        for i in range(start, len(codes)):
+            if not codes[i].startswith(query) or len(hits) >= limit:
+                break
+            add(i)
+
+        # 2. Name prefix (name_order is sorted by name)
+        sorted_names = listing.sorted_names
+        start = bisect.bisect_left(sorted_names, query)
+        for pos in range(start, len(sorted_names)):
+            if not sorted_names[pos].startswith(query) or len(hits) >= limit:
+                break
+            add(listing.name_order[pos])
+
+        # 3. Fuzzy: substring first, then in-order subsequence (e.g. "平银" -> "平安银行")
+        if len(hits) < limit:
+            scored = []
+            for i, name in enumerate(listing.names):
+                if i in seen:
+                    continue
+                score = _fuzzy_score(query, name)
+                if score:
+                    scored.append((score, len(name), i))
+            scored.sort(key=lambda s: (-s[0], s[1]))
+            for _, _, i in scored[:limit - len(hits)]:
+                add(i)
+
+        return [{"code": codes[i], "name": listing.names[i]} for i in hits[:limit]]
+
+    # --- Loading ---
+
+    def _ensure_loaded(self):
+        if not self.listing.codes:
+            with self._lock:
+                if not self.listing.codes and not self._load_snapshot():
+                    self._refresh()
+        elif time.time() - self.loaded_at > self.ttl_seconds:
+            self._refresh_in_background()
+        return self.listing
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self._refresh()
+            except Exception as e:
+                print(f"Stock index refresh failed, keeping previous listing: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _refresh(self):
+        codes, names = self.loader()
+        self._install(codes, names, time.time())
+        self._save_snapshot()
+
+    def _install(self, codes, names, loaded_at):
+        pairs = sorted(zip(codes, names))
+        codes = [c for c, _ in pairs]
+        names = [n for _, n in pairs]
+        name_order = sorted(range(len(names)), key=names.__getitem__)
+        self.listing = Listing(codes, names, name_order, [names[i] for i in name_order], dict(pairs))
+        self.loaded_at = loaded_at
+
+    def _load_snapshot(self):
+        try:
+            snap = json.loads(self.snapshot_path.read_text(encoding="utf-8"))
+            self._install(snap["codes"], snap["names"], snap["loaded_at"])
+            return True
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def _save_snapshot(self):
+        try:
+            self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.snapshot_path.with_suffix(".tmp")
+            tmp.write_text(
+                json.dumps({"codes": self.listing.codes, "names": self.listing.names, "loaded_at": self.loaded_at}, ensure_ascii=False),
+                encoding="utf-8",
+            )
+            os.replace(tmp, self.snapshot_path)
+        except OSError as e:
+            print(f"Stock index snapshot write failed: {e}")
+
+
+def _fuzzy_score(query, text):
+    """
+    2 for a substring match, 1 for an in-order subsequence match, 0 otherwise.
+    """
+    if query in text:
+        return 2
+    pos = 0
+    for ch in query:
+        pos = text.find(ch, pos)
+        if pos < 0:
+            return 0
+        pos += 1
+    return 1
@@ -0,0 +1,145 @@
+"""
+Pooled PostgREST access for request handlers.
+
+`create_client()` per request built a new HTTP session (so a new TCP + TLS
+handshake) and a full Supabase client (auth, storage, realtime, functions) just to
+run table/rpc queries. `SupabasePool` keeps one httpx connection pool per process
+and hands each request a lightweight PostgREST client on top of it:
+
+- Auth stays per request: the apikey and the caller's JWT live in the headers of
+  that request's client object, never on the shared transport. The transport also
+  refuses cookies, so nothing from one caller's response rides along on another's.
+- `parallel(...)` runs a handler's independent queries concurrently on a small
+  thread pool over the same pooled connections.
+- Every round trip is recorded as a "db" stage (see metrics.py).
+
+httpx/postgrest are imported on first use to keep them off the cold-start path.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import in_context, record
+
+MAX_CONNECTIONS = int(os.environ.get("SUPABASE_POOL_CONNECTIONS", "20"))
+KEEPALIVE_SECONDS = 60
+QUERY_PARALLELISM = int(os.environ.get("SUPABASE_QUERY_PARALLELISM", "6"))
+
+_query_pool = None
+_query_pool_guard = threading.Lock()
+
+
+class SupabasePool:
+    """
+    Shared transport + per-request PostgREST clients for one Supabase project.
+    """
+
+    def __init__(self, url, key, max_connections=MAX_CONNECTIONS, http_client=None):
+        self.rest_url = f"{url.rstrip('/')}/rest/v1"
+        self.key = key
+        self.max_connections = max_connections
+        self._http = http_client
+        self._guard = threading.Lock()
+
+    @property
+    def http(self):
+        """
+        The shared httpx.Client, created on first use.
+        """
+        if self._http is None:
+            with self._guard:
+                if self._http is None:
+                    self._http = self._make_http()
+        return self._http
+
+    def _make_http(self):
+        import httpx
+        from http.cookiejar import CookieJar, DefaultCookiePolicy
+        from postgrest.constants import DEFAULT_POSTGREST_CLIENT_TIMEOUT
+        return httpx.Client(
+            base_url=self.rest_url,
+            timeout=DEFAULT_POSTGREST_CLIENT_TIMEOUT,
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections,
+                                keepalive_expiry=KEEPALIVE_SECONDS),
+            cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),  # never store cookies
+            follow_redirects=True,
+            http2=True,
+            event_hooks={"request": [_mark_sent], "response": [_record_round_trip]},
+        )
+
+    def client(self, token=None, key=None):
+        """
+        A PostgREST client (`.table()` / `.rpc()`) for one request. With `token`
+        queries run as that user under RLS; without it, as the key's role. `key`
+        replaces the pool's key (the service role key for backend-only writes).
+        """
+        from postgrest import SyncPostgrestClient
+        key = key or self.key
+        headers = {
+            "apikey": key,
+            "Authorization": f"Bearer {token or key}",
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+        }
+        return SyncPostgrestClient(self.rest_url, headers=headers, http_client=self.http)
+
+    def close(self):
+        if self._http is not None:
+            self._http.close()
+            self._http = None
+
+
+def _mark_sent(request):
+    request.extensions["sent_at"] = time.perf_counter()
+
+
+def _record_round_trip(response):
+    sent_at = response.request.extensions.get("sent_at")
+    if sent_at is not None:
+        record("db", time.perf_counter() - sent_at)
+
+
+def _pool():
+    global _query_pool
+    if _query_pool is None:
+        with _query_pool_guard:
+            if _query_pool is None:
+                _query_pool = ThreadPoolExecutor(max_workers=QUERY_PARALLELISM, thread_name_prefix="query")
+    return _query_pool
+
+
+def parallel(*calls):
+    """
+    Runs independent zero-argument callables (typically `lambda: query.execute()`)
+    concurrently and returns their results in order. The first exception is
+    re-raised once all calls have finished. Calls must not use `parallel` themselves.
+    """
+    if QUERY_PARALLELISM <= 1 or len(calls) <= 1:
+        return [call() for call in calls]
+    return _collect([_pool().submit(in_context(call)) for call in calls])
+
+
+def concurrently(*calls):
+    """
+    Like `parallel`, for longer calls that use `parallel` themselves: each runs on
+    its own short-lived thread, so they never wait on the shared query pool.
+    """
+    if QUERY_PARALLELISM <= 1 or len(calls) <= 1:
+        return [call() for call in calls]
+    with ThreadPoolExecutor(max_workers=len(calls), thread_name_prefix="scan") as executor:
+        return _collect([executor.submit(in_context(call)) for call in calls])
+
+
+def _collect(futures):
+    results, error = [], None
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(None)
+            error = error or e
+    if error is not None:
+        raise error
+    return results
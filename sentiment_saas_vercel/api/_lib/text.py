@@ -0,0 +1,14 @@
+"""
+Text normalization shared by prompt building, the LLM cache and duplicate detection.
+"""
+import re
+import unicodedata
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """
+    NFKC (full-width -> half-width), trimmed, whitespace collapsed.
+    """
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text or "")).strip()
@@ -1,12 +1,15 @@
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional
 import os
+import sys
 import asyncio
-from supabase import create_client, Client
-import akshare as ak
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import pathlib
 
@@ -14,35 +17,91 @@ import pathlib
 env_path = pathlib.Path(__file__).parent.parent / '.env.local'
 load_dotenv(dotenv_path=env_path)
 
+# Make the helper package in api/_lib importable both under `uvicorn api.index` and on Vercel
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+from _lib.price_store import PriceStore
+from _lib.stock_index import StockIndex
+from _lib import backtest
+from _lib import indicators
+from _lib.sentiment import analyze_single_item, analyze_items, iter_analyzed, cascade_split
+from _lib.llm_cache import LLMCache
+from _lib.llm_dispatch import current_llm_user, get_dispatcher
+from _lib import analysis_worker
+from _lib import ingest
+from _lib import cleanup
+from _lib import rollups
+from _lib.commentary import CommentaryCache
+from _lib.near_dup import NearDupIndex
+from _lib.metrics import LLM_WINDOW, REGISTRY, TimingMiddleware, in_context
+
+from _lib.supabase_pool import SupabasePool, parallel
+
+if TYPE_CHECKING:
+    from postgrest import SyncPostgrestClient
+
 # Initialize FastAPI
 app = FastAPI()
+# Server-Timing per response, request histograms for /api/metrics, opt-in profiling
+app.add_middleware(TimingMiddleware)
 
 # Supabase Conf
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 # Use Anon Key for base client
 SUPABASE_KEY = os.environ.get("NEXT_PUBLIC_SUPABASE_ANON_KEY") or os.environ.get("SUPABASE_ANON_KEY") 
+# Service role key for the backend-only writes RLS keeps from users (rollups, caches, cleanup state)
+SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
 
 init_error = None
 if not SUPABASE_URL or not SUPABASE_KEY:
     init_error = "Missing SUPABASE_URL or NEXT_PUBLIC_SUPABASE_ANON_KEY."
     print(f"❌ {init_error}")
 
-# Global Client (Optional, mainly for public reads if needed)
-try:
-    if SUPABASE_URL and SUPABASE_KEY:
-         supabase_global: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-         print("✅ Supabase initialized successfully (Anon Key).")
-    else:
-         supabase_global = None
-except Exception as e:
-    print(f"❌ Failed to initialize Supabase: {e}")
-    supabase_global = None
-    init_error = str(e)
+
+# One pooled HTTP transport shared by every request's PostgREST client (opened on first use)
+supabase_pool = SupabasePool(SUPABASE_URL or "", SUPABASE_KEY or "")
+
+
+def get_global_supabase() -> Optional["SyncPostgrestClient"]:
+    """
+    Anon-key client for public reads, on the shared transport.
+    """
+    return None if init_error else supabase_pool.client()
+
+
+def get_service_supabase() -> Optional["SyncPostgrestClient"]:
+    """
+    Service-role client on the shared transport, or None when the key is not set.
+    """
+    if init_error or not SUPABASE_SERVICE_ROLE_KEY:
+        return None
+    return supabase_pool.client(key=SUPABASE_SERVICE_ROLE_KEY)
+
+# Shared OHLCV history (Vercel only allows writes under /tmp)
+price_store = PriceStore(os.environ.get("PRICE_STORE_DIR", "/tmp/stocksentiment/prices"))
+# Code -> name listing, refreshed daily and snapshotted for warm restarts
+stock_index = StockIndex(os.environ.get("STOCK_INDEX_PATH", "/tmp/stocksentiment/stock_index.json"))
+
+# Content-hash keyed LLM results (local LRU + shared llm_cache table, written with the service role)
+llm_cache = LLMCache(writer=get_service_supabase)
+near_dups = NearDupIndex()
+
+# Bounded pool for blocking data-source calls (AkShare, price store) so they never stall the event loop
+data_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("DATA_POOL_WORKERS", "8")), thread_name_prefix="data")
 
 
-def get_user_supabase(request: Request) -> Client:
+async def run_blocking(fn, *args):
     """
-    Creates a Supabase client scoped to the authenticated user.
+    Runs a blocking data-source call on the shared data pool (in the request's
+    context, so its stage timings count towards the request).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(data_pool, in_context(functools.partial(fn, *args)))
+
+
+def get_user_supabase(request: Request) -> "SyncPostgrestClient":
+    """
+    PostgREST client scoped to the authenticated user. Only the headers are per
+    request; connections come from the shared pool.
     """
     if init_error:
         raise HTTPException(status_code=500, detail=f"Database config error: {init_error}")
@@ -51,177 +110,216 @@ def get_user_supabase(request: Request) -> Client:
     if not auth_header:
          raise HTTPException(status_code=401, detail="Missing Authorization Header")
 
-    # Create fresh client
-    client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
     # Inject token (User Context)
-    client.postgrest.auth(auth_header.replace("Bearer ", ""))
-    return client
+    return supabase_pool.client(auth_header.replace("Bearer ", ""))
+
+
+def request_user_id(request: Request) -> Optional[str]:
+    """
+    Reads the user id (`sub`) from the bearer JWT. The token is verified by
+    PostgREST on every query, so this is only used to fill `user_id` columns.
+    """
+    import base64
+    token = (request.headers.get('Authorization') or "").replace("Bearer ", "")
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload)).get("sub")
+    except (IndexError, ValueError):
+        return None
 
 # Models
 class FetchRequest(BaseModel):
-    stock_code: str
+    stock_code: Optional[str] = None
+    stock_codes: Optional[List[str]] = None
 
 class BatchAnalyzeRequest(BaseModel):
     corpus_ids: List[str]
+    packed: bool = False  # several items per LLM request (short news/report texts)
+    cascade: bool = False  # opt-in: settle clear-cut items with the local lexicon, LLM for the rest
+
+class AnalysisJobRequest(BaseModel):
+    stock_code: str
 
 class CleanupRequest(BaseModel):
     stock_code: str
+    full: bool = False  # rescan everything, ignoring the high-water marks
 
 class TechnicalIndicatorsRequest(BaseModel):
     stock_code: str
     days: int = 60
+    wait_ai: float = 25  # seconds of the request budget to wait for fresh commentary; 0 returns cached/pending at once
+
+class TechnicalIndicatorsBatchRequest(BaseModel):
+    stock_codes: List[str]
+    days: int = 60
+    include_ai: bool = False
+
+INDICATOR_EXPLANATIONS = {
+    "ma": "移动平均线：MA5>MA10>MA20为多头排列，反之为空头排列",
+    "macd": "MACD：DIF上穿DEA为金叉(买入信号)，下穿为死叉(卖出信号)",
+    "rsi": "RSI：>70超买可能回调，<30超卖可能反弹",
+    "kdj": "KDJ：K>80或J>100超买，K<20或J<0超卖"
+}
+
+SIGNAL_COLUMNS = ["ma_trend", "macd_signal", "rsi_signal", "kdj_signal"]
+MAX_BATCH_STOCKS = 200
+
+
+async def technical_commentary(stock_code, indicators_now, signals):
+    """
+    Asks DeepSeek for a short technical read of the latest indicator values.
+    Returns "" when no API key is configured; raises if the call fails, so the
+    commentary cache never stores an error.
+    """
+    if not os.environ.get("DEEPSEEK_API_KEY"):
+        return ""
+    prompt_text = f"""请用中文分析股票 {stock_code} 的技术指标并给出操作建议：
+
+当前价格：{indicators_now['close']}
+均线：MA5={indicators_now['ma5']}, MA10={indicators_now['ma10']}, MA20={indicators_now['ma20']} ({signals['ma_trend']})
+MACD：DIF={indicators_now['macd_dif']}, DEA={indicators_now['macd_dea']}, 柱状={indicators_now['macd_hist']} ({signals['macd_signal']})
+RSI(14)：{indicators_now['rsi']} ({signals['rsi_signal']})
+KDJ：K={indicators_now['k']}, D={indicators_now['d']}, J={indicators_now['j']} ({signals['kdj_signal']})
+
+请综合以上指标，给出：
+1. 短期趋势判断（1-5天）
+2. 中期趋势判断（1-2周）  
+3. 操作建议（买入/持有/观望/卖出）
+4. 风险提示
+
+回复请简洁专业，控制在200字以内。"""
+
+    response = await get_dispatcher().chat(
+        model="deepseek-chat",
+        messages=[
+            {"role": "system", "content": "你是专业的股票技术分析师，擅长解读技术指标。"},
+            {"role": "user", "content": prompt_text}
+        ],
+        max_tokens=500,
+        temperature=0.3
+    )
+    return response.choices[0].message.content
+
+
+commentary_cache = CommentaryCache(technical_commentary)
+
 
 # --- Technical Indicators Endpoint ---
 @app.post("/api/technical_indicators")
-async def get_technical_indicators(req: TechnicalIndicatorsRequest):
+async def get_technical_indicators(req: TechnicalIndicatorsRequest, request: Request):
     """
     Calculates technical indicators (MA, MACD, RSI, KDJ) for a stock.
-    Returns indicator values and AI-generated technical analysis.
+    Returns indicator values and AI-generated technical analysis. The commentary
+    comes from the commentary cache and is awaited for up to `wait_ai` seconds:
+    `ai_status` is "ready", "stale" (previous text while a refresh runs), "pending"
+    or "unavailable" (the last attempt failed; retried after a delay).
     """
-    import pandas as pd
-    from ta.trend import MACD, SMAIndicator
-    from ta.momentum import RSIIndicator, StochasticOscillator
-    from openai import OpenAI
-    
+    current_llm_user.set(request_user_id(request))
     stock_code = req.stock_code
     days = req.days
     
     try:
-        # 1. Fetch historical price data
-        df = ak.stock_zh_a_hist(symbol=stock_code, period="daily", adjust="qfq")
+        # 1. Last N days of price history from the shared store
+        df = await run_blocking(price_store.tail, stock_code, days)
         if df is None or df.empty:
             return {"error": "无法获取股票数据"}
         
-        # Use last N days
-        df = df.tail(days).copy()
-        # AkShare returns 12 columns: ['日期', '股票代码', '开盘', '收盘', '最高', '最低', '成交量', '成交额', '振幅', '涨跌幅', '涨跌额', '换手率']
-        df.columns = ['date', 'stock_code', 'open', 'close', 'high', 'low', 'volume', 'amount', 'amplitude', 'change_pct', 'change_amt', 'turnover']
-        
-        # 2. Calculate Moving Averages
-        df['ma5'] = SMAIndicator(close=df['close'], window=5).sma_indicator()
-        df['ma10'] = SMAIndicator(close=df['close'], window=10).sma_indicator()
-        df['ma20'] = SMAIndicator(close=df['close'], window=20).sma_indicator()
-        
-        # 3. Calculate MACD
-        macd = MACD(close=df['close'], window_slow=26, window_fast=12, window_sign=9)
-        df['macd_dif'] = macd.macd()
-        df['macd_dea'] = macd.macd_signal()
-        df['macd_hist'] = macd.macd_diff()
-        
-        # 4. Calculate RSI (14-day)
-        rsi = RSIIndicator(close=df['close'], window=14)
-        df['rsi'] = rsi.rsi()
-        
-        # 5. Calculate KDJ (Stochastic)
-        stoch = StochasticOscillator(high=df['high'], low=df['low'], close=df['close'], window=9, smooth_window=3)
-        df['k'] = stoch.stoch()
-        df['d'] = stoch.stoch_signal()
-        df['j'] = 3 * df['k'] - 2 * df['d']
-        
-        # Get latest values
-        latest = df.iloc[-1]
-        prev = df.iloc[-2] if len(df) > 1 else latest
+        # 2. MA / MACD / RSI / KDJ in one vectorized pass
+        ind = indicators.compute(df['close'].to_numpy(), df['high'].to_numpy(), df['low'].to_numpy())
         
-        # Determine signals
-        ma_trend = "多头排列" if latest['ma5'] > latest['ma10'] > latest['ma20'] else "空头排列" if latest['ma5'] < latest['ma10'] < latest['ma20'] else "震荡整理"
-        macd_signal = "金叉" if prev['macd_dif'] < prev['macd_dea'] and latest['macd_dif'] > latest['macd_dea'] else "死叉" if prev['macd_dif'] > prev['macd_dea'] and latest['macd_dif'] < latest['macd_dea'] else "持续多头" if latest['macd_dif'] > latest['macd_dea'] else "持续空头"
-        rsi_signal = "超买" if latest['rsi'] > 70 else "超卖" if latest['rsi'] < 30 else "中性"
-        kdj_signal = "超买" if latest['k'] > 80 or latest['j'] > 100 else "超卖" if latest['k'] < 20 or latest['j'] < 0 else "中性"
+        # Determine signals from the last two bars
+        signals = indicators.signals(
+            {name: values[-1] for name, values in ind.items()},
+            {name: values[-2] if len(values) > 1 else values[-1] for name, values in ind.items()},
+        )
         
-        # Prepare chart data (last 30 days for visualization)
-        chart_data = []
-        for idx, row in df.tail(30).iterrows():
-            chart_data.append({
-                "date": str(row['date'])[:10] if hasattr(row['date'], 'strftime') else str(row['date'])[:10],
-                "close": round(float(row['close']), 2),
-                "ma5": round(float(row['ma5']), 2) if pd.notna(row['ma5']) else None,
-                "ma10": round(float(row['ma10']), 2) if pd.notna(row['ma10']) else None,
-                "ma20": round(float(row['ma20']), 2) if pd.notna(row['ma20']) else None,
-                "macd_dif": round(float(row['macd_dif']), 4) if pd.notna(row['macd_dif']) else None,
-                "macd_dea": round(float(row['macd_dea']), 4) if pd.notna(row['macd_dea']) else None,
-                "macd_hist": round(float(row['macd_hist']), 4) if pd.notna(row['macd_hist']) else None,
-                "rsi": round(float(row['rsi']), 2) if pd.notna(row['rsi']) else None,
-                "k": round(float(row['k']), 2) if pd.notna(row['k']) else None,
-                "d": round(float(row['d']), 2) if pd.notna(row['d']) else None,
-                "j": round(float(row['j']), 2) if pd.notna(row['j']) else None,
-            })
+        # Prepare chart data (last 30 days for visualization), built column-wise
+        chart_data = indicators.chart_payload(df['date'].to_numpy(), ind, rows=30)
         
         # Current indicator values
-        indicators = {
-            "ma5": round(float(latest['ma5']), 2) if pd.notna(latest['ma5']) else None,
-            "ma10": round(float(latest['ma10']), 2) if pd.notna(latest['ma10']) else None,
-            "ma20": round(float(latest['ma20']), 2) if pd.notna(latest['ma20']) else None,
-            "macd_dif": round(float(latest['macd_dif']), 4) if pd.notna(latest['macd_dif']) else None,
-            "macd_dea": round(float(latest['macd_dea']), 4) if pd.notna(latest['macd_dea']) else None,
-            "macd_hist": round(float(latest['macd_hist']), 4) if pd.notna(latest['macd_hist']) else None,
-            "rsi": round(float(latest['rsi']), 2) if pd.notna(latest['rsi']) else None,
-            "k": round(float(latest['k']), 2) if pd.notna(latest['k']) else None,
-            "d": round(float(latest['d']), 2) if pd.notna(latest['d']) else None,
-            "j": round(float(latest['j']), 2) if pd.notna(latest['j']) else None,
-            "close": round(float(latest['close']), 2),
-        }
+        indicators_now = indicators.latest_values(ind)
         
-        signals = {
-            "ma_trend": ma_trend,
-            "macd_signal": macd_signal,
-            "rsi_signal": rsi_signal,
-            "kdj_signal": kdj_signal,
-        }
-        
-        # 6. AI Technical Analysis
-        ai_analysis = ""
-        try:
-            DEEPSEEK_API_KEY = os.environ.get("DEEPSEEK_API_KEY")
-            if DEEPSEEK_API_KEY:
-                client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com")
-                prompt = f"""请用中文分析股票 {stock_code} 的技术指标并给出操作建议：
-
-当前价格：{indicators['close']}
-均线：MA5={indicators['ma5']}, MA10={indicators['ma10']}, MA20={indicators['ma20']} ({ma_trend})
-MACD：DIF={indicators['macd_dif']}, DEA={indicators['macd_dea']}, 柱状={indicators['macd_hist']} ({macd_signal})
-RSI(14)：{indicators['rsi']} ({rsi_signal})
-KDJ：K={indicators['k']}, D={indicators['d']}, J={indicators['j']} ({kdj_signal})
-
-请综合以上指标，给出：
-1. 短期趋势判断（1-5天）
-2. 中期趋势判断（1-2周）  
-3. 操作建议（买入/持有/观望/卖出）
-4. 风险提示
-
-回复请简洁专业，控制在200字以内。"""
-
-                response = client.chat.completions.create(
-                    model="deepseek-chat",
-                    messages=[
-                        {"role": "system", "content": "你是专业的股票技术分析师，擅长解读技术指标。"},
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=500,
-                    temperature=0.3
-                )
-                ai_analysis = response.choices[0].message.content
-        except Exception as e:
-            ai_analysis = f"AI分析暂不可用: {str(e)}"
+        # 3. AI Technical Analysis (cached per indicator snapshot, awaited within the request budget)
+        ai_status, ai_analysis = await commentary_cache.get(
+            stock_code, df['date'].iloc[-1], indicators_now, signals, wait=min(req.wait_ai, 30)
+        )
         
         return {
             "status": "success",
             "stock_code": stock_code,
-            "indicators": indicators,
+            "indicators": indicators_now,
             "signals": signals,
             "chart_data": chart_data,
             "ai_analysis": ai_analysis,
-            "indicator_explanations": {
-                "ma": "移动平均线：MA5>MA10>MA20为多头排列，反之为空头排列",
-                "macd": "MACD：DIF上穿DEA为金叉(买入信号)，下穿为死叉(卖出信号)",
-                "rsi": "RSI：>70超买可能回调，<30超卖可能反弹",
-                "kdj": "KDJ：K>80或J>100超买，K<20或J<0超卖"
-            }
+            "ai_status": ai_status,
+            "indicator_explanations": INDICATOR_EXPLANATIONS
         }
         
     except Exception as e:
         print(f"Technical indicators error: {e}")
         return {"status": "error", "error": str(e)}
 
+
+@app.post("/api/technical_indicators/batch")
+async def get_technical_indicators_batch(req: TechnicalIndicatorsBatchRequest, request: Request):
+    """
+    Portfolio overview: signals for many stocks in one request.
+    - Price histories are fetched in parallel on the bounded data pool
+    - Indicators are computed for all stocks at once as an (N, days) array
+    Returns a compact matrix: signals[code] = [ma_trend, macd_signal, rsi_signal, kdj_signal]
+    """
+    current_llm_user.set(request_user_id(request))
+    codes = list(dict.fromkeys(req.stock_codes))[:MAX_BATCH_STOCKS]
+    if not codes:
+        return {"status": "success", "columns": SIGNAL_COLUMNS, "signals": {}, "close": {}, "errors": {}}
+
+    # 1. Fetch every history concurrently; one failing symbol doesn't fail the batch
+    frames = await asyncio.gather(
+        *[run_blocking(price_store.tail, code, req.days) for code in codes],
+        return_exceptions=True,
+    )
+    errors = {}
+    loaded = []
+    for code, df in zip(codes, frames):
+        if isinstance(df, Exception):
+            errors[code] = str(df)
+        elif df is None or df.empty:
+            errors[code] = "无法获取股票数据"
+        else:
+            loaded.append((code, df))
+
+    if not loaded:
+        return {"status": "error", "columns": SIGNAL_COLUMNS, "signals": {}, "close": {}, "errors": errors}
+
+    # 2. Stack into left-padded (N, T) arrays and compute everything in one pass
+    ok_codes = [code for code, _ in loaded]
+    close = indicators.pad_left([df['close'].to_numpy() for _, df in loaded])
+    high = indicators.pad_left([df['high'].to_numpy() for _, df in loaded])
+    low = indicators.pad_left([df['low'].to_numpy() for _, df in loaded])
+    ind = indicators.compute(close, high, low)
+    signals = indicators.signals(
+        {name: values[:, -1] for name, values in ind.items()},
+        {name: values[:, -2] if values.shape[1] > 1 else values[:, -1] for name, values in ind.items()},
+    )
+    matrix = {code: [signals[col][i] for col in SIGNAL_COLUMNS] for i, code in enumerate(ok_codes)}
+    closes = dict(zip(ok_codes, indicators.rounded_column(ind["close"][:, -1], 2)))
+
+    result = {"status": "success", "columns": SIGNAL_COLUMNS, "signals": matrix, "close": closes, "errors": errors}
+
+    # 3. Optional per-stock AI commentary (shares the single-flight commentary cache)
+    if req.include_ai:
+        async def commentary(i, code, df):
+            latest = indicators.latest_values({name: values[i] for name, values in ind.items()})
+            _, text = await commentary_cache.get(
+                code, df['date'].iloc[-1], latest, dict(zip(SIGNAL_COLUMNS, matrix[code])), wait=60
+            )
+            return text
+        texts = await asyncio.gather(*[commentary(i, code, df) for i, (code, df) in enumerate(loaded)])
+        result["ai_analysis"] = dict(zip(ok_codes, texts))
+
+    return result
+
 # --- 0. Cleanup Duplicates & English Data ---
 @app.post("/api/cleanup_data")
 async def cleanup_data(req: CleanupRequest, request: Request):
@@ -230,73 +328,20 @@ async def cleanup_data(req: CleanupRequest, request: Request):
     - Removes duplicate raw_corpus entries (keeps newest per title)
     - Deletes sentiment_results with English summaries
     - Resets is_analyzed flag for re-analysis
+    Only rows added since the previous cleanup are scanned unless `full` is set.
     """
-    import re
     supabase = get_user_supabase(request)
-    stock_code = req.stock_code
-    
-    deleted_duplicates = 0
-    deleted_english = 0
-    reset_count = 0
-    
     try:
-        # 1. Get all raw_corpus for this stock
-        all_corpus = supabase.table("raw_corpus").select("id, title, publish_time").eq("stock_code", stock_code).order("publish_time", desc=True).execute()
-        
-        if all_corpus.data:
-            # Find duplicates (keep first occurrence which is newest due to desc order)
-            seen_titles = {}
-            duplicate_ids = []
-            for item in all_corpus.data:
-                title = item["title"]
-                if title in seen_titles:
-                    duplicate_ids.append(item["id"])
-                else:
-                    seen_titles[title] = item["id"]
-            
-            # Delete duplicates from raw_corpus (cascade will delete sentiment_results)
-            if duplicate_ids:
-                supabase.table("raw_corpus").delete().in_("id", duplicate_ids).execute()
-                deleted_duplicates = len(duplicate_ids)
-        
-        # 2. Find and delete sentiment_results with English summaries
-        # Get remaining corpus IDs
-        remaining = supabase.table("raw_corpus").select("id").eq("stock_code", stock_code).execute()
-        if remaining.data:
-            corpus_ids = [r["id"] for r in remaining.data]
-            
-            # Get sentiment results for these
-            results = supabase.table("sentiment_results").select("id, corpus_id, summary").in_("corpus_id", corpus_ids).execute()
-            
-            if results.data:
-                # Check for English text (mostly ASCII letters means English)
-                english_ids = []
-                corpus_to_reset = []
-                for r in results.data:
-                    summary = r.get("summary", "") or ""
-                    # If more than 50% ASCII letters, consider it English
-                    ascii_letters = sum(1 for c in summary if c.isascii() and c.isalpha())
-                    if len(summary) > 10 and ascii_letters / max(len(summary), 1) > 0.5:
-                        english_ids.append(r["id"])
-                        corpus_to_reset.append(r["corpus_id"])
-                
-                # Delete English sentiment results
-                if english_ids:
-                    supabase.table("sentiment_results").delete().in_("id", english_ids).execute()
-                    deleted_english = len(english_ids)
-                
-                # Reset is_analyzed for affected corpus entries
-                if corpus_to_reset:
-                    supabase.table("raw_corpus").update({"is_analyzed": False}).in_("id", corpus_to_reset).execute()
-                    reset_count = len(corpus_to_reset)
-        
-        return {
-            "status": "success",
-            "deleted_duplicates": deleted_duplicates,
-            "deleted_english_summaries": deleted_english,
-            "reset_for_reanalysis": reset_count
-        }
-    
+        # cleanup_state is service-role only; without the key every run is a full scan
+        report = await run_blocking(functools.partial(cleanup.run_cleanup, supabase, req.stock_code, llm_cache,
+                                                      req.full, state_client=get_service_supabase() or supabase))
+        if report["deleted_duplicates"] or report["deleted_english_summaries"]:
+            # Deleted results must leave the daily rollups too (replace_sentiment_rollup is service-role only)
+            try:
+                await run_blocking(rollups.rebuild, get_service_supabase() or supabase, req.stock_code)
+            except Exception as e:
+                print(f"Sentiment rollup rebuild failed for {req.stock_code}: {e}")
+        return {"status": "success", **report}
     except Exception as e:
         print(f"Cleanup error: {e}")
         return {"status": "error", "error": str(e)}
@@ -307,85 +352,22 @@ async def fetch_raw(req: FetchRequest, request: Request):
     """
     Fetches news AND research reports from AkShare and saves to raw_corpus.
     - Limited to last 10 days
-    - Deduplicates by title
+    - Deduplicates by title fingerprint (upsert) and collapses reworded headlines
+    - Accepts `stock_codes` to ingest a whole portfolio in one call; every
+      source/stock pair is fetched concurrently with a per-source timeout
     """
-    from datetime import timedelta
-    
     supabase = get_user_supabase(request)
-    stock_code = req.stock_code
-    new_count = 0
-    ten_days_ago = datetime.now() - timedelta(days=10)
+    codes = req.stock_codes or ([req.stock_code] if req.stock_code else [])
+    if not codes:
+        return {"status": "error", "error": "stock_code or stock_codes required"}
 
     try:
-        records = []
-        
-        # 1. Fetch News (东方财富)
-        try:
-            df_news = ak.stock_news_em(symbol=stock_code)
-            for _, row in df_news.head(20).iterrows():
-                pub_time_str = row.get("发布时间", "")
-                try:
-                    pub_time = datetime.strptime(pub_time_str, "%Y-%m-%d %H:%M:%S")
-                except:
-                    pub_time = datetime.now()
-                
-                if pub_time >= ten_days_ago:
-                    title = row.get("新闻标题", "No Title")
-                    records.append({
-                        "stock_code": stock_code,
-                        "source": "news",
-                        "title": title,
-                        "content": row.get("新闻内容", "") or title,
-                        "publish_time": pub_time.isoformat(),
-                        "is_analyzed": False
-                    })
-        except Exception as e:
-            print(f"News fetch error: {e}")
-
-        # 2. Fetch Research Reports (研报)
-        try:
-            df_report = ak.stock_research_report_em(symbol=stock_code)
-            for _, row in df_report.head(10).iterrows():
-                pub_date = row.get("日期", "")
-                try:
-                    pub_time = datetime.strptime(str(pub_date), "%Y-%m-%d")
-                except:
-                    pub_time = datetime.now()
-                
-                if pub_time >= ten_days_ago:
-                    title = row.get("报告名称", "研报")
-                    org = row.get("研究机构", "")
-                    rating = row.get("评级", "")
-                    content = f"[{org}] {title} - 评级: {rating}"
-                    records.append({
-                        "stock_code": stock_code,
-                        "source": "report",
-                        "title": title,
-                        "content": content,
-                        "publish_time": pub_time.isoformat(),
-                        "is_analyzed": False
-                    })
-        except Exception as e:
-            print(f"Research report fetch error: {e}")
-
-        # 3. Deduplicate: Check existing titles for this stock
-        if records:
-            titles = [r["title"] for r in records]
-            existing = supabase.table("raw_corpus").select("title").eq("stock_code", stock_code).in_("title", titles).execute()
-            existing_titles = set([r["title"] for r in existing.data]) if existing.data else set()
-            
-            # Filter out duplicates
-            unique_records = [r for r in records if r["title"] not in existing_titles]
-            
-            if unique_records:
-                data, count = supabase.table("raw_corpus").insert(unique_records).execute()
-                new_count = len(data[1]) if data and len(data) > 1 else len(unique_records)
-
+        result = await ingest.ingest(supabase, codes[:MAX_BATCH_STOCKS], data_pool, near_dups=near_dups)
     except Exception as e:
         print(f"Error fetching data: {e}")
         return {"status": "partial_success", "error": str(e)}
 
-    return {"status": "success", "new_items": new_count}
+    return {"status": "success", **result}
 
 
 # --- 2. Batch Analyze (DB -> LLM -> DB) ---
@@ -393,95 +375,192 @@ async def fetch_raw(req: FetchRequest, request: Request):
 async def analyze_batch(req: BatchAnalyzeRequest, request: Request):
     """
     Receives list of corpus_ids, calls DeepSeek, saves results.
+    Cached and (with `cascade`) confidently lexicon-scored items skip the model;
+    `split` reports how many items each tier settled.
+    Items the model still couldn't score after retries are returned in `failed_ids`
+    and stay unanalyzed, so the dashboard can retry them. Rows an analysis worker
+    currently holds are left to it and returned in `leased_ids`.
     """
     supabase = get_user_supabase(request)
+    current_llm_user.set(request_user_id(request))
 
     ids = req.corpus_ids
     if not ids:
-        return {"success": True, "processed_count": 0}
+        return {"success": True, "processed_count": 0, "failed_ids": [], "leased_ids": [],
+                "cache": {"hits": 0, "lexicon": 0, "misses": 0, "failed": 0},
+                "split": {"cache": 0, "lexicon": 0, "llm": 0}}
 
     # 1. Fetch Content
     response = supabase.table("raw_corpus").select("*").in_("id", ids).execute()
-    items = response.data
+    items, leased_ids = split_leased(response.data or [])
 
-    processed_results = []
-    
-    # 2. Parallel Analysis using asyncio
-    tasks = [analyze_single_item(item) for item in items]
-    results = await asyncio.gather(*tasks)
+    # 2. Cached results first, then parallel (optionally packed) analysis of the misses
+    results, cache_stats = await analyze_items(items, llm_cache, supabase, packed=req.packed, cascade=req.cascade)
 
-    # 3. Save Results
-    sentiment_inserts = []
-    analyzed_ids = []
+    # 3. Save Results & mark as analyzed
+    analyzed_ids = persist_results(supabase, results, items)
 
-    for res in results:
-        if res:
-            sentiment_inserts.append(res)
-            analyzed_ids.append(res["corpus_id"])
+    done = set(analyzed_ids)
+    failed_ids = [item["id"] for item in items if item["id"] not in done]
+    return {"success": True, "processed_count": len(analyzed_ids), "failed_ids": failed_ids,
+            "leased_ids": leased_ids, "cache": cache_stats, "split": cascade_split(cache_stats, len(items))}
 
-    if sentiment_inserts:
-        supabase.table("sentiment_results").insert(sentiment_inserts).execute()
-        
-    # 4. Mark as Analyzed
+def split_leased(items):
+    """
+    Splits fetched corpus rows into (free rows, ids of rows a worker holds a lease on),
+    so the API never scores a row a worker is scoring at the same time.
+    """
+    free, leased_ids = [], []
+    for item in items:
+        if analysis_worker.is_leased(item):
+            leased_ids.append(item["id"])
+        else:
+            free.append(item)
+    return free, leased_ids
+
+def persist_results(supabase, results, items):
+    """
+    Inserts sentiment_results rows, flags their corpus rows (from `items`) as
+    analyzed and folds them into the daily rollups. Returns the analyzed corpus ids.
+    The rollup function is service-role only; without SUPABASE_SERVICE_ROLE_KEY the
+    call is refused and logged, and jobs/rebuild_rollups.py can catch up.
+    """
+    analyzed_ids = [res["corpus_id"] for res in results]
+    if results:
+        supabase.table("sentiment_results").insert(results).execute()
     if analyzed_ids:
-        supabase.table("raw_corpus").update({"is_analyzed": True}).in_("id", analyzed_ids).execute()
+        # Independent once the results are stored
+        parallel(
+            lambda: supabase.table("raw_corpus").update({"is_analyzed": True}).in_("id", analyzed_ids).execute(),
+            lambda: rollups.apply(get_service_supabase() or supabase, items, results),
+        )
+    return analyzed_ids
+
+
+STREAM_FLUSH_ROWS = 10        # commit a micro-batch once this many rows are scored...
+STREAM_FLUSH_SECONDS = 0.5    # ...or once the oldest unsaved row is this old
+STREAM_HEARTBEAT_SECONDS = 10
+
 
-    return {"success": True, "processed_count": len(analyzed_ids)}
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-# --- DeepSeek Helper ---
-async def analyze_single_item(item):
+
+@app.post("/api/analyze_batch/stream")
+async def analyze_batch_stream(req: BatchAnalyzeRequest, request: Request):
     """
-    Calls DeepSeek API for sentiment analysis.
-    Outputs in Chinese.
+    Streaming analyze_batch over Server-Sent Events. Rows are committed in micro-batches
+    while scoring continues, and each is emitted once persisted:
+    - start:     {"total"}
+    - result:    a sentiment_results row
+    - failed:    {"corpus_id"} (left unanalyzed for a later retry)
+    - heartbeat: {"elapsed"} while waiting on slow model calls
+    - summary:   {"processed_count", "failed_ids", "leased_ids", "cache", "split", "elapsed"}
     """
-    try:
-        text = f"{item['title']} \n {item['content']}"
-        source = item['source']
-        
-        api_key = os.environ.get("DEEPSEEK_API_KEY")
-        if not api_key:
-            # Fallback for demo without key
-            print("DEEPSEEK_API_KEY not set, using mock.")
-            await asyncio.sleep(0.3) 
-            score = 0.0
-            if "跌" in text or "空" in text or "减持" in text or "下调" in text:
-                score = -0.5
-            elif "涨" in text or "多" in text or "牛" in text or "买入" in text or "增持" in text:
-                score = 0.5
-            summary = f"模拟分析: {item['title'][:20]}..."
-        else:
-            # DeepSeek API Call
-            from openai import AsyncOpenAI
-            client = AsyncOpenAI(api_key=api_key, base_url="https://api.deepseek.com/v1")
-            
-            completion = await client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "system", "content": "你是一位专业的金融情感分析师。分析以下财经文本的情绪倾向。请用中文回复，格式为JSON: { \"score\": 浮点数(-1到1, -1极度看空, 0中性, 1极度看多), \"summary\": \"一句话中文解释分析理由\" }"},
-                    {"role": "user", "content": f"请分析以下内容的情绪: {text}"}
-                ]
-            )
-            content = completion.choices[0].message.content
+    supabase = get_user_supabase(request)
+    current_llm_user.set(request_user_id(request))
+
+    items, leased_ids = [], []
+    if req.corpus_ids:
+        response = await run_blocking(supabase.table("raw_corpus").select("*").in_("id", req.corpus_ids).execute)
+        items, leased_ids = split_leased(response.data or [])
+
+    async def events():
+        started = time.monotonic()
+        stats = {}
+        queue = asyncio.Queue()
+
+        async def produce():
             try:
-                import json
-                clean_content = content.replace("```json", "").replace("```", "").strip()
-                data = json.loads(clean_content)
-                score = data.get('score', 0)
-                summary = data.get('summary', '分析完成')
-            except:
-                score = 0
-                summary = content[:50] if content else "解析失败"
-
-        # Handle all source types
-        return {
-            "corpus_id": item['id'],
-            "news_score_raw": score if source in ['news', 'report'] else None,
-            "guba_score_raw": score if source == 'guba' else None,
-            "summary": summary
-        }
+                async for item, row in iter_analyzed(items, llm_cache, supabase, packed=req.packed,
+                                                     stats=stats, cascade=req.cascade):
+                    await queue.put((item, row))
+            finally:
+                await queue.put(None)
+
+        producer = asyncio.create_task(produce())
+        unsaved, unsaved_since = [], None
+        processed, failed_ids = 0, []
+        try:
+            yield sse_event("start", {"total": len(items)})
+            finished = False
+            while not finished or unsaved:
+                entry = False  # timed out waiting
+                if not finished:
+                    timeout = STREAM_FLUSH_SECONDS if unsaved else STREAM_HEARTBEAT_SECONDS
+                    try:
+                        entry = await asyncio.wait_for(queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                if entry is None:
+                    finished = True
+                elif entry:
+                    item, row = entry
+                    if row:
+                        unsaved_since = unsaved_since or time.monotonic()
+                        unsaved.append(row)
+                    else:
+                        failed_ids.append(item["id"])
+                        yield sse_event("failed", {"corpus_id": item["id"]})
+                elif not unsaved:
+                    yield sse_event("heartbeat", {"elapsed": round(time.monotonic() - started, 1)})
+
+                if unsaved and (finished or len(unsaved) >= STREAM_FLUSH_ROWS
+                                or time.monotonic() - unsaved_since >= STREAM_FLUSH_SECONDS):
+                    batch, unsaved, unsaved_since = unsaved, [], None
+                    await run_blocking(persist_results, supabase, batch, items)
+                    processed += len(batch)
+                    for row in batch:
+                        yield sse_event("result", row)
+
+            await producer
+            yield sse_event("summary", {
+                "processed_count": processed,
+                "failed_ids": failed_ids,
+                "leased_ids": leased_ids,
+                "cache": stats,
+                "split": cascade_split(stats, len(items)),
+                "elapsed": round(time.monotonic() - started, 2),
+            })
+        except Exception as e:
+            print(f"Streaming analysis error: {e}")
+            yield sse_event("error", {"error": str(e), "processed_count": processed})
+        finally:
+            producer.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# --- 2b. Server-side Analysis Jobs (drained by jobs/analysis_worker.py) ---
+@app.post("/api/analysis_jobs")
+async def create_analysis_job(req: AnalysisJobRequest, request: Request):
+    """
+    Queues every pending raw_corpus row of a stock for the analysis worker.
+    Returns the job id to poll; no LLM work happens in this request.
+    """
+    supabase = get_user_supabase(request)
+    try:
+        job = await run_blocking(functools.partial(analysis_worker.create_job, supabase, req.stock_code,
+                                                   request_user_id(request), service=get_service_supabase()))
+        return {"status": "success", **job}
     except Exception as e:
-        print(f"Analysis failed for {item['id']}: {e}")
-        return None
+        print(f"Create analysis job error: {e}")
+        return {"status": "error", "error": str(e)}
+
+
+@app.get("/api/analysis_jobs/{job_id}")
+async def get_analysis_job(job_id: str, request: Request):
+    """
+    Progress of an analysis job: {state, total, done, failed}.
+    """
+    supabase = get_user_supabase(request)
+    try:
+        progress = await run_blocking(functools.partial(analysis_worker.job_progress, supabase, job_id,
+                                                        service=get_service_supabase()))
+        return {"status": "success", **progress}
+    except Exception as e:
+        print(f"Analysis job progress error: {e}")
+        return {"status": "error", "error": str(e)}
 
 
 # --- 3. Fetch Stock Price Data ---
@@ -492,23 +571,12 @@ class StockPriceRequest(BaseModel):
 @app.post("/api/stock_price")
 async def get_stock_price(req: StockPriceRequest):
     """
-    Fetches daily stock prices from AkShare.
+    Fetches daily stock prices (AkShare qfq, via the shared price store).
     Returns: list of {date, close, open, high, low, volume}
     """
     try:
-        # AkShare function for A-share daily data
-        df = ak.stock_zh_a_hist(symbol=req.stock_code, period="daily", adjust="qfq")
-        # Take last N days
-        df = df.tail(req.days)
-        # Rename columns to English
-        df = df.rename(columns={
-            "日期": "date",
-            "开盘": "open",
-            "收盘": "close",
-            "最高": "high",
-            "最低": "low",
-            "成交量": "volume"
-        })
+        # Last N days, served from the local store (one upstream fetch per session)
+        df = await run_blocking(price_store.tail, req.stock_code, req.days)
         # Convert to list of dicts
         result = df[["date", "open", "close", "high", "low", "volume"]].to_dict(orient="records")
         return {"status": "success", "data": result}
@@ -517,22 +585,149 @@ async def get_stock_price(req: StockPriceRequest):
         return {"status": "error", "error": str(e)}
 
 
+# --- 3b. Daily Sentiment Series (rollups merged with prices) ---
+@app.post("/api/sentiment_series")
+async def get_sentiment_series(req: StockPriceRequest, request: Request):
+    """
+    Per-day close plus news/guba sentiment means and counts from the sentiment_daily
+    rollups, and the day's most decisive summary. The client weights the sources.
+    Returns: list of {date, close, news: {mean, count} | null, guba: ..., summary}
+    """
+    try:
+        supabase = get_user_supabase(request)
+        # Prices and rollups load side by side; the rollup window is a calendar-day
+        # bound wide enough for `days` trading days and is trimmed by the merge
+        since = (datetime.now() - timedelta(days=req.days * 2 + 14)).strftime("%Y-%m-%d")
+        df, daily = await asyncio.gather(
+            run_blocking(price_store.tail, req.stock_code, req.days),
+            run_blocking(rollups.load, supabase, req.stock_code, since),
+        )
+        if df is None or df.empty:
+            return {"status": "success", "data": []}
+        prices = {"date": df["date"].tolist(), "close": df["close"].tolist()}
+        return {"status": "success", "data": rollups.merge_with_prices(daily, prices)}
+    except Exception as e:
+        print(f"Error fetching sentiment series: {e}")
+        return {"status": "error", "error": str(e)}
+
+
+# --- 3c. Sentiment/Price Backtest & Lead-Lag ---
+class BacktestRequest(BaseModel):
+    stock_codes: List[str]
+    days: int = 250
+    news_weight: float = 0.7      # weights for the lead-lag and event study
+    guba_weight: float = 0.3
+    news_weights: Optional[List[float]] = None  # backtest grid; default 0, 0.1, ..., 1
+    guba_weights: Optional[List[float]] = None
+    max_lag: int = 5
+    horizons: int = 10
+    event_threshold: float = 0.5
+    threshold: float = 0.3        # |signal| needed to hold a position
+    hold: int = 1                 # bars a signal is carried forward
+    delay: int = 1                # bars between the signal day and entry
+    cost_bps: float = 10
+
+MAX_BACKTEST_STOCKS = 500
+MAX_LAG = 20
+MAX_HORIZON = 60
+WEIGHT_STEPS = [round(0.1 * i, 1) for i in range(11)]
+
+
+@app.post("/api/backtest")
+async def run_backtest(req: BacktestRequest, request: Request):
+    """
+    Lead-lag correlations, an event study after strong sentiment days and a
+    long/short backtest over a grid of news/guba weights, for many stocks at once.
+    - Price histories load in parallel on the data pool, rollups in one paged query
+    - The analyses run as (weights, stocks, days) array operations off the event loop
+    """
+    try:
+        codes = list(dict.fromkeys(req.stock_codes))[:MAX_BACKTEST_STOCKS]
+        if not codes:
+            return {"status": "error", "error": "No stock codes"}
+        supabase = get_user_supabase(request)
+        since = (datetime.now() - timedelta(days=req.days * 2 + 14)).strftime("%Y-%m-%d")
+        histories, daily = await asyncio.gather(
+            asyncio.gather(*[run_blocking(price_store.history, code) for code in codes], return_exceptions=True),
+            run_blocking(rollups.load_many, supabase, codes, since),
+        )
+        errors = {code: str(h) for code, h in zip(codes, histories) if isinstance(h, Exception)}
+        loaded = [(code, h) for code, h in zip(codes, histories) if not isinstance(h, Exception) and len(h["date"])]
+        if not loaded:
+            return {"status": "error", "error": "无法获取股票数据", "errors": errors}
+
+        grid = backtest.weight_grid(req.news_weights or WEIGHT_STEPS, req.guba_weights or WEIGHT_STEPS)
+        evaluate = functools.partial(
+            backtest.evaluate,
+            weights=(req.news_weight, req.guba_weight), grid=grid,
+            max_lag=min(max(req.max_lag, 0), MAX_LAG), horizons=min(max(req.horizons, 1), MAX_HORIZON),
+            event_threshold=req.event_threshold, threshold=req.threshold, hold=max(req.hold, 1),
+            delay=max(req.delay, 0), cost_bps=req.cost_bps,
+        )
+        result = await run_blocking(
+            evaluate, [code for code, _ in loaded], [(h["date"], h["close"]) for _, h in loaded], daily, req.days,
+        )
+        return {"status": "success", **result, "errors": errors}
+    except Exception as e:
+        print(f"Backtest error: {e}")
+        return {"status": "error", "error": str(e)}
+
+
 # --- 4. Fetch Stock Info (Name) ---
+class StockInfoBatchRequest(BaseModel):
+    stock_codes: List[str]
+
 @app.get("/api/stock_info/{stock_code}")
 async def get_stock_info(stock_code: str):
     """
-    Gets stock name from AkShare.
+    Gets stock name from the in-memory code index.
     """
     try:
-        # Get A-share stock list
-        df = ak.stock_info_a_code_name()
-        # Find the stock
-        match = df[df["code"] == stock_code]
-        if not match.empty:
-            name = match.iloc[0]["name"]
-            return {"status": "success", "code": stock_code, "name": name}
-        else:
-            return {"status": "success", "code": stock_code, "name": stock_code}
+        name = await run_blocking(stock_index.name, stock_code)
+        return {"status": "success", "code": stock_code, "name": name}
     except Exception as e:
         print(f"Error fetching stock info: {e}")
         return {"status": "error", "code": stock_code, "name": stock_code}
+
+
+@app.post("/api/stock_info/batch")
+async def get_stock_info_batch(req: StockInfoBatchRequest):
+    """
+    Resolves a whole portfolio's names in one call.
+    Returns: {code: name}, unknown codes map to themselves.
+    """
+    try:
+        names = await run_blocking(stock_index.names_for, req.stock_codes)
+        return {"status": "success", "names": names}
+    except Exception as e:
+        print(f"Error fetching stock info batch: {e}")
+        return {"status": "error", "error": str(e), "names": {c: c for c in req.stock_codes}}
+
+
+@app.get("/api/stock_search")
+async def search_stocks(q: str, limit: int = 10):
+    """
+    Prefix and fuzzy search over codes and names for the add-stock box.
+    """
+    try:
+        matches = await run_blocking(stock_index.search, q, min(max(limit, 1), 50))
+        return {"status": "success", "results": matches}
+    except Exception as e:
+        print(f"Error searching stocks: {e}")
+        return {"status": "error", "error": str(e), "results": []}
+
+
+# --- Metrics ---
+@app.get("/api/metrics")
+async def metrics(request: Request):
+    """
+    Prometheus text exposition of this instance's request, stage, LLM and
+    data-source metrics. Set METRICS_TOKEN to require `Authorization: Bearer <token>`.
+    """
+    token = os.environ.get("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    snapshot = get_dispatcher().snapshot()
+    LLM_WINDOW.set(snapshot["in_flight"], field="in_flight")
+    LLM_WINDOW.set(snapshot["limit"], field="limit")
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
@@ -42,6 +42,16 @@ const CustomTooltip = ({ active, payload, label }: any) => {
     return null
 }
 
+// When a server-side analysis worker is running, hand analysis off to it instead of looping here
+const USE_ANALYSIS_WORKER = process.env.NEXT_PUBLIC_ANALYSIS_WORKER === "1"
+// When jobs/ingest_scheduler.py keeps every portfolio stock fresh, "update" only re-reads
+// stocks it refreshed recently instead of fetching and analyzing them again
+const USE_INGEST_SCHEDULER = process.env.NEXT_PUBLIC_INGEST_SCHEDULER === "1"
+const INGEST_FRESH_MS = 15 * 60 * 1000
+const ANALYSIS_POLL_MS = 2000
+// Corpus ids per streaming request; keeps each request well inside the serverless time limit
+const STREAM_CHUNK = 50
+
 export default function Dashboard() {
     const supabase = createClient()
     const [user, setUser] = useState<any>(null)
@@ -68,6 +78,7 @@ export default function Dashboard() {
     const [statusMsg, setStatusMsg] = useState("")
     const [progress, setProgress] = useState(0)
     const [lastUpdateTime, setLastUpdateTime] = useState<string | null>(null)
+    const [ingestedAt, setIngestedAt] = useState<number | null>(null)
     const [showCleanupConfirm, setShowCleanupConfirm] = useState(false)
 
     // Technical Indicators
@@ -91,6 +102,7 @@ export default function Dashboard() {
             fetchChartData(selectedStock)
             fetchNewsDetails(selectedStock)
             fetchTechnicalIndicators(selectedStock)
+            fetchFreshness(selectedStock)
         }
     }, [selectedStock, settings])
 
@@ -112,6 +124,22 @@ export default function Dashboard() {
         }
     }
 
+    // Per-symbol freshness written by the ingestion scheduler (no row: never scheduled yet)
+    const fetchFreshness = async (code: string) => {
+        if (!USE_INGEST_SCHEDULER) return
+        const { data } = await supabase
+            .from('ingest_state')
+            .select('last_ingested_at, last_analyzed_at')
+            .eq('stock_code', code)
+            .maybeSingle()
+        setIngestedAt(data?.last_ingested_at ? new Date(data.last_ingested_at).getTime() : null)
+        // Keep the time of the last manual analysis when the scheduler has none
+        if (data?.last_analyzed_at) setLastUpdateTime(new Date(data.last_analyzed_at).toLocaleString('zh-CN'))
+    }
+
+    const isFreshlyIngested = () =>
+        USE_INGEST_SCHEDULER && ingestedAt !== null && Date.now() - ingestedAt < INGEST_FRESH_MS
+
     const fetchStockInfo = async (code: string) => {
         try {
             // Fetch name
@@ -152,57 +180,29 @@ export default function Dashboard() {
 
     const fetchChartData = async (code: string) => {
         try {
-            // Fetch stock prices
-            const priceRes = await axios.post('/api/stock_price', { stock_code: code, days: 30 })
-            const priceData = priceRes.data.data || []
-
-            // Fetch sentiment data
-            const { data: corpus } = await supabase
-                .from('raw_corpus')
-                .select(`
-                    id, title, publish_time, 
-                    sentiment_results ( news_score_raw, guba_score_raw, summary )
-                `)
-                .eq('stock_code', code)
-                .eq('is_analyzed', true)
-                .order('publish_time', { ascending: true })
-
-            // Group sentiment by date
-            const sentimentMap: Record<string, { total: number, count: number, summaries: string[] }> = {}
-            corpus?.forEach((item: any) => {
-                if (!item.sentiment_results || item.sentiment_results.length === 0) return
-                const res = item.sentiment_results[0]
-                const news = res.news_score_raw || 0
-                const guba = res.guba_score_raw || 0
+            // Daily closes merged server-side with per-source sentiment rollups
+            const { data: { session } } = await supabase.auth.getSession()
+            const config = { headers: { Authorization: `Bearer ${session?.access_token}` } }
+            const seriesRes = await axios.post('/api/sentiment_series', { stock_code: code, days: 30 }, config)
+            const series = seriesRes.data.data || []
 
+            // Weight the day's news/guba means by the user's settings
+            const merged = series.map((day: any) => {
                 let score = 0
                 let weightSum = 0
-                if (res.news_score_raw != null) {
-                    score += news * settings.news_weight
+                if (day.news) {
+                    score += day.news.mean * settings.news_weight
                     weightSum += settings.news_weight
                 }
-                if (res.guba_score_raw != null) {
-                    score += guba * settings.guba_weight
+                if (day.guba) {
+                    score += day.guba.mean * settings.guba_weight
                     weightSum += settings.guba_weight
                 }
-                const finalScore = weightSum > 0 ? score / weightSum : 0
-
-                const date = new Date(item.publish_time).toISOString().split('T')[0]
-                if (!sentimentMap[date]) sentimentMap[date] = { total: 0, count: 0, summaries: [] }
-                sentimentMap[date].total += finalScore
-                sentimentMap[date].count += 1
-                if (res.summary) sentimentMap[date].summaries.push(res.summary)
-            })
-
-            // Merge price and sentiment
-            const merged = priceData.map((p: any) => {
-                const dateStr = typeof p.date === 'string' ? p.date : new Date(p.date).toISOString().split('T')[0]
-                const sentiment = sentimentMap[dateStr]
                 return {
-                    date: dateStr,
-                    close: p.close,
-                    sentiment: sentiment ? parseFloat((sentiment.total / sentiment.count).toFixed(2)) : null,
-                    newsSummary: sentiment?.summaries[0] || null
+                    date: day.date,
+                    close: day.close,
+                    sentiment: weightSum > 0 ? parseFloat((score / weightSum).toFixed(2)) : null,
+                    newsSummary: day.summary
                 }
             })
 
@@ -242,6 +242,9 @@ export default function Dashboard() {
             const res = await axios.post('/api/technical_indicators', { stock_code: code, days: 60 })
             if (res.data.status === 'success') {
                 setTechnicalData(res.data)
+                if (res.data.ai_status === 'pending' || res.data.ai_status === 'stale') {
+                    refreshCommentary(code)
+                }
             }
         } catch (e) {
             console.error("Error fetching technical indicators:", e)
@@ -250,6 +253,20 @@ export default function Dashboard() {
         }
     }
 
+    // Indicators render immediately; the AI commentary is picked up once generated
+    const refreshCommentary = async (code: string) => {
+        try {
+            const res = await axios.post('/api/technical_indicators', { stock_code: code, days: 60, wait_ai: 25 })
+            if (res.data.status === 'success') {
+                setTechnicalData((prev: any) => prev && prev.stock_code === code
+                    ? { ...prev, ai_analysis: res.data.ai_analysis, ai_status: res.data.ai_status }
+                    : prev)
+            }
+        } catch (e) {
+            console.error("Error fetching technical commentary:", e)
+        }
+    }
+
     const deleteStock = async (id: string) => {
         await supabase.from('user_portfolios').delete().eq('id', id)
         fetchPortfolios()
@@ -292,6 +309,64 @@ export default function Dashboard() {
         }
     }
 
+    // Server-side analysis: queue a job for the worker and poll its progress
+    const runAnalysisJob = async (code: string, config: any, progressBase: number, progressSpan: number) => {
+        const jobRes = await axios.post('/api/analysis_jobs', { stock_code: code }, config)
+        if (jobRes.data.status !== 'success') throw new Error(jobRes.data.error)
+        const jobId = jobRes.data.job_id
+
+        while (true) {
+            const { data } = await axios.get(`/api/analysis_jobs/${jobId}`, config)
+            if (data.status !== 'success') throw new Error(data.error)
+            const finished = data.done + data.failed
+            setStatusMsg(`正在分析 ${finished}/${data.total}...`)
+            setProgress(progressBase + (data.total > 0 ? (finished / data.total) * progressSpan : progressSpan))
+            if (data.state === 'done') break
+            await new Promise(resolve => setTimeout(resolve, ANALYSIS_POLL_MS))
+        }
+    }
+
+    // In-request analysis: stream results back as each micro-batch is saved
+    const runAnalysisStream = async (ids: string[], config: any, progressBase: number, progressSpan: number) => {
+        const total = ids.length
+        let finished = 0
+        const report = () => {
+            setStatusMsg(`正在分析 ${finished}/${total}...`)
+            setProgress(progressBase + (total > 0 ? (finished / total) * progressSpan : progressSpan))
+        }
+
+        for (let i = 0; i < total; i += STREAM_CHUNK) {
+            const res = await fetch('/api/analyze_batch/stream', {
+                method: 'POST',
+                headers: { ...config.headers, 'Content-Type': 'application/json' },
+                // Lexicon-first: clear-cut headlines skip the model
+                body: JSON.stringify({ corpus_ids: ids.slice(i, i + STREAM_CHUNK), cascade: true })
+            })
+            if (!res.ok || !res.body) throw new Error(`分析请求失败 (${res.status})`)
+
+            const reader = res.body.getReader()
+            const decoder = new TextDecoder()
+            let buffer = ""
+            while (true) {
+                const { done, value } = await reader.read()
+                if (done) break
+                buffer += decoder.decode(value, { stream: true })
+                const events = buffer.split("\n\n")
+                buffer = events.pop() || ""
+                for (const raw of events) {
+                    const event = raw.match(/^event: (.*)$/m)?.[1]
+                    const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || "{}")
+                    if (event === 'result' || event === 'failed') {
+                        finished += 1
+                        report()
+                    } else if (event === 'error') {
+                        throw new Error(data.error)
+                    }
+                }
+            }
+        }
+    }
+
     const handleFullUpdateInternal = async () => {
         if (!selectedStock) return
 
@@ -317,14 +392,10 @@ export default function Dashboard() {
                 return
             }
 
-            const BATCH_SIZE = 5
-            const total = pendingItems.length
-
-            for (let i = 0; i < total; i += BATCH_SIZE) {
-                const batchIds = pendingItems.slice(i, i + BATCH_SIZE).map(item => item.id)
-                setStatusMsg(`正在分析 ${Math.ceil(i / BATCH_SIZE) + 1}/${Math.ceil(total / BATCH_SIZE)}...`)
-                await axios.post('/api/analyze_batch', { corpus_ids: batchIds }, config)
-                setProgress(50 + Math.min(((i + BATCH_SIZE) / total) * 50, 50))
+            if (USE_ANALYSIS_WORKER) {
+                await runAnalysisJob(selectedStock, config, 50, 50)
+            } else {
+                await runAnalysisStream(pendingItems.map(item => item.id), config, 50, 50)
             }
 
             setStatusMsg("更新完成!")
@@ -342,6 +413,15 @@ export default function Dashboard() {
         setProgress(0)
 
         try {
+            if (isFreshlyIngested()) {
+                setStatusMsg("数据已由后台更新")
+                fetchChartData(selectedStock)
+                fetchNewsDetails(selectedStock)
+                fetchFreshness(selectedStock)
+                setIsUpdating(false)
+                return
+            }
+
             setStatusMsg("正在获取最新数据...")
             const { data: { session } } = await supabase.auth.getSession()
             const config = { headers: { Authorization: `Bearer ${session?.access_token}` } }
@@ -363,14 +443,10 @@ export default function Dashboard() {
                 return
             }
 
-            const BATCH_SIZE = 5
-            const total = pendingItems.length
-
-            for (let i = 0; i < total; i += BATCH_SIZE) {
-                const batchIds = pendingItems.slice(i, i + BATCH_SIZE).map(item => item.id)
-                setStatusMsg(`正在分析 ${Math.ceil(i / BATCH_SIZE) + 1}/${Math.ceil(total / BATCH_SIZE)}...`)
-                await axios.post('/api/analyze_batch', { corpus_ids: batchIds }, config)
-                setProgress(Math.min(((i + BATCH_SIZE) / total) * 100, 100))
+            if (USE_ANALYSIS_WORKER) {
+                await runAnalysisJob(selectedStock, config, 0, 100)
+            } else {
+                await runAnalysisStream(pendingItems.map(item => item.id), config, 0, 100)
             }
 
             setStatusMsg("更新完成!")
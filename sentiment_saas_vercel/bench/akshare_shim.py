@@ -0,0 +1,164 @@
+"""
+Offline stand-in for the AkShare functions the backend calls.
+
+`AkShareShim.install()` registers the shim as the `akshare` module, so every
+`import akshare as ak` in api/_lib picks it up without patching. Frames come from
+recordings when available (`<dir>/<function>/<symbol>.csv`, or
+`<dir>/stock_info_a_code_name.csv` for the listing) and are otherwise
+synthesized deterministically per symbol in AkShare's column layout. `latency`
+imitates the upstream round trip.
+
+`record(dir, symbols)` captures real AkShare frames into that layout (needs the
+real package and network access).
+"""
+import hashlib
+import pathlib
+import random
+import sys
+import time
+import types
+from datetime import datetime, timedelta
+
+SUBJECTS = ["公司", "控股股东", "董事会", "子公司", "管理层", "主力资金", "北向资金", "机构"]
+EVENTS = ["发布年度业绩预告", "签订重大合同", "获得政府补助", "披露回购进展", "收到监管问询函",
+          "宣布增持计划", "公布减持计划", "新产品通过认证", "拟投资建设新基地", "遭遇诉讼纠纷"]
+DETAILS = ["净利润同比大增", "营收小幅下滑", "订单饱满", "股价承压", "市场反响热烈", "不及预期",
+           "超预期", "毛利率改善", "现金流紧张", "行业景气回升"]
+ORGS = ["中信证券", "华泰证券", "国泰君安", "招商证券", "海通证券"]
+RATINGS = ["买入", "增持", "中性", "减持"]
+NAMES = ["科技", "医药", "银行", "能源", "制造", "电子", "消费", "材料"]
+
+
+def _rng(*parts):
+    return random.Random(int(hashlib.md5("/".join(map(str, parts)).encode()).hexdigest()[:12], 16))
+
+
+class AkShareShim:
+    def __init__(self, recordings=None, latency=0.0, news_per_call=20, reports_per_call=10, bars=500):
+        self.recordings = pathlib.Path(recordings) if recordings else None
+        self.latency = latency
+        self.news_per_call = news_per_call
+        self.reports_per_call = reports_per_call
+        self.bars = bars
+        self.calls = {}
+
+    def install(self):
+        """
+        Registers this shim as `sys.modules["akshare"]`.
+        """
+        module = types.ModuleType("akshare")
+        module.__doc__ = "AkShare shim (bench/akshare_shim.py)"
+        for name in ("stock_news_em", "stock_research_report_em", "stock_zh_a_hist", "stock_info_a_code_name",
+                     "tool_trade_date_hist_sina"):
+            setattr(module, name, getattr(self, name))
+        sys.modules["akshare"] = module
+        return module
+
+    # --- AkShare surface ---
+
+    def stock_news_em(self, symbol):
+        return self._serve("stock_news_em", symbol, lambda: self._news(symbol))
+
+    def stock_research_report_em(self, symbol):
+        return self._serve("stock_research_report_em", symbol, lambda: self._reports(symbol))
+
+    def stock_zh_a_hist(self, symbol, period="daily", adjust="qfq", start_date=None, end_date=None):
+        df = self._serve("stock_zh_a_hist", symbol, lambda: self._history(symbol))
+        if start_date:
+            df = df[df["日期"].astype(str).str.replace("-", "") >= start_date]
+        return df.reset_index(drop=True)
+
+    def stock_info_a_code_name(self):
+        return self._serve("stock_info_a_code_name", None, self._listing)
+
+    def tool_trade_date_hist_sina(self):
+        return self._serve("tool_trade_date_hist_sina", None, self._trade_dates)
+
+    # --- Plumbing ---
+
+    def _serve(self, function, symbol, synthesize):
+        import pandas as pd
+        self.calls[function] = self.calls.get(function, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.recordings:
+            path = self.recordings / (f"{function}.csv" if symbol is None else f"{function}/{symbol}.csv")
+            if path.exists():
+                return pd.read_csv(path, dtype={"code": str, "股票代码": str})
+        return synthesize()
+
+    def _news(self, symbol):
+        import pandas as pd
+        rng = _rng("news", symbol, datetime.now().date())
+        now = datetime.now()
+        rows = []
+        for i in range(self.news_per_call):
+            title = f"{symbol}{rng.choice(SUBJECTS)}{rng.choice(EVENTS)}，{rng.choice(DETAILS)}（第{rng.randint(1, 999)}期）"
+            rows.append({
+                "关键词": symbol,
+                "新闻标题": title,
+                "新闻内容": f"{title}。{rng.choice(DETAILS)}，{rng.choice(DETAILS)}。",
+                "发布时间": (now - timedelta(hours=i * 3 + rng.random())).strftime("%Y-%m-%d %H:%M:%S"),
+                "文章来源": "东方财富",
+            })
+        return pd.DataFrame(rows)
+
+    def _reports(self, symbol):
+        import pandas as pd
+        rng = _rng("reports", symbol, datetime.now().date())
+        today = datetime.now().date()
+        return pd.DataFrame([{
+            "股票代码": symbol,
+            "报告名称": f"{rng.choice(EVENTS)}，{rng.choice(DETAILS)}",
+            "评级": rng.choice(RATINGS),
+            "研究机构": rng.choice(ORGS),
+            "日期": (today - timedelta(days=i)).isoformat(),
+        } for i in range(self.reports_per_call)])
+
+    def _history(self, symbol):
+        import numpy as np
+        import pandas as pd
+        rng = np.random.default_rng(int(hashlib.md5(symbol.encode()).hexdigest()[:8], 16))
+        dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=self.bars)
+        close = np.maximum(1.0, 20 * np.exp(np.cumsum(rng.normal(0, 0.02, self.bars))))
+        open_ = close * (1 + rng.normal(0, 0.005, self.bars))
+        high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, self.bars)))
+        low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, self.bars)))
+        prev = np.concatenate([[close[0]], close[:-1]])
+        return pd.DataFrame({
+            "日期": dates.strftime("%Y-%m-%d"), "股票代码": symbol,
+            "开盘": open_.round(2), "收盘": close.round(2), "最高": high.round(2), "最低": low.round(2),
+            "成交量": rng.integers(10_000, 1_000_000, self.bars), "成交额": (close * 1e6).round(2),
+            "振幅": ((high - low) / prev * 100).round(2), "涨跌幅": ((close - prev) / prev * 100).round(2),
+            "涨跌额": (close - prev).round(2), "换手率": rng.uniform(0.1, 5, self.bars).round(2),
+        })
+
+    def _trade_dates(self):
+        import pandas as pd
+        # Weekdays through the end of the year, like the synthesized price history
+        days = pd.bdate_range(start="2000-01-01", end=f"{datetime.now().year}-12-31")
+        return pd.DataFrame({"trade_date": days.date})
+
+    def _listing(self):
+        import pandas as pd
+        codes = [f"{prefix}{i:03d}" for prefix in ("600", "000", "300") for i in range(1000)]
+        rng = _rng("listing")
+        return pd.DataFrame({"code": codes, "name": [f"{rng.choice(NAMES)}{c[-3:]}" for c in codes]})
+
+
+def record(directory, symbols):
+    """
+    Saves real AkShare frames for `symbols` in the layout the shim replays.
+    """
+    import akshare as ak
+    root = pathlib.Path(directory)
+    for function in ("stock_news_em", "stock_research_report_em", "stock_zh_a_hist"):
+        (root / function).mkdir(parents=True, exist_ok=True)
+        for symbol in symbols:
+            getattr(ak, function)(symbol=symbol).to_csv(root / function / f"{symbol}.csv", index=False)
+    ak.stock_info_a_code_name().to_csv(root / "stock_info_a_code_name.csv", index=False)
+
+
+if __name__ == "__main__":
+    # python bench/akshare_shim.py <dir> 600519 000001 ...
+    record(sys.argv[1], sys.argv[2:])
@@ -0,0 +1,199 @@
+"""
+Runs the historical backfill against the in-memory Supabase stand-in and the
+AkShare shim.
+
+Checks that:
+- a run killed mid-way resumes from its checkpoints and ends with exactly the rows
+  of an uninterrupted run (no duplicates, nothing lost);
+- a finished range is skipped without calling the source again;
+- upstream calls are spaced by the throttle interval;
+- analysis workers drain backfilled rows while ingestion is still running.
+Reports rows/s and the peak traced memory of a run.
+
+Usage (from sentiment_saas_vercel/):
+    python bench/backfill_local.py --symbols 6 --news 400 --reports 300 --chunk-rows 50
+"""
+import argparse
+import asyncio
+import collections
+import importlib.util
+import pathlib
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "api"))
+sys.path.insert(0, str(ROOT / "bench"))
+
+from akshare_shim import AkShareShim  # noqa: E402
+from fakes import FakeSupabase  # noqa: E402
+from _lib import ingest  # noqa: E402
+from _lib.analysis_worker import AnalysisWorker  # noqa: E402
+from _lib.backfill import Backfill  # noqa: E402
+
+
+class Crash(BaseException):
+    """Stands in for the process dying: not caught by the backfill's error handling."""
+
+
+class CrashingClient:
+    """
+    Passes through to `db` but dies on the (n+1)-th raw_corpus upsert.
+    """
+
+    def __init__(self, db, crash_after):
+        self.db = db
+        self.crash_after = crash_after
+        self.upserts = 0
+
+    def table(self, name):
+        query = self.db.table(name)
+        if name == "raw_corpus":
+            execute = query.execute
+
+            def guarded():
+                if query.op == "upsert":
+                    self.upserts += 1
+                    if self.upserts > self.crash_after:
+                        raise Crash()
+                return execute()
+            query.execute = guarded
+        return query
+
+    def rpc(self, name, params=None):
+        return self.db.rpc(name, params)
+
+
+def timed_sources(calls):
+    def wrap(name, fetch):
+        def call(code):
+            calls.append((time.monotonic(), name, code))
+            return fetch(code)
+        return call
+    return {name: (wrap(name, fetch), convert) for name, (fetch, convert) in ingest.SOURCES.items()}
+
+
+def corpus(db):
+    return sorted((r["stock_code"], r["fingerprint"]) for r in db.tables["raw_corpus"])
+
+
+async def analyze(item):
+    await asyncio.sleep(0.001)
+    return {"corpus_id": item["id"], "news_score_raw": 0.1, "guba_score_raw": None, "summary": "ok"}
+
+
+def load_job():
+    spec = importlib.util.spec_from_file_location("backfill_job", ROOT / "jobs" / "backfill.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run(args):
+    AkShareShim(news_per_call=args.news, reports_per_call=args.reports).install()
+    codes = [f"600{i:03d}" for i in range(args.symbols)]
+    end = date.today() - timedelta(days=1)
+    start = end - timedelta(days=args.days)
+    failures = []
+
+    def check(ok, message):
+        print(f"  {'ok  ' if ok else 'FAIL'} {message}")
+        if not ok:
+            failures.append(message)
+
+    # Reference: one uninterrupted run
+    reference = FakeSupabase()
+    calls = []
+    tracemalloc.start()
+    started = time.perf_counter()
+    backfill = Backfill(reference, sources=timed_sources(calls), chunk_rows=args.chunk_rows,
+                        min_interval=args.min_interval)
+    backfill.run(codes, start, end)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{args.symbols} symbols, {start}..{end}: {backfill.stats}")
+    print(f"uninterrupted: {elapsed:.2f}s, {backfill.stats['rows_seen'] / elapsed:.0f} rows/s, "
+          f"peak traced memory {peak / 1e6:.1f} MB")
+    gaps = [b[0] - a[0] for a, b in zip(calls, calls[1:])]
+    check(min(gaps) >= args.min_interval * 0.95, f"upstream calls spaced >= {args.min_interval}s "
+                                                 f"(min gap {min(gaps):.3f}s)")
+    check(backfill.stats["rows_seen"] > 0 and backfill.stats["chunks"] > len(codes) * 2,
+          "rows were written in several chunks per symbol")
+
+    # Killed part-way, then resumed by a fresh process
+    db = FakeSupabase()
+    crashing = CrashingClient(db, crash_after=args.crash_after)
+    try:
+        Backfill(crashing, chunk_rows=args.chunk_rows, min_interval=0).run(codes, start, end)
+        check(False, "run crashed")
+    except Crash:
+        pass
+    interrupted = {(s["stock_code"], s["source"]): s for s in db.tables["backfill_state"]}
+    running = [s for s in interrupted.values() if s["status"] == "running"]
+    check(len(running) == 1 and running[0]["cursor"], f"crash left one checkpoint in progress ({running[0]['cursor']})")
+    resumed = Backfill(db, chunk_rows=args.chunk_rows, min_interval=0)
+    resumed.run(codes, start, end)
+    print(f"resumed: {resumed.stats}")
+    check(corpus(db) == corpus(reference), "resumed run stored exactly the rows of an uninterrupted run")
+    check(len(set(corpus(db))) == len(corpus(db)), "no duplicate rows")
+    check(resumed.stats["skipped"] == len(interrupted) - 1,
+          "symbols finished before the crash were skipped")
+    check(resumed.stats["rows_seen"] < backfill.stats["rows_seen"], "resume did not start from scratch")
+
+    again = Backfill(db, min_interval=0)
+    again.run(codes, start, end)
+    check(again.stats["fetches"] == 0 and again.stats["skipped"] == len(codes) * len(ingest.SOURCES),
+          "finished range is skipped without upstream calls")
+
+    # Analysis alongside ingestion
+    job = load_job()
+    db = FakeSupabase()
+    ingest_done = {}
+    backfill = Backfill(db, chunk_rows=args.chunk_rows, min_interval=args.min_interval)
+    original_run = backfill.run
+
+    def run_and_stamp(*a):
+        try:
+            return original_run(*a)
+        finally:
+            ingest_done["at"] = time.monotonic()
+    backfill.run = run_and_stamp
+    workers = [AnalysisWorker(db, analyze=analyze, worker_id=f"w{i}", idle_sleep=0.05) for i in range(2)]
+    analyzed_at = collections.Counter()
+    original_persist = AnalysisWorker._persist
+
+    def stamped_persist(self, succeeded, failed, items):
+        analyzed_at["before_ingest_done"] += len(succeeded) if "at" not in ingest_done else 0
+        return original_persist(self, succeeded, failed, items)
+    AnalysisWorker._persist = stamped_persist
+    try:
+        asyncio.run(job.run(backfill, codes, start, end, workers))
+    finally:
+        AnalysisWorker._persist = original_persist
+    pending = [r for r in db.tables["raw_corpus"] if not r["is_analyzed"]]
+    print(f"with analysis: {sum(w.stats['analyzed'] for w in workers)} analyzed, "
+          f"{analyzed_at['before_ingest_done']} before ingestion finished")
+    check(not pending, "every backfilled row analyzed")
+    check(analyzed_at["before_ingest_done"] > 0, "analysis ran while ingestion was still going")
+
+    if failures:
+        sys.exit(f"FAIL: {len(failures)} checks failed")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--symbols", type=int, default=6)
+    parser.add_argument("--news", type=int, default=400, help="news rows the source returns per symbol")
+    parser.add_argument("--reports", type=int, default=300, help="reports the source returns per symbol")
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--chunk-rows", type=int, default=50)
+    parser.add_argument("--min-interval", type=float, default=0.05)
+    parser.add_argument("--crash-after", type=int, default=12, help="raw_corpus upserts before the simulated crash")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Times the vectorized backtest engine on synthetic data and checks it against a
+plain per-symbol loop.
+
+Synthetic news sentiment predicts the return `delay + 1` bars later; guba
+sentiment is noise. Some rollup rows fall on weekends, so the roll-forward onto
+the trading calendar is exercised as well. The checks are:
+- lead-lag correlations and backtest metrics match a per-symbol loop reference;
+- the lead-lag peak sits at the planted lag;
+- strong positive days are followed by above-baseline returns, negative days by below;
+- the best grid settings put more weight on news than on guba;
+- rollups load through `rollups.load_many` paging from the Supabase stand-in.
+
+Usage (from sentiment_saas_vercel/):
+    python bench/backtest_bench.py --symbols 500 --days 250
+"""
+import argparse
+import math
+import pathlib
+import sys
+import time
+
+import numpy as np
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "api"))
+sys.path.insert(0, str(ROOT / "bench"))
+
+from fakes import FakeSupabase  # noqa: E402
+from _lib import backtest, rollups  # noqa: E402
+
+
+def synthetic(symbols, days, delay, seed):
+    """
+    Returns (codes, histories, rollup rows).
+    """
+    rng = np.random.default_rng(seed)
+    all_days = np.arange(np.datetime64("2023-01-02"), np.datetime64("2023-01-02") + int(days * 1.6) + 10)
+    calendar = all_days[np.is_busday(all_days)][:days]
+    codes = [f"{600000 + i}" for i in range(symbols)]
+    news = np.where(rng.random((symbols, days)) < 0.6, np.clip(rng.normal(0, 0.5, (symbols, days)), -1, 1), np.nan)
+    returns = rng.normal(0, 0.02, (symbols, days))
+    returns[:, delay + 1:] += 0.01 * np.nan_to_num(news[:, :-(delay + 1)])
+    close = 10 * np.cumprod(1 + returns, axis=1)
+
+    histories, rows = [], []
+    for i, code in enumerate(codes):
+        start = rng.integers(0, days // 5)  # a few listings start late
+        histories.append((calendar[start:], close[i, start:]))
+        for t in np.flatnonzero(np.isfinite(news[i])):
+            count = int(rng.integers(1, 6))
+            rows.append({"stock_code": code, "day": str(calendar[t]), "source": "news",
+                         "score_sum": float(news[i, t]) * count, "item_count": count})
+        for t in range(days):
+            if rng.random() < 0.5:
+                day = calendar[t]
+                # Saturday posts belong to the next session
+                if t and calendar[t] - calendar[t - 1] > 1 and rng.random() < 0.5:
+                    day = calendar[t] - 2
+                rows.append({"stock_code": code, "day": str(day), "source": "guba",
+                             "score_sum": float(rng.normal(0, 0.5)), "item_count": 1})
+    return codes, histories, rows
+
+
+# --- Loop reference ---
+
+def reference(codes, histories, rows, weights, max_lag, threshold, hold, delay, cost_bps):
+    """
+    Per-symbol Python loops over the same definitions, for a handful of symbols.
+    """
+    calendar = sorted({str(d) for dates, _ in histories for d in dates})
+    bars = {code: dict(zip(map(str, dates), close)) for code, (dates, close) in zip(codes, histories)}
+    sums = {}
+    for r in rows:
+        later = [d for d in calendar if d >= r["day"]]
+        if not later or r["day"] < calendar[0]:
+            continue
+        key = (r["stock_code"], later[0], r["source"])
+        s, c = sums.get(key, (0.0, 0))
+        sums[key] = (s + r["score_sum"], c + r["item_count"])
+
+    def signal(code, day, wn, wg):
+        num = den = 0.0
+        for source, w in (("news", wn), ("guba", wg)):
+            s, c = sums.get((code, day, source), (0.0, 0))
+            if c:
+                num += w * s / c
+                den += w
+        return num / den if den > 0 else None
+
+    def ret(code, t):
+        if t < 1 or t >= len(calendar):
+            return None
+        a, b = bars[code].get(calendar[t - 1]), bars[code].get(calendar[t])
+        return b / a - 1 if a is not None and b is not None else None
+
+    corr = {}
+    for code in codes:
+        sig = [signal(code, d, *weights) for d in calendar]
+        for k in range(-max_lag, max_lag + 1):
+            pairs = [(s, ret(code, t + k)) for t, s in enumerate(sig)]
+            pairs = [(s, r) for s, r in pairs if s is not None and r is not None]
+            corr[code, k] = pearson(pairs) if len(pairs) >= 10 else None
+
+    daily = []
+    last = {code: (None, -1) for code in codes}
+    prev = {code: 0.0 for code in codes}
+    for t, day in enumerate(calendar):
+        sides = {}
+        for code in codes:
+            s = signal(code, day, *weights)
+            if s is not None:
+                last[code] = (s, t)
+            s, at = last[code]
+            if s is not None and t - at < hold and abs(s) >= threshold and ret(code, t + delay + 1) is not None:
+                sides[code] = math.copysign(1.0, s)
+        pnl = 0.0
+        for code in codes:
+            w = sides.get(code, 0.0) / max(len(sides), 1)
+            pnl += w * (ret(code, t + delay + 1) or 0.0) - cost_bps / 1e4 * abs(w - prev[code])
+            prev[code] = w
+        daily.append(pnl)
+    return corr, daily
+
+
+def pearson(pairs):
+    xs, ys = zip(*pairs)
+    mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+    cov = sum((x - mx) * (y - my) for x, y in pairs)
+    vx = sum((x - mx) ** 2 for x in xs)
+    vy = sum((y - my) ** 2 for y in ys)
+    return cov / math.sqrt(vx * vy) if vx > 0 and vy > 0 else None
+
+
+def run(args):
+    failures = []
+
+    def check(ok, message):
+        print(f"  {'ok  ' if ok else 'FAIL'} {message}")
+        if not ok:
+            failures.append(message)
+
+    codes, histories, rows = synthetic(args.symbols, args.days, args.delay, args.seed)
+    grid = backtest.weight_grid(backtest_steps(), backtest_steps())
+    params = dict(max_lag=args.max_lag, threshold=args.threshold, hold=args.hold, delay=args.delay, cost_bps=args.cost_bps)
+
+    # Correctness on a small subset
+    n = args.reference_symbols
+    sub_rows = [r for r in rows if r["stock_code"] in set(codes[:n])]
+    weights = (0.7, 0.3)
+    corr, daily = reference(codes[:n], histories[:n], sub_rows, weights, **params)
+    calendar, close = backtest.align_prices(histories[:n], args.days)
+    sentiment = backtest.align_sentiment(sub_rows, codes[:n], calendar)
+    signal = backtest.combine(sentiment, [weights])[0]
+    ll = backtest.lead_lag(signal, close, args.max_lag)
+    got = ll["per_symbol"]
+    want = np.array([[np.nan if corr[c, k] is None else corr[c, k] for k in range(-args.max_lag, args.max_lag + 1)]
+                     for c in codes[:n]])
+    check(np.allclose(got, want, equal_nan=True, atol=1e-9), f"lead-lag matches the loop reference ({n} symbols)")
+    metrics = backtest.backtest_grid(sentiment, close, [weights], args.threshold, args.hold, args.delay, args.cost_bps)
+    want_total = np.prod(1 + np.array(daily)) - 1
+    want_sharpe = np.mean(daily) / np.std(daily, ddof=1) * math.sqrt(backtest.TRADING_DAYS)
+    check(abs(metrics["total_return"][0] - want_total) < 1e-9 and abs(metrics["sharpe"][0] - want_sharpe) < 1e-6,
+          f"backtest return and Sharpe match the loop reference ({metrics['total_return'][0]:.4f} vs {want_total:.4f})")
+
+    # Rollups through the paged loader
+    db = FakeSupabase()
+    db.seed("sentiment_daily", sub_rows)
+    loaded = rollups.load_many(db, codes[:n], page_size=97)
+    check(len(loaded) == len(sub_rows), f"load_many pages through all {len(sub_rows)} rollup rows")
+
+    # Scale: every symbol, the full grid
+    started = time.perf_counter()
+    result = backtest.evaluate(codes, histories, rows, args.days, weights=weights, grid=grid,
+                               horizons=args.horizons, event_threshold=args.event_threshold, **params)
+    elapsed = time.perf_counter() - started
+    print(f"{args.symbols} symbols x {result['bars']} bars, {len(grid)} weight settings, "
+          f"{len(rows)} rollup rows: {elapsed:.2f}s")
+
+    lags = result["lead_lag"]["lags"]
+    pooled = result["lead_lag"]["pooled"]
+    peak = lags[int(np.nanargmax(np.abs(np.array(pooled, dtype=float))))]
+    print(f"  pooled lead-lag: {dict(zip(lags, pooled))}")
+    check(peak == args.delay + 1, f"lead-lag peaks at lag {args.delay + 1} (got {peak})")
+    ev = result["event_study"]
+    print(f"  event study h=1: positive {ev['positive'][0]}, baseline {ev['baseline'][0]}, negative {ev['negative'][0]}")
+    check(ev["positive"][0] > ev["baseline"][0] > ev["negative"][0], "strong days move returns in their direction")
+    best = result["backtest"]["best"]
+    print(f"  best: {best}")
+    check(best["news_weight"] > best["guba_weight"], "best weights favour the informative source")
+    check(elapsed < args.budget, f"finished within {args.budget:g}s")
+
+    if failures:
+        sys.exit(f"FAIL: {len(failures)} checks failed")
+
+
+def backtest_steps():
+    return [round(0.1 * i, 1) for i in range(11)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--days", type=int, default=250)
+    parser.add_argument("--max-lag", type=int, default=5)
+    parser.add_argument("--horizons", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=0.3)
+    parser.add_argument("--event-threshold", type=float, default=0.5)
+    parser.add_argument("--hold", type=int, default=2)
+    parser.add_argument("--delay", type=int, default=1)
+    parser.add_argument("--cost-bps", type=float, default=10)
+    parser.add_argument("--reference-symbols", type=int, default=8)
+    parser.add_argument("--budget", type=float, default=10, help="seconds allowed for the full run")
+    parser.add_argument("--seed", type=int, default=7)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
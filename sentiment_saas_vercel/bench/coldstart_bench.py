@@ -0,0 +1,265 @@
+"""
+Import-time and cold-start benchmark for the api/index.py serverless function.
+
+1. Import profile: runs `python -X importtime -c "import index"` and reports the
+   total plus the heaviest top-level packages; deferred packages (AkShare, the
+   Supabase SDK, openai) are profiled on their own so their cost stays visible.
+2. Cold start per endpoint: every run is a fresh interpreter that imports
+   index, wires in the in-memory Supabase stand-in, synthetic AkShare data and the
+   mock completion server, then sends one request straight to the ASGI app. It
+   reports interpreter+import time, time to the first response byte and which
+   heavy packages the endpoint ended up loading.
+
+Usage (from sentiment_saas_vercel/):
+    python bench/coldstart_bench.py --runs 3
+    python bench/coldstart_bench.py --endpoints analyze_batch,stock_price --json
+"""
+import argparse
+import json
+import os
+import pathlib
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+API_DIR = ROOT / "api"
+
+HEAVY_MODULES = ["akshare", "pandas", "numpy", "supabase", "openai"]
+DEFERRED_MODULES = ["akshare", "supabase", "openai"]
+STOCK = "600519"
+AUTH = "Bearer x.eyJzdWIiOiJiZW5jaC11c2VyIn0.y"  # payload {"sub": "bench-user"}
+
+# name -> (method, path, body or a callable taking the fake db)
+ENDPOINTS = {
+    "stock_search": ("GET", f"/api/stock_search?q={STOCK[:3]}", None),
+    "stock_price": ("POST", "/api/stock_price", {"stock_code": STOCK, "days": 60}),
+    "technical_indicators": ("POST", "/api/technical_indicators", {"stock_code": STOCK, "days": 60}),
+    "fetch_raw": ("POST", "/api/fetch_raw", {"stock_code": STOCK}),
+    "analyze_batch": ("POST", "/api/analyze_batch",
+                      lambda db: {"corpus_ids": [r["id"] for r in db.tables["raw_corpus"]], "cascade": False}),
+    "cleanup_data": ("POST", "/api/cleanup_data", {"stock_code": STOCK}),
+    "sentiment_series": ("POST", "/api/sentiment_series", {"stock_code": STOCK, "days": 60}),
+}
+
+_IMPORTTIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+# --- Import profile ---
+
+def import_profile(module, top=8):
+    """
+    Returns (total seconds, [(package, cumulative seconds)]) for `import module`
+    in a fresh interpreter.
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=API_DIR, capture_output=True, text=True, env=_child_env())
+    if proc.returncode != 0:
+        return None, []
+    packages = {}
+    total = None
+    for line in proc.stderr.splitlines():
+        m = _IMPORTTIME.match(line)
+        if not m:
+            continue
+        cumulative, name = int(m.group(2)) / 1e6, m.group(4)
+        if name == module:
+            total = cumulative
+        elif "." not in name and name != module:
+            packages[name] = max(packages.get(name, 0.0), cumulative)
+    heaviest = sorted(packages.items(), key=lambda kv: kv[1], reverse=True)[:top]
+    return total, heaviest
+
+
+# --- Cold start (child side) ---
+
+def _child_env(llm_url=None):
+    env = dict(os.environ)
+    env.setdefault("SUPABASE_URL", "http://supabase.invalid")
+    env.setdefault("NEXT_PUBLIC_SUPABASE_ANON_KEY", "bench-anon-key")
+    env["DEEPSEEK_API_KEY"] = "bench-key"
+    if llm_url:
+        env["DEEPSEEK_BASE_URL"] = llm_url
+    scratch = tempfile.mkdtemp(prefix="coldstart-")
+    env["PRICE_STORE_DIR"] = os.path.join(scratch, "prices")
+    env["STOCK_INDEX_PATH"] = os.path.join(scratch, "stock_index.json")
+    return env
+
+
+def synthetic_history(symbol, start_date=None):
+    """
+    AkShare `stock_zh_a_hist`-shaped frame (only called after index is imported).
+    """
+    import numpy as np
+    import pandas as pd
+    n = 250
+    rng = np.random.default_rng(int(symbol))
+    close = 20 + np.cumsum(rng.normal(0, 0.3, n))
+    dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=n).strftime("%Y-%m-%d")
+    return pd.DataFrame({
+        "日期": dates, "开盘": close, "收盘": close, "最高": close + 0.2, "最低": close - 0.2,
+        "成交量": rng.integers(1e5, 1e6, n), "成交额": close * 1e6, "振幅": 1.0,
+        "涨跌幅": 0.1, "涨跌额": 0.02, "换手率": 0.5,
+    })
+
+
+def synthetic_listing():
+    return [STOCK, "000001", "600000"], ["贵州茅台", "平安银行", "浦发银行"]
+
+
+def synthetic_news(stock_code):
+    import pandas as pd
+    now = pd.Timestamp.now()
+    return pd.DataFrame({
+        "新闻标题": [f"{stock_code} 公告第{i}号：经营情况稳定" for i in range(20)],
+        "新闻内容": ["" for _ in range(20)],
+        "发布时间": [(now - pd.Timedelta(hours=i)).strftime("%Y-%m-%d %H:%M:%S") for i in range(20)],
+    })
+
+
+def synthetic_reports(stock_code):
+    import pandas as pd
+    return pd.DataFrame({"报告名称": [], "研究机构": [], "评级": [], "日期": []})
+
+
+def _asgi_request(app, method, target, body):
+    """
+    Minimal ASGI client (no httpx, so the client adds no imports of its own).
+    Returns (status, seconds to the first response message, body bytes).
+    """
+    import asyncio
+    path, _, query = target.partition("?")
+    payload = json.dumps(body).encode() if body is not None else b""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+        "headers": [(b"content-type", b"application/json"), (b"authorization", AUTH.encode()),
+                    (b"host", b"bench")],
+        "client": ("127.0.0.1", 1), "server": ("bench", 80), "root_path": "",
+    }
+    state = {"status": None, "first": None, "body": b"", "received": False}
+
+    async def receive():
+        if not state["received"]:
+            state["received"] = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await asyncio.Event().wait()  # no disconnect until the response is done
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            state["status"] = message["status"]
+            state["first"] = time.perf_counter()
+        elif message["type"] == "http.response.body":
+            state["body"] += message.get("body", b"")
+
+    async def run():
+        started = time.perf_counter()
+        await app(scope, receive, send)
+        return state["status"], state["first"] - started, state["body"]
+
+    return asyncio.run(run())
+
+
+def child(endpoint):
+    started = time.perf_counter()
+    sys.path.insert(0, str(API_DIR))
+    import index
+    imported = time.perf_counter()
+
+    sys.path.insert(0, str(ROOT / "bench"))
+    from fakes import FakeSupabase
+    db = FakeSupabase()
+    db.seed("raw_corpus", [
+        {"stock_code": STOCK, "source": "news", "title": f"业绩预告超预期，净利润同比大增（{i}）",
+         "content": "", "publish_time": f"2024-01-0{1 + i % 5}T09:30:00+00:00"}
+        for i in range(20)
+    ])
+    index.supabase_pool.client = lambda token=None: db
+    index.price_store.fetcher = synthetic_history
+    index.stock_index.loader = synthetic_listing
+    index.ingest.SOURCES = {
+        "news": (synthetic_news, index.ingest.news_records),
+        "report": (synthetic_reports, index.ingest.report_records),
+    }
+
+    method, path, body = ENDPOINTS[endpoint]
+    body = body(db) if callable(body) else body
+    status, first_byte, _ = _asgi_request(index.app, method, path, body)
+    print(json.dumps({
+        "endpoint": endpoint,
+        "status": status,
+        "import_s": round(imported - started, 4),
+        "first_response_s": round(first_byte, 4),
+        "loaded": [m for m in HEAVY_MODULES if m in sys.modules],
+    }))
+
+
+# --- Cold start (parent side) ---
+
+def cold_start(endpoint, llm_url):
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, __file__, "--child", endpoint], cwd=ROOT,
+                          capture_output=True, text=True, env=_child_env(llm_url))
+    wall = time.perf_counter() - started
+    lines = [l for l in proc.stdout.splitlines() if l.startswith("{")]
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError(f"{endpoint} child failed:\n{proc.stderr[-2000:]}")
+    result = json.loads(lines[-1])
+    result["process_s"] = round(wall, 4)  # interpreter start -> exit
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="cold starts per endpoint (median is reported)")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma-separated endpoint names")
+    parser.add_argument("--json", action="store_true", help="print one JSON document instead of tables")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    sys.path.insert(0, str(ROOT / "bench"))
+    from mock_llm import MockCompletionServer
+
+    total, heaviest = import_profile("index")
+    report = {
+        "import": {"index_s": total, "heaviest": heaviest,
+                   "deferred": {m: import_profile(m, top=0)[0] for m in DEFERRED_MODULES}},
+        "endpoints": {},
+    }
+    with MockCompletionServer(base_latency=0.05, per_token_latency=0) as llm:
+        for name in args.endpoints.split(","):
+            runs = [cold_start(name, llm.base_url) for _ in range(args.runs)]
+            report["endpoints"][name] = {
+                "status": runs[-1]["status"],
+                "import_s": statistics.median(r["import_s"] for r in runs),
+                "first_response_s": statistics.median(r["first_response_s"] for r in runs),
+                "process_s": statistics.median(r["process_s"] for r in runs),
+                "loaded": runs[-1]["loaded"],
+            }
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+
+    print(f"import index: {report['import']['index_s']:.3f}s")
+    for name, seconds in report["import"]["heaviest"]:
+        print(f"  {name:<24}{seconds:.3f}s")
+    print("deferred until first use:")
+    for name, seconds in report["import"]["deferred"].items():
+        print(f"  {name:<24}{'not installed' if seconds is None else f'{seconds:.3f}s'}")
+    print()
+    print(f"{'endpoint':<22}{'status':>7}{'import':>9}{'first resp':>12}{'process':>9}  loaded")
+    for name, r in report["endpoints"].items():
+        print(f"{name:<22}{r['status']:>7}{r['import_s']:>8.3f}s{r['first_response_s']:>11.3f}s"
+              f"{r['process_s']:>8.3f}s  {', '.join(r['loaded'])}")
+
+
+if __name__ == "__main__":
+    main()
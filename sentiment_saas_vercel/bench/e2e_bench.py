@@ -0,0 +1,358 @@
+"""
+Offline end-to-end benchmark: fetch_raw -> analyze_batch -> chart load.
+
+Everything the backend talks to is replaced by a local stand-in:
+- AkShare: bench/akshare_shim.py (recorded frames from `--recordings`, or synthetic)
+- Supabase: bench/postgrest_stub.py (PostgREST over HTTP, backed by FakeSupabase)
+- DeepSeek: bench/mock_llm.py (configurable latency and error rate)
+
+The API runs under uvicorn in its own process, so its peak RSS is measured
+without the load generator or the fakes, which live in this process.
+Phases run in order, at `--concurrency` requests in flight:
+
+1. fetch_raw for every stock
+2. analyze_batch (or the streaming variant) over every unanalyzed row, in batches
+3. chart load: stock_price + sentiment_series + technical_indicators per stock,
+   `--chart-rounds` times
+
+Per endpoint it reports p50/p95/p99 latency, requests/s and items/s, and per
+phase the peak RSS of the API process. Results go to a JSON file (`--out`);
+`--baseline` compares the run with an earlier file.
+
+Usage (from sentiment_saas_vercel/):
+    python bench/e2e_bench.py --stocks 20 --concurrency 8
+    python bench/e2e_bench.py --out bench/results/after.json --baseline bench/results/before.json
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import pathlib
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "bench"))
+
+ANALYZE_BATCH_SIZE = 50  # the dashboard's STREAM_CHUNK
+
+
+def fake_jwt(sub):
+    def part(obj):
+        return base64.urlsafe_b64encode(json.dumps(obj).encode()).decode().rstrip("=")
+    return f"{part({'alg': 'HS256', 'typ': 'JWT'})}.{part({'sub': sub, 'role': 'authenticated'})}.c2ln"
+
+
+def percentile(values, q):
+    """
+    Linear-interpolated percentile (q in 0..100) of a non-empty list.
+    """
+    values = sorted(values)
+    k = (len(values) - 1) * q / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def stock_codes(n):
+    return [f"600{i:03d}" for i in range(n)]
+
+
+# --- API process ---
+
+def serve(port, recordings, akshare_latency):
+    """
+    Child process: AkShare shim + the real app under uvicorn.
+    """
+    from akshare_shim import AkShareShim
+    AkShareShim(recordings=recordings, latency=akshare_latency).install()
+    sys.path.insert(0, str(ROOT / "api"))
+    import uvicorn
+    import index
+    uvicorn.run(index.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_api(args, supabase_url, llm_url, anon_key):
+    port = free_port()
+    scratch = tempfile.mkdtemp(prefix="e2e-bench-")
+    env = dict(os.environ,
+               SUPABASE_URL=supabase_url, NEXT_PUBLIC_SUPABASE_ANON_KEY=anon_key,
+               DEEPSEEK_API_KEY="bench-key", DEEPSEEK_BASE_URL=llm_url,
+               PRICE_STORE_DIR=os.path.join(scratch, "prices"),
+               STOCK_INDEX_PATH=os.path.join(scratch, "stock_index.json"))
+    cmd = [sys.executable, __file__, "--serve", str(port), "--akshare-latency", str(args.akshare_latency)]
+    if args.recordings:
+        cmd += ["--recordings", args.recordings]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env)
+    return proc, f"http://127.0.0.1:{port}"
+
+
+async def wait_ready(client, proc, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"API process exited with {proc.returncode}")
+        try:
+            if (await client.get("/api/stock_info/600000")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("API did not come up")
+
+
+class RssSampler:
+    """
+    Samples the API process's resident set size (Linux /proc) in the background.
+    """
+
+    def __init__(self, pid, interval=0.05):
+        self.path = pathlib.Path(f"/proc/{pid}/status")
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _field(self, name):
+        try:
+            for line in self.path.read_text().splitlines():
+                if line.startswith(name + ":"):
+                    return int(line.split()[1])
+        except (OSError, ValueError):
+            return None
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = self._field("VmRSS")
+            if rss:
+                self.peak_kb = max(self.peak_kb, rss)
+            time.sleep(self.interval)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def reset_peak(self):
+        self.peak_kb = self._field("VmRSS") or 0
+
+    def high_water_mb(self):
+        hwm = self._field("VmHWM")
+        return round(hwm / 1024, 1) if hwm else None
+
+    def stop(self):
+        self._stop.set()
+
+
+# --- Load generation ---
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}  # endpoint -> [(seconds, ok, items)]
+
+    def add(self, endpoint, seconds, ok, items=0):
+        self.samples.setdefault(endpoint, []).append((seconds, ok, items))
+
+    def summarize(self, wall):
+        out = {}
+        for endpoint, rows in self.samples.items():
+            latencies = [s for s, ok, _ in rows if ok] or [0.0]
+            items = sum(i for _, ok, i in rows if ok)
+            out[endpoint] = {
+                "requests": len(rows),
+                "errors": sum(1 for _, ok, _ in rows if not ok),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+                "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+                "requests_per_s": round(len(rows) / wall, 2) if wall else None,
+                "items": items,
+                "items_per_s": round(items / wall, 2) if wall else None,
+            }
+        return out
+
+
+def sse_summary(text):
+    event = None
+    for line in text.splitlines():
+        if line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:") and event in ("summary", "error"):
+            return event, json.loads(line[5:])
+    return None, {}
+
+
+async def call(client, sem, recorder, endpoint, method, path, body=None, items_of=None):
+    async with sem:
+        started = time.perf_counter()
+        ok, items = False, 0
+        try:
+            res = await client.request(method, path, json=body)
+            if res.headers.get("content-type", "").startswith("text/event-stream"):
+                event, data = sse_summary(res.text)
+                ok = res.status_code == 200 and event == "summary"
+            else:
+                data = res.json()
+                ok = res.status_code == 200 and data.get("status") != "error" and data.get("success", True)
+            items = items_of(data) if ok and items_of else 0
+        except Exception as e:
+            print(f"{endpoint} request failed: {e}")
+        recorder.add(endpoint, time.perf_counter() - started, ok, items)
+
+
+async def run_phase(name, sampler, make_calls):
+    recorder = Recorder()
+    sampler.reset_peak()
+    started = time.perf_counter()
+    await asyncio.gather(*make_calls(recorder))
+    wall = time.perf_counter() - started
+    return {"phase": name, "wall_s": round(wall, 3), "peak_rss_mb": round(sampler.peak_kb / 1024, 1),
+            "endpoints": recorder.summarize(wall)}
+
+
+async def drive(args, stub, base_url, proc):
+    import httpx
+    codes = stock_codes(args.stocks)
+    sem = asyncio.Semaphore(args.concurrency)
+    headers = {"Authorization": f"Bearer {fake_jwt('bench-user')}"}
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, timeout=300, limits=limits) as client:
+        await wait_ready(client, proc)
+        sampler = RssSampler(proc.pid).start()
+        phases = []
+
+        phases.append(await run_phase("fetch_raw", sampler, lambda rec: [
+            call(client, sem, rec, "fetch_raw", "POST", "/api/fetch_raw", {"stock_code": code},
+                 items_of=lambda d: d.get("new_items", 0))
+            for code in codes
+        ]))
+
+        pending = [r["id"] for r in stub.db.tables["raw_corpus"] if not r.get("is_analyzed")]
+        batches = [pending[i:i + args.batch_size] for i in range(0, len(pending), args.batch_size)]
+        path = "/api/analyze_batch/stream" if args.stream else "/api/analyze_batch"
+        phases.append(await run_phase("analyze_batch", sampler, lambda rec: [
+            call(client, sem, rec, path.rsplit("/api/", 1)[-1], "POST", path,
+                 {"corpus_ids": batch, "cascade": not args.no_cascade},
+                 items_of=lambda d: d.get("processed_count", 0))
+            for batch in batches
+        ]))
+
+        def chart_calls(rec):
+            calls = []
+            for _ in range(args.chart_rounds):
+                for code in codes:
+                    calls += [
+                        call(client, sem, rec, "stock_price", "POST", "/api/stock_price",
+                             {"stock_code": code, "days": 90}, items_of=lambda d: len(d.get("data", []))),
+                        call(client, sem, rec, "sentiment_series", "POST", "/api/sentiment_series",
+                             {"stock_code": code, "days": 90}, items_of=lambda d: len(d.get("data", []))),
+                        call(client, sem, rec, "technical_indicators", "POST", "/api/technical_indicators",
+                             {"stock_code": code, "days": 60}, items_of=lambda d: 1),
+                    ]
+            return calls
+
+        phases.append(await run_phase("chart_load", sampler, chart_calls))
+        sampler.stop()
+        return phases, sampler.high_water_mb()
+
+
+# --- Reporting ---
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    for phase in report["phases"]:
+        print(f"{phase['phase']}: {phase['wall_s']}s, API peak RSS {phase['peak_rss_mb']} MB")
+        for name, r in phase["endpoints"].items():
+            print(f"  {name:<22}n={r['requests']:<4} err={r['errors']:<3} p50 {r['p50_ms']:>8} ms  "
+                  f"p95 {r['p95_ms']:>8} ms  p99 {r['p99_ms']:>8} ms  {r['requests_per_s']:>7} req/s  "
+                  f"{r['items_per_s']:>8} items/s")
+    print(f"API peak RSS (VmHWM): {report['api_peak_rss_mb']} MB")
+    print(f"LLM: {report['llm']}  DB: {report['db']}")
+
+
+def compare(report, baseline):
+    print(f"\nvs baseline {baseline.get('revision')} ({baseline.get('timestamp')}):")
+    before = {(p["phase"], name): r for p in baseline["phases"] for name, r in p["endpoints"].items()}
+    for phase in report["phases"]:
+        for name, r in phase["endpoints"].items():
+            old = before.get((phase["phase"], name))
+            if not old:
+                continue
+            def change(key):
+                return f"{(r[key] - old[key]) / old[key] * 100:+.1f}%" if old[key] else "n/a"
+            print(f"  {name:<22}p95 {old['p95_ms']} -> {r['p95_ms']} ms ({change('p95_ms')})  "
+                  f"items/s {old['items_per_s']} -> {r['items_per_s']} ({change('items_per_s')})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stocks", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight")
+    parser.add_argument("--batch-size", type=int, default=ANALYZE_BATCH_SIZE, help="corpus ids per analyze_batch call")
+    parser.add_argument("--chart-rounds", type=int, default=3)
+    parser.add_argument("--stream", action="store_true", help="use /api/analyze_batch/stream")
+    parser.add_argument("--no-cascade", action="store_true", help="send every item to the LLM")
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--llm-error-rate", type=float, default=0.02)
+    parser.add_argument("--db-latency", type=float, default=0.005, help="seconds per PostgREST request")
+    parser.add_argument("--akshare-latency", type=float, default=0.2)
+    parser.add_argument("--recordings", help="directory of recorded AkShare frames (see akshare_shim.py)")
+    parser.add_argument("--out", help="result file (default bench/results/e2e-<timestamp>.json)")
+    parser.add_argument("--baseline", help="earlier result file to compare against")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.recordings, args.akshare_latency)
+        return
+
+    from mock_llm import MockCompletionServer
+    from postgrest_stub import PostgrestStub
+
+    with PostgrestStub(latency=args.db_latency) as stub, \
+            MockCompletionServer(base_latency=args.llm_latency, error_rate=args.llm_error_rate) as llm:
+        proc, base_url = start_api(args, stub.url, llm.base_url, fake_jwt("anon"))
+        try:
+            phases, peak = asyncio.run(drive(args, stub, base_url, proc))
+        finally:
+            proc.terminate()
+            proc.wait(timeout=10)
+        report = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("serve", "out", "baseline")},
+            "phases": phases,
+            "api_peak_rss_mb": peak,
+            "llm": dict(llm.stats),
+            "db": dict(stub.stats),
+        }
+
+    out = pathlib.Path(args.out or ROOT / "bench" / "results" / f"e2e-{datetime.now():%Y%m%d-%H%M%S}.json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2))
+    print_report(report)
+    print(f"\nwrote {out}")
+    if args.baseline:
+        compare(report, json.loads(pathlib.Path(args.baseline).read_text()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+"""
+Offline stand-ins for the services the backend talks to.
+
+`FakeSupabase` is an in-process, thread-safe imitation of the supabase-py client
+surface the backend uses (`table(...).select/insert/upsert/update/delete` with
+PostgREST-style filters, plus `rpc`). The Postgres functions from
+`supabase/schema.sql` are re-implemented in Python so workers and jobs can run
+end to end without a database.
+"""
+import copy
+import re
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+# Column defaults mirrored from supabase/schema.sql
+TABLE_DEFAULTS = {
+    "raw_corpus": {
+        "is_analyzed": False,
+        "lease_owner": None,
+        "lease_expires_at": None,
+        "analysis_attempts": 0,
+        "last_error": None,
+        "job_id": None,
+    },
+    "analysis_jobs": {"total": 0, "user_id": None},
+    "ingest_state": {
+        "holders": 0,
+        "last_ingested_at": None,
+        "last_analyzed_at": None,
+        "new_items": 0,
+        "last_error": None,
+        "lease_owner": None,
+        "lease_expires_at": None,
+    },
+}
+
+# child table -> {parent table: foreign key column}, for embedded-resource selects and filters
+FOREIGN_KEYS = {
+    "sentiment_results": {"raw_corpus": "corpus_id"},
+}
+_EMBED = re.compile(r"(\w+)(?:!\w+)?\s*\(([^)]*)\)")
+
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+
+def _ts(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeQuery:
+    """
+    Chainable query builder; filters are applied at `execute()` time.
+    """
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.op = "select"
+        self.columns = "*"
+        self.payload = None
+        self.filters = []
+        self.orders = []
+        self.limit_n = None
+        self.offset_n = 0
+        self.count_mode = None
+        self.on_conflict = None
+        self.ignore_duplicates = False
+
+    # --- Operations ---
+
+    def select(self, columns="*", count=None):
+        self.op, self.columns, self.count_mode = "select", columns, count
+        return self
+
+    def insert(self, rows):
+        self.op, self.payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict="id", ignore_duplicates=False):
+        self.op, self.payload = "upsert", rows
+        self.on_conflict, self.ignore_duplicates = on_conflict, ignore_duplicates
+        return self
+
+    def update(self, values):
+        self.op, self.payload = "update", values
+        return self
+
+    def delete(self):
+        self.op = "delete"
+        return self
+
+    # --- Filters ---
+
+    def _filter(self, col, fn):
+        self.filters.append((col, fn))
+        return self
+
+    def eq(self, col, value):
+        return self._filter(col, lambda v: v == value)
+
+    def neq(self, col, value):
+        return self._filter(col, lambda v: v != value)
+
+    def gt(self, col, value):
+        return self._filter(col, lambda v: v is not None and _cmp(v, value) > 0)
+
+    def gte(self, col, value):
+        return self._filter(col, lambda v: v is not None and _cmp(v, value) >= 0)
+
+    def lt(self, col, value):
+        return self._filter(col, lambda v: v is not None and _cmp(v, value) < 0)
+
+    def lte(self, col, value):
+        return self._filter(col, lambda v: v is not None and _cmp(v, value) <= 0)
+
+    def in_(self, col, values):
+        values = set(values)
+        return self._filter(col, lambda v: v in values)
+
+    def is_(self, col, value):
+        target = None if value in (None, "null") else value
+        return self._filter(col, lambda v: v is target or v == target)
+
+    def order(self, col, desc=False):
+        self.orders.append((col, desc))
+        return self
+
+    def limit(self, n):
+        self.limit_n = n
+        return self
+
+    def range(self, start, end):
+        self.offset_n, self.limit_n = start, end - start + 1
+        return self
+
+    # --- Execution ---
+
+    def _value(self, row, col):
+        # "raw_corpus.stock_code" filters through an embedded `raw_corpus!inner(...)` select
+        if "." not in col:
+            return row.get(col)
+        parent, field = col.split(".", 1)
+        fk = FOREIGN_KEYS.get(self.table, {}).get(parent)
+        target = self.db.find(parent, row.get(fk)) if fk else None
+        return target.get(field) if target else None
+
+    def _matches(self, row):
+        return all(fn(self._value(row, col)) for col, fn in self.filters)
+
+    def execute(self):
+        self.db.round_trips += 1
+        with self.db.lock:
+            rows = self.db.tables[self.table]
+            if self.op == "select":
+                hits = [r for r in rows if self._matches(r)]
+                for col, desc in reversed(self.orders):
+                    hits.sort(key=lambda r: (r.get(col) is None, r.get(col)), reverse=desc)
+                total = len(hits)
+                hits = hits[self.offset_n:]
+                if self.limit_n is not None:
+                    hits = hits[:self.limit_n]
+                return FakeResponse([self._project(r) for r in hits], total if self.count_mode else None)
+            if self.op == "insert":
+                new = [self.db._new_row(self.table, r) for r in _as_list(self.payload)]
+                rows.extend(new)
+                return FakeResponse(copy.deepcopy(new))
+            if self.op == "upsert":
+                return FakeResponse(self._upsert(rows))
+            if self.op == "update":
+                hits = [r for r in rows if self._matches(r)]
+                for r in hits:
+                    r.update(copy.deepcopy(self.payload))
+                return FakeResponse(copy.deepcopy(hits))
+            if self.op == "delete":
+                keep, gone = [], []
+                for r in rows:
+                    (gone if self._matches(r) else keep).append(r)
+                self.db.tables[self.table] = keep
+                return FakeResponse(copy.deepcopy(gone))
+        raise ValueError(f"Unsupported operation {self.op}")
+
+    def _upsert(self, rows):
+        keys = [k.strip() for k in (self.on_conflict or "id").split(",")]
+        index = {tuple(r.get(k) for k in keys): r for r in rows}
+        written = []
+        for payload in _as_list(self.payload):
+            key = tuple(payload.get(k) for k in keys)
+            existing = index.get(key)
+            if existing is None:
+                row = self.db._new_row(self.table, payload)
+                rows.append(row)
+                index[key] = row
+                written.append(copy.deepcopy(row))
+            elif not self.ignore_duplicates:
+                existing.update(copy.deepcopy(payload))
+                written.append(copy.deepcopy(existing))
+        return written
+
+    def _project(self, row):
+        if self.columns.strip() == "*":
+            return copy.deepcopy(row)
+        out = {}
+        # Embedded parents ("raw_corpus!inner(a, b)") resolve through FOREIGN_KEYS;
+        # other embeds (children) are not emulated
+        for parent, cols in _EMBED.findall(self.columns):
+            fk = FOREIGN_KEYS.get(self.table, {}).get(parent)
+            target = self.db.find(parent, row.get(fk)) if fk else None
+            if fk:
+                names = [c.strip() for c in cols.split(",") if c.strip()]
+                out[parent] = {c: copy.deepcopy(target.get(c)) for c in names} if target else None
+        plain = _EMBED.sub("", self.columns)
+        cols = [c.strip() for c in plain.split(",") if c.strip() and "(" not in c and ")" not in c]
+        out.update({c: copy.deepcopy(row.get(c)) for c in cols})
+        return out
+
+
+class FakeRpc:
+    def __init__(self, db, name, params):
+        self.db, self.name, self.params = db, name, params or {}
+
+    def execute(self):
+        self.db.round_trips += 1
+        fn = self.db.functions.get(self.name)
+        if fn is None:
+            raise ValueError(f"Unknown rpc {self.name}")
+        with self.db.lock:
+            return FakeResponse(copy.deepcopy(fn(self.db, **self.params)))
+
+
+class FakePostgrest:
+    def __init__(self, db):
+        self.db = db
+        self.token = None
+
+    def auth(self, token):
+        self.token = token
+
+
+class FakeSupabase:
+    """
+    In-memory stand-in for `supabase.Client`.
+    `round_trips` counts executed queries so benchmarks can report DB chatter.
+    """
+
+    def __init__(self):
+        self.tables = defaultdict(list)
+        self.functions = dict(DEFAULT_FUNCTIONS)
+        self.lock = threading.RLock()
+        self.round_trips = 0
+        self.postgrest = FakePostgrest(self)
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params=None):
+        return FakeRpc(self, name, params)
+
+    def seed(self, table, rows):
+        with self.lock:
+            new = [self._new_row(table, r) for r in rows]
+            self.tables[table].extend(new)
+            return new
+
+    def find(self, table, row_id):
+        return next((r for r in self.tables[table] if r.get("id") == row_id), None)
+
+    def _new_row(self, table, values):
+        row = {"id": str(uuid.uuid4()), "created_at": utc_now().isoformat()}
+        row.update(copy.deepcopy(TABLE_DEFAULTS.get(table, {})))
+        row.update(copy.deepcopy(values))
+        return row
+
+
+# --- Python versions of the SQL functions in supabase/schema.sql ---
+
+def claim_analysis_batch(db, p_worker, p_limit, p_lease_seconds, p_max_attempts, p_ids=None):
+    now = utc_now()
+    ids = set(p_ids) if p_ids is not None else None
+    free = [
+        r for r in db.tables["raw_corpus"]
+        if not r.get("is_analyzed")
+        and r.get("analysis_attempts", 0) < p_max_attempts
+        and (r.get("lease_expires_at") is None or _ts(r["lease_expires_at"]) < now)
+        and (ids is None or r["id"] in ids)
+    ]
+    free.sort(key=lambda r: r.get("publish_time") or "", reverse=True)
+    free.sort(key=lambda r: r.get("job_id") is None)
+    claimed = free[:p_limit]
+    for r in claimed:
+        r["lease_owner"] = p_worker
+        r["lease_expires_at"] = (now + timedelta(seconds=p_lease_seconds)).isoformat()
+        r["analysis_attempts"] = r.get("analysis_attempts", 0) + 1
+    return claimed
+
+
+def tag_analysis_job(db, p_job, p_stock):
+    tagged = 0
+    for r in db.tables["raw_corpus"]:
+        if r["stock_code"] == p_stock and not r.get("is_analyzed") and r.get("job_id") is None:
+            r["job_id"] = p_job
+            tagged += 1
+    return tagged
+
+
+def analysis_job_progress(db, p_job, p_max_attempts=3):
+    rows = [r for r in db.tables["raw_corpus"] if r.get("job_id") == p_job]
+    done = sum(1 for r in rows if r.get("is_analyzed"))
+    failed = sum(1 for r in rows if not r.get("is_analyzed") and r.get("analysis_attempts", 0) >= p_max_attempts)
+    return [{"total": len(rows), "done": done, "failed": failed}]
+
+
+def apply_sentiment_rollup(db, p_rows):
+    table = db.tables["sentiment_daily"]
+    index = {(r["stock_code"], r["day"], r["source"]): r for r in table}
+    for delta in p_rows:
+        row = index.get((delta["stock_code"], delta["day"], delta["source"]))
+        if row is None:
+            row = db._new_row("sentiment_daily", delta)
+            table.append(row)
+            index[(row["stock_code"], row["day"], row["source"])] = row
+            continue
+        row["score_sum"] += delta["score_sum"]
+        row["item_count"] += delta["item_count"]
+        merged = row["top_summaries"] + copy.deepcopy(delta["top_summaries"])
+        row["top_summaries"] = sorted(merged, key=lambda s: abs(s["score"]), reverse=True)[:3]
+    return None
+
+
+def replace_sentiment_rollup(db, p_stock, p_rows):
+    db.tables["sentiment_daily"] = [r for r in db.tables["sentiment_daily"] if r["stock_code"] != p_stock]
+    db.tables["sentiment_daily"].extend(db._new_row("sentiment_daily", r) for r in p_rows)
+    return None
+
+
+def claim_stale_symbols(db, p_worker, p_limit, p_stale_seconds, p_lease_seconds):
+    now = utc_now()
+    holders = defaultdict(set)
+    for r in db.tables["user_portfolios"]:
+        holders[r["stock_code"]].add(r.get("user_id"))
+    states = {r["stock_code"]: r for r in db.tables["ingest_state"]}
+    for code in holders:
+        if code not in states:
+            states[code] = db._new_row("ingest_state", {"stock_code": code})
+            db.tables["ingest_state"].append(states[code])
+
+    due = []
+    for code, users in holders.items():
+        state = states[code]
+        last, lease = _ts(state.get("last_ingested_at")), _ts(state.get("lease_expires_at"))
+        if last is not None and last >= now - timedelta(seconds=p_stale_seconds):
+            continue
+        if lease is not None and lease >= now:
+            continue
+        age = (now - last).total_seconds() if last is not None else 0.0
+        due.append((last is not None, -len(users) * age, -len(users), code))
+    due.sort()
+
+    claimed = []
+    for *_, code in due[:p_limit]:
+        state = states[code]
+        state["lease_owner"] = p_worker
+        state["lease_expires_at"] = (now + timedelta(seconds=p_lease_seconds)).isoformat()
+        state["holders"] = len(holders[code])
+        claimed.append(state)
+    return claimed
+
+
+DEFAULT_FUNCTIONS = {
+    "claim_analysis_batch": claim_analysis_batch,
+    "analysis_job_progress": analysis_job_progress,
+    "tag_analysis_job": tag_analysis_job,
+    "apply_sentiment_rollup": apply_sentiment_rollup,
+    "replace_sentiment_rollup": replace_sentiment_rollup,
+    "claim_stale_symbols": claim_stale_symbols,
+}
+
+
+def _as_list(rows):
+    return rows if isinstance(rows, list) else [rows]
+
+
+def _cmp(a, b):
+    if isinstance(a, datetime) or isinstance(b, datetime):
+        a, b = _ts(a), _ts(b)
+    return (a > b) - (a < b)
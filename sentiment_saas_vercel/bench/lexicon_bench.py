@@ -0,0 +1,72 @@
+"""
+Lexicon scorer checks and throughput.
+
+Checks that:
+- ordinary words containing a negator/intensifier character ("无人机", "未来",
+  "不断", "非洲", "微软") neither flip nor scale the sentiment term after them;
+- real negations and intensifiers still do;
+- titles are scored at a useful rate on one core.
+
+Usage (from sentiment_saas_vercel/):
+    python bench/lexicon_bench.py --titles 50000
+"""
+import argparse
+import pathlib
+import random
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "api"))
+
+from _lib import lexicon  # noqa: E402
+
+# (title, expected sign of the score)
+FALSE_POSITIVES = [
+    ("无人机订单大增", 1), ("未来业绩增长", 1), ("不断创新高", 1), ("非洲业务大增", 1),
+    ("微软股价大涨", 1), ("无锡工厂量产", 1), ("超市业务营收增长", 1), ("不少机构看好", 1),
+    ("未来或面临处罚", -1), ("无线业务下滑", -1), ("非银板块大跌", -1), ("微信支付份额下降", -1),
+]
+NEGATIONS = [
+    ("业绩不及预期", -1), ("净利润未增长", -1), ("否认违规", 1), ("未大幅下滑", 1),
+    ("不会减持", 1), ("并未下调评级", 1),
+]
+# (title, the same title without the word): the word must not scale the term
+UNSCALED = [("微软股价大涨", "股价大涨"), ("超级工厂量产", "工厂量产"), ("非洲业务大增", "业务大增")]
+
+
+def sign(value):
+    return (value > 0) - (value < 0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--titles", type=int, default=50000)
+    args = parser.parse_args()
+    failures = []
+
+    def check(ok, message):
+        print(f"  {'ok  ' if ok else 'FAIL'} {message}")
+        if not ok:
+            failures.append(message)
+
+    for title, expected in FALSE_POSITIVES + NEGATIONS:
+        score, confidence, terms = lexicon.score_text(title)
+        check(sign(score) == expected, f"{title}: {score:+.3f} ({'、'.join(terms)})")
+    for title, plain in UNSCALED:
+        check(lexicon.score_text(title)[0] == lexicon.score_text(plain)[0], f"{title} scores like {plain}")
+
+    rng = random.Random(0)
+    words = [t for t, _ in FALSE_POSITIVES + NEGATIONS] + ["公司发布公告", "董事会换届", "行业观察"]
+    titles = ["，".join(rng.sample(words, 3)) for _ in range(args.titles)]
+    started = time.perf_counter()
+    lexicon.score_texts(titles)
+    elapsed = time.perf_counter() - started
+    print(f"{args.titles} titles in {elapsed:.2f}s ({args.titles / elapsed:,.0f}/s)")
+
+    if failures:
+        sys.exit(f"FAIL: {len(failures)} checks failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Local OpenAI-compatible completion server for benchmarks.
+
+Serves `POST /v1/chat/completions` from a background thread. Replies look like
+DeepSeek's: a JSON object for single-item prompts, or a JSON array with one entry
+per `[n]` line for packed prompts. Latency is `base_latency + per_token_latency *
+(prompt + completion tokens)`, and `error_rate` of requests fail with 429/500 so
+callers' retry paths get exercised. Token usage is counted the way the backend
+estimates it and reported in `usage`, and totals are kept on the server.
+Like DeepSeek's context cache, the part of a prompt that repeats the start of an
+earlier prompt is reported as `prompt_cache_hit_tokens` (in whole 64-token units).
+"""
+import json
+import os
+import pathlib
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "api"))
+
+from _lib.sentiment import estimate_tokens  # noqa: E402
+
+_ITEM_LINE = re.compile(r"^\[(\d+)\]", re.MULTILINE)
+CACHE_UNIT_TOKENS = 64
+CACHE_PROMPTS = 256  # recent prompts kept for prefix matching
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # the default backlog of 5 would throttle concurrent clients
+
+
+class MockCompletionServer:
+    def __init__(self, base_latency=0.2, per_token_latency=0.0005, error_rate=0.0,
+                 drop_rate=0.0, seed=0, host="127.0.0.1", port=0):
+        self.base_latency = base_latency
+        self.per_token_latency = per_token_latency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate  # chance a packed reply omits an item
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0, "cache_hit_tokens": 0}
+        self.recent_prompts = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._server = _Server((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {k: 0 for k in self.stats}
+            self.recent_prompts = []
+            self.peak_in_flight = 0
+
+    # --- Reply synthesis ---
+
+    def _cache_hit(self, prompt):
+        """
+        Tokens of the longest prefix shared with a recent prompt, rounded down to
+        whole cache units. Call with the lock held.
+        """
+        shared = max((len(os.path.commonprefix([prompt, p])) for p in self.recent_prompts), default=0)
+        self.recent_prompts = (self.recent_prompts + [prompt])[-CACHE_PROMPTS:]
+        return estimate_tokens(prompt[:shared]) // CACHE_UNIT_TOKENS * CACHE_UNIT_TOKENS
+
+    def _reply(self, messages):
+        user = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+        ids = [int(n) for n in _ITEM_LINE.findall(user)]
+        if ids:
+            rows = [
+                {"id": i, "score": round(self.rng.uniform(-1, 1), 2), "summary": "模拟分析：情绪中性偏多"}
+                for i in ids if self.rng.random() >= self.drop_rate
+            ]
+            return json.dumps(rows, ensure_ascii=False)
+        return json.dumps({"score": round(self.rng.uniform(-1, 1), 2), "summary": "模拟分析：情绪中性偏多"},
+                          ensure_ascii=False)
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                messages = body.get("messages", [])
+                prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+                prompt = "".join(m.get("content", "") for m in messages)
+                with mock.lock:
+                    mock.stats["requests"] += 1
+                    cache_hit = mock._cache_hit(prompt)
+                    mock.in_flight += 1
+                    mock.peak_in_flight = max(mock.peak_in_flight, mock.in_flight)
+                    fail = mock.rng.random() < mock.error_rate
+                    content = None if fail else mock._reply(messages)
+                try:
+                    completion_tokens = estimate_tokens(content) if content else 0
+                    time.sleep(mock.base_latency + mock.per_token_latency * (prompt_tokens + completion_tokens))
+                    if fail:
+                        with mock.lock:
+                            mock.stats["errors"] += 1
+                        status = 429 if mock.rng.random() < 0.5 else 500
+                        self._send(status, {"error": {"message": "mock failure", "type": "rate_limit"}},
+                                   {"Retry-After": "0"} if status == 429 else {})
+                        return
+                    with mock.lock:
+                        mock.stats["prompt_tokens"] += prompt_tokens
+                        mock.stats["completion_tokens"] += completion_tokens
+                        mock.stats["cache_hit_tokens"] += cache_hit
+                    self._send(200, {
+                        "id": "mock-1",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": body.get("model", "mock"),
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": content}}],
+                        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                  "total_tokens": prompt_tokens + completion_tokens,
+                                  "prompt_cache_hit_tokens": cache_hit,
+                                  "prompt_cache_miss_tokens": prompt_tokens - cache_hit},
+                    })
+                finally:
+                    with mock.lock:
+                        mock.in_flight -= 1
+
+            def _send(self, status, payload, headers=None):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
@@ -0,0 +1,80 @@
+"""
+Per-item vs packed prompt benchmark against the local mock completion server.
+
+Reports items/s, requests and tokens per item for both paths over the same
+synthetic corpus of short news titles and one-line research-report blurbs.
+
+Usage (from sentiment_saas_vercel/):
+    python bench/packing_bench.py --items 200 --latency 0.3 --drop-rate 0.05
+"""
+import argparse
+import asyncio
+import os
+import pathlib
+import random
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "api"))
+sys.path.insert(0, str(ROOT / "bench"))
+
+from mock_llm import MockCompletionServer  # noqa: E402
+
+HEADLINES = ["业绩预告超预期，净利润同比大增", "股东拟减持不超过2%股份", "获机构调研，订单饱满",
+             "新产品发布会召开，市场反响热烈", "遭遇监管问询，股价承压", "季度营收小幅下滑"]
+ORGS = ["中信证券", "华泰证券", "国泰君安", "招商证券"]
+RATINGS = ["买入", "增持", "中性", "减持"]
+
+
+def make_items(n, seed=0):
+    rng = random.Random(seed)
+    items = []
+    for i in range(n):
+        if rng.random() < 0.6:
+            title = f"{rng.choice(HEADLINES)}（{i}）"
+            items.append({"id": f"n{i}", "source": "news", "title": title, "content": title})
+        else:
+            title = f"深度报告：{rng.choice(HEADLINES)}（{i}）"
+            content = f"[{rng.choice(ORGS)}] {title} - 评级: {rng.choice(RATINGS)}"
+            items.append({"id": f"r{i}", "source": "report", "title": title, "content": content})
+    return items
+
+
+async def run_path(items, packed, batch_size):
+    from _lib.sentiment import analyze_items
+    started = time.perf_counter()
+    scored = 0
+    # Same shape as the dashboard: batches of corpus ids, one analyze_batch call each
+    for i in range(0, len(items), batch_size):
+        results, _ = await analyze_items(items[i:i + batch_size], packed=packed)
+        scored += len(results)
+    return scored, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=50, help="corpus ids per analyze_batch call")
+    parser.add_argument("--latency", type=float, default=0.3, help="mock base latency per request (s)")
+    parser.add_argument("--per-token-latency", type=float, default=0.002, help="mock seconds per token")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="chance a packed reply omits an item")
+    args = parser.parse_args()
+
+    items = make_items(args.items)
+    with MockCompletionServer(base_latency=args.latency, per_token_latency=args.per_token_latency,
+                              drop_rate=args.drop_rate) as server:
+        os.environ["DEEPSEEK_API_KEY"] = "mock"
+        os.environ["DEEPSEEK_BASE_URL"] = server.base_url
+
+        print(f"{'path':<10}{'items/s':>10}{'requests':>10}{'tok/item':>10}{'scored':>8}")
+        for label, packed in (("per-item", False), ("packed", True)):
+            server.reset_stats()
+            scored, elapsed = asyncio.run(run_path(items, packed, args.batch_size))
+            stats = server.stats
+            tokens = stats["prompt_tokens"] + stats["completion_tokens"]
+            print(f"{label:<10}{scored / elapsed:>10.1f}{stats['requests']:>10}{tokens / max(scored, 1):>10.1f}{scored:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Local PostgREST-compatible HTTP server backed by `FakeSupabase`.
+
+Serves `/rest/v1/<table>` (GET/POST/PATCH/DELETE with PostgREST filter syntax,
+`select`, `order`, `limit`, `offset`, `on_conflict`, `Prefer: resolution=...`
+and `count=exact`) and `/rest/v1/rpc/<function>`, so the real supabase-py /
+postgrest-py clients can run against it over real sockets. Filter values are
+passed through as strings, except `true`/`false`/`null`.
+
+`latency` is added to every request (round trip + query time) and
+`connect_latency` to every new connection (TCP + TLS handshake), so the cost of
+opening connections can be measured locally. Every request's bearer-token
+subject is recorded in `requests_log` for auth-isolation checks.
+"""
+import base64
+import csv
+import json
+import pathlib
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+from fakes import FakeRpc, FakeSupabase  # noqa: E402
+
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+_LITERALS = {"true": True, "false": False, "null": None}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+def token_subject(authorization):
+    """
+    `sub` of a bearer JWT (unverified), or None.
+    """
+    token = (authorization or "").replace("Bearer ", "")
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload)).get("sub")
+    except (IndexError, ValueError, AttributeError):
+        return None
+
+
+def _literal(value):
+    return _LITERALS.get(value, value)
+
+
+def _in_values(value):
+    inner = value[1:-1] if value.startswith("(") and value.endswith(")") else value
+    return [_literal(v) for v in next(csv.reader([inner]))] if inner else []
+
+
+def apply_filter(query, column, expression):
+    """
+    Applies one `column=op.value` PostgREST filter to a FakeQuery.
+    """
+    op, _, value = expression.partition(".")
+    if op == "in":
+        return query.in_(column, _in_values(value))
+    if op == "is":
+        return query.is_(column, _literal(value))
+    if op in ("eq", "neq", "gt", "gte", "lt", "lte"):
+        return getattr(query, op)(column, _literal(value))
+    raise ValueError(f"Unsupported filter {column}={expression}")
+
+
+class PostgrestStub:
+    def __init__(self, db=None, latency=0.0, connect_latency=0.0, host="127.0.0.1", port=0):
+        self.db = db or FakeSupabase()
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "connections": 0, "errors": 0}
+        self.requests_log = []  # (method, path with query, token subject)
+        self._server = _Server((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        Project URL, as passed to create_client / SupabasePool.
+        """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {k: 0 for k in self.stats}
+            self.requests_log = []
+
+    # --- Request translation ---
+
+    def execute(self, method, path, params, prefer, body):
+        """
+        Runs one REST call against the fake store. Returns (status, rows, count).
+        """
+        name = path.split("/rest/v1/", 1)[-1].strip("/")
+        if name.startswith("rpc/"):
+            return 200, FakeRpc(self.db, name[4:], body or {}).execute().data, None
+
+        query = self.db.table(name)
+        count = "exact" if "count=exact" in prefer else None
+        if method in ("GET", "HEAD"):
+            query.select(params.get("select", "*"), count=count)
+        elif method == "POST":
+            if "resolution=" in prefer:
+                query.upsert(body, on_conflict=params.get("on_conflict", "id"),
+                             ignore_duplicates="resolution=ignore-duplicates" in prefer)
+            else:
+                query.insert(body)
+        elif method == "PATCH":
+            query.update(body)
+        elif method == "DELETE":
+            query.delete()
+        else:
+            raise ValueError(f"Unsupported method {method}")
+
+        for column, expression in params.items():
+            if column not in RESERVED_PARAMS:
+                apply_filter(query, column, expression)
+        for term in filter(None, params.get("order", "").split(",")):
+            column, *modifiers = term.split(".")
+            query.order(column, desc="desc" in modifiers)
+        if "limit" in params:
+            query.limit(int(params["limit"]))
+        if "offset" in params:
+            query.offset_n = int(params["offset"])
+        res = query.execute()
+        return (201 if method == "POST" else 200), res.data, res.count
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, so reused connections stay open
+            disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with stub.lock:
+                    stub.stats["connections"] += 1
+                if stub.connect_latency:
+                    time.sleep(stub.connect_latency)
+
+            def do_GET(self):
+                self._serve("GET")
+
+            def do_POST(self):
+                self._serve("POST")
+
+            def do_PATCH(self):
+                self._serve("PATCH")
+
+            def do_DELETE(self):
+                self._serve("DELETE")
+
+            def _serve(self, method):
+                parts = urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                with stub.lock:
+                    stub.stats["requests"] += 1
+                    stub.requests_log.append((method, self.path, token_subject(self.headers.get("Authorization"))))
+                if stub.latency:
+                    time.sleep(stub.latency)
+                try:
+                    body = json.loads(raw) if raw else None
+                    status, rows, count = stub.execute(
+                        method, parts.path, dict(parse_qsl(parts.query, keep_blank_values=True)),
+                        self.headers.get("Prefer") or "", body,
+                    )
+                    headers = {}
+                    if count is not None:
+                        headers["Content-Range"] = f"0-{max(len(rows) - 1, 0)}/{count}"
+                    self._send(status, rows if rows is not None else [], headers)
+                except Exception as e:
+                    with stub.lock:
+                        stub.stats["errors"] += 1
+                    self._send(400, {"message": str(e), "code": "STUB", "hint": None, "details": None})
+
+            def _send(self, status, payload, headers=None):
+                data = json.dumps(payload, default=str).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
@@ -0,0 +1,130 @@
+"""
+Token-budgeted prompts against the local mock completion server.
+
+Scores a synthetic corpus of short headlines and long articles (filler
+paragraphs with a few sentences that name the stock or carry sentiment terms)
+with the per-item and packed paths, and reports prompt tokens per item, tokens
+saved by trimming and the share of prompt tokens the mock's prefix cache served.
+
+Checks that:
+- trimmed prompts stay within the per-item budget and keep the lead, the
+  sentences quoting the stock code and the sentiment sentences;
+- short items are sent unchanged;
+- every prompt starts with the same bytes, so the prefix cache serves it;
+- the token columns of the stored rows add up to the usage the server reported.
+
+Usage (from sentiment_saas_vercel/):
+    python bench/prompt_bench.py --items 120 --long-share 0.4
+"""
+import argparse
+import asyncio
+import os
+import pathlib
+import random
+import sys
+import time
+import unicodedata
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "api"))
+sys.path.insert(0, str(ROOT / "bench"))
+
+from mock_llm import MockCompletionServer  # noqa: E402
+from _lib import prompt  # noqa: E402
+
+NAMES = {"600519": "贵州茅台", "000001": "平安银行", "300750": "宁德时代"}
+FILLER = ["行业整体格局在过去一段时间内保持相对稳定，各方参与者持续关注宏观环境的变化。",
+          "从历史数据来看，相关板块的季节性波动与往年大致相同，市场交投情绪较为平淡。",
+          "分析人士指出，后续仍需结合更多公开信息进行综合判断，短期内不宜过度解读。",
+          "会议还讨论了若干常规事项，包括年度审计安排及董事会换届的时间表。"]
+KEY = ["公司三季度净利润同比大增，业绩超预期。", "控股股东宣布减持计划，股价承压。"]
+
+
+def make_items(n, long_share, seed=0):
+    """
+    Returns (items, {item id: sentences trimming must keep}).
+    """
+    rng = random.Random(seed)
+    items, must_keep = [], {}
+    for i in range(n):
+        code = rng.choice(list(NAMES))
+        title = f"{NAMES[code]}：{rng.choice(['经营动态', '公告点评', '行业观察'])}（{i}）"
+        if rng.random() >= long_share:
+            items.append({"id": f"s{i}", "stock_code": code, "source": "news", "title": title, "content": title})
+            continue
+        lead = f"{NAMES[code]}今日发布公告，披露了最新的经营情况。"
+        mention = f"据悉，{NAMES[code]}（{code}）管理层表示将继续聚焦主业。"
+        key = rng.choice(KEY)
+        body = [lead] + [rng.choice(FILLER) for _ in range(40)]
+        body.insert(15, mention)
+        body.insert(28, key)
+        items.append({"id": f"l{i}", "stock_code": code, "source": "news", "title": title, "content": "".join(body)})
+        must_keep[f"l{i}"] = [lead, mention, key]
+    return items, must_keep
+
+
+async def run_path(items, packed, batch_size):
+    from _lib.sentiment import analyze_items
+    rows = []
+    for i in range(0, len(items), batch_size):
+        results, _ = await analyze_items(items[i:i + batch_size], packed=packed)
+        rows += results
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=120)
+    parser.add_argument("--long-share", type=float, default=0.4, help="share of items that are long articles")
+    parser.add_argument("--batch-size", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.05, help="mock base latency per request (s)")
+    args = parser.parse_args()
+    failures = []
+
+    def check(ok, message):
+        print(f"  {'ok  ' if ok else 'FAIL'} {message}")
+        if not ok:
+            failures.append(message)
+
+    items, must_keep = make_items(args.items, args.long_share)
+    texts = {item["id"]: prompt.fit(item) for item in items}
+    long_ids = set(must_keep)
+    over = [i for i, t in texts.items() if t.tokens > prompt.ITEM_TOKEN_BUDGET]
+    check(not over, f"every prompt text within {prompt.ITEM_TOKEN_BUDGET} tokens")
+    kept = all(unicodedata.normalize("NFKC", s) in texts[i].text for i, sentences in must_keep.items() for s in sentences)
+    check(kept, "trimming keeps the lead, the stock mention and the sentiment sentence")
+    short = [i for i in texts if i not in long_ids]
+    check(all(texts[i].tokens == texts[i].content_tokens for i in short), "short items are not trimmed")
+    full = sum(t.content_tokens for t in texts.values())
+    sent = sum(t.tokens for t in texts.values())
+    print(f"{len(items)} items ({len(long_ids)} long): {full} content tokens -> {sent} sent "
+          f"({1 - sent / full:.0%} trimmed)")
+
+    with MockCompletionServer(base_latency=args.latency, per_token_latency=0.0) as server:
+        os.environ["DEEPSEEK_API_KEY"] = "mock"
+        os.environ["DEEPSEEK_BASE_URL"] = server.base_url
+        print(f"{'path':<10}{'items/s':>10}{'requests':>10}{'prompt/item':>13}{'cached':>9}")
+        for label, packed in (("per-item", False), ("packed", True)):
+            server.reset_stats()
+            started = time.perf_counter()
+            rows = asyncio.run(run_path(items, packed, args.batch_size))
+            elapsed = time.perf_counter() - started
+            stats = server.stats
+            print(f"{label:<10}{len(rows) / elapsed:>10.1f}{stats['requests']:>10}"
+                  f"{stats['prompt_tokens'] / max(len(rows), 1):>13.1f}"
+                  f"{stats['cache_hit_tokens'] / max(stats['prompt_tokens'], 1):>9.0%}")
+            totals = {column: sum(r[column] for r in rows) for column in ("prompt_tokens", "completion_tokens", "cached_tokens")}
+            check(totals == {"prompt_tokens": stats["prompt_tokens"], "completion_tokens": stats["completion_tokens"],
+                             "cached_tokens": stats["cache_hit_tokens"]},
+                  f"{label}: row token columns add up to the server's usage")
+            prefix = prompt.estimate_tokens(prompt.PACKED_SYSTEM_PROMPT if packed else prompt.SYSTEM_PROMPT) // 64 * 64
+            check(stats["cache_hit_tokens"] >= (stats["requests"] - 1) * prefix,
+                  f"{label}: the shared prefix is served from the cache")
+            check(all(r["trimmed_tokens"] > 0 for r in rows if r["corpus_id"] in long_ids), f"{label}: trimmed tokens recorded")
+
+    if failures:
+        sys.exit(f"FAIL: {len(failures)} checks failed")
+
+
+if __name__ == "__main__":
+    main()
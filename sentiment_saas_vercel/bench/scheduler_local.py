@@ -0,0 +1,174 @@
+"""
+Runs the market-wide ingestion scheduler against the in-memory Supabase stand-in
+and the AkShare shim.
+
+Seeds users whose portfolios overlap (a few popular stocks, a long tail) and checks:
+- every portfolio stock is fetched exactly once per round, however many users hold it;
+- popular stocks are claimed first, and an immediate second round finds nothing due;
+- once the data ages, the stale symbols are claimed again, by holders x staleness;
+- a symbol whose sources all fail is parked for `retry_seconds`, not retried in a loop;
+- two schedulers running side by side never claim the same symbol.
+It also compares fetch counts with every user refreshing their own portfolio.
+
+Usage (from sentiment_saas_vercel/):
+    python bench/scheduler_local.py --users 200 --stocks 60 --portfolio 8 --akshare-latency 0.02
+"""
+import argparse
+import asyncio
+import collections
+import pathlib
+import random
+import sys
+import time
+from datetime import timedelta
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "api"))
+sys.path.insert(0, str(ROOT / "bench"))
+
+from akshare_shim import AkShareShim  # noqa: E402
+from fakes import FakeSupabase, utc_now  # noqa: E402
+from _lib import ingest  # noqa: E402
+from _lib.analysis_worker import AnalysisWorker  # noqa: E402
+from _lib.scheduler import IngestScheduler  # noqa: E402
+
+BROKEN = "688999"  # every source raises for this one
+
+
+def seed_portfolios(db, users, stocks, size, seed):
+    """
+    Zipf-like popularity: low-numbered stocks are held by many users.
+    """
+    rng = random.Random(seed)
+    codes = [f"600{i:03d}" for i in range(stocks)]
+    weights = [1.0 / (rank + 1) for rank in range(stocks)]
+    rows = []
+    for u in range(users):
+        held = set()
+        while len(held) < min(size, stocks):
+            held.add(rng.choices(codes, weights)[0])
+        rows += [{"user_id": f"user-{u}", "stock_code": code} for code in held]
+    rows.append({"user_id": "user-0", "stock_code": BROKEN})
+    db.seed("user_portfolios", rows)
+    return collections.Counter(r["stock_code"] for r in rows)
+
+
+async def analyze(item):
+    await asyncio.sleep(0.001)
+    return {"corpus_id": item["id"], "news_score_raw": 0.1, "guba_score_raw": None, "summary": "ok"}
+
+
+def sources():
+    def broken(fetch):
+        def call(code):
+            if code == BROKEN:
+                raise RuntimeError("upstream error")
+            return fetch(code)
+        return call
+    return {name: (broken(fetch), convert) for name, (fetch, convert) in ingest.SOURCES.items()}
+
+
+def make_scheduler(db, name, args):
+    return IngestScheduler(db, worker=AnalysisWorker(db, analyze=analyze, worker_id=f"{name}-worker"),
+                           scheduler_id=name, batch_size=args.batch_size, stale_seconds=args.stale_seconds,
+                           retry_seconds=args.stale_seconds * 4, sources=sources())
+
+
+def age(db, seconds):
+    for state in db.tables["ingest_state"]:
+        for column in ("last_ingested_at", "lease_expires_at"):
+            if state.get(column):
+                state[column] = (utc_now() - timedelta(seconds=seconds)).isoformat()
+
+
+async def run(args):
+    shim = AkShareShim(latency=args.akshare_latency)
+    shim.install()
+    db = FakeSupabase()
+    holders = seed_portfolios(db, args.users, args.stocks, args.portfolio, args.seed)
+    failures = []
+
+    def check(ok, message):
+        print(f"  {'ok  ' if ok else 'FAIL'} {message}")
+        if not ok:
+            failures.append(message)
+
+    # Round 1: everything is new; two schedulers split the universe
+    claims = collections.defaultdict(list)
+    original = FakeSupabase.rpc
+
+    def tracking_rpc(self, name, params=None):
+        rpc = original(self, name, params)
+        if name != "claim_stale_symbols":
+            return rpc
+        execute = rpc.execute
+
+        def run_and_track():
+            res = execute()
+            claims[params["p_worker"]].append([r["stock_code"] for r in res.data])
+            return res
+        rpc.execute = run_and_track
+        return rpc
+
+    FakeSupabase.rpc = tracking_rpc
+    schedulers = [make_scheduler(db, f"s{i}", args) for i in range(2)]
+    started = time.perf_counter()
+    await asyncio.gather(*[s.catch_up() for s in schedulers])
+    elapsed = time.perf_counter() - started
+
+    fetched = shim.calls.get("stock_news_em", 0)
+    claimed = [code for batches in claims.values() for batch in batches for code in batch]
+    naive = sum(holders.values())
+    print(f"users={args.users} portfolio rows={naive} distinct stocks={len(holders)}")
+    print(f"round 1: {elapsed:.2f}s, news fetches={fetched} (per-user refresh would make {naive}), "
+          f"rows={len(db.tables['raw_corpus'])}, analyzed={len(db.tables['sentiment_results'])}")
+    check(sorted(claimed) == sorted(holders), "every portfolio stock claimed exactly once across both schedulers")
+    check(fetched == len(holders) - 1, "one news fetch per (working) stock")
+    first = next(batches[0] for batches in claims.values() if batches)
+    top = sorted(holders, key=lambda c: -holders[c])[:len(first)]
+    check(min(holders[c] for c in first) >= min(holders[c] for c in top), "first batch holds the most popular stocks")
+    check(not [r for r in db.tables["raw_corpus"] if not r["is_analyzed"]], "every new row analyzed")
+    state = {s["stock_code"]: s for s in db.tables["ingest_state"]}
+    check(state[BROKEN]["last_ingested_at"] is None and bool(state[BROKEN]["last_error"]),
+          "failing symbol keeps no freshness and records its error")
+
+    # Round 2: nothing is stale yet
+    claims.clear()
+    await schedulers[0].catch_up()
+    check(not any(batch for batches in claims.values() for batch in batches), "fresh symbols are not re-claimed")
+
+    # Round 3: data ages past the threshold; the broken symbol's backoff has not run out
+    age(db, args.stale_seconds * 2)
+    for state in db.tables["ingest_state"]:
+        if state["stock_code"] == BROKEN:
+            state["lease_expires_at"] = (utc_now() + timedelta(seconds=60)).isoformat()
+    claims.clear()
+    await schedulers[0].run_once()
+    batch = claims["s0"][0]
+    expected = sorted((c for c in holders if c != BROKEN), key=lambda c: -holders[c])[:len(batch)]
+    check([holders[c] for c in batch] == [holders[c] for c in expected], "stale symbols re-claimed by holders x age")
+    await schedulers[0].catch_up()
+    again = [code for batches in claims.values() for batch in batches for code in batch]
+    check(BROKEN not in again, "parked symbol waits out its retry delay")
+
+    FakeSupabase.rpc = original
+    for s in schedulers:
+        print(f"  {s.scheduler_id}: {s.stats}, analysis {s.worker.stats}")
+    if failures:
+        sys.exit(f"FAIL: {len(failures)} checks failed")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--stocks", type=int, default=60)
+    parser.add_argument("--portfolio", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--stale-seconds", type=int, default=900)
+    parser.add_argument("--akshare-latency", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=7)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
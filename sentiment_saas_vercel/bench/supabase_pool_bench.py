@@ -0,0 +1,152 @@
+"""
+Per-request Supabase client cost: `create_client()` per request vs the shared
+`SupabasePool`, measured against the local PostgREST stub.
+
+1. Single query: each "request" builds its client and runs one select.
+2. cleanup_data: `run_cleanup` on a seeded stock (duplicate titles, English
+   summaries) with a fresh client and sequential queries, a pooled client with
+   sequential queries, and a pooled client with `parallel` queries.
+3. Isolation: concurrent requests for different users through one pool; every
+   query the stub receives must carry the JWT of the user that issued it.
+
+`--connect-latency` stands in for the TCP + TLS handshake a new connection costs
+against a hosted project, `--latency` for the round trip of each query.
+
+Usage (from sentiment_saas_vercel/):
+    python bench/supabase_pool_bench.py --requests 50 --latency 0.01 --connect-latency 0.05
+"""
+import argparse
+import base64
+import json
+import pathlib
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "api"))
+sys.path.insert(0, str(ROOT / "bench"))
+
+from _lib import cleanup, supabase_pool  # noqa: E402
+from _lib.supabase_pool import SupabasePool  # noqa: E402
+from postgrest_stub import PostgrestStub  # noqa: E402
+
+STOCK = "600519"
+
+
+def fake_jwt(sub):
+    def part(obj):
+        return base64.urlsafe_b64encode(json.dumps(obj).encode()).decode().rstrip("=")
+    return f"{part({'alg': 'HS256', 'typ': 'JWT'})}.{part({'sub': sub, 'role': 'authenticated'})}.c2ln"
+
+
+ANON_KEY = fake_jwt("anon")
+
+
+def fresh_client(url, token):
+    """
+    What get_user_supabase used to do on every request.
+    """
+    from supabase import create_client
+    client = create_client(url, ANON_KEY)
+    client.postgrest.auth(token)
+    return client
+
+
+def seed(db, rows):
+    db.tables.clear()
+    corpus = db.seed("raw_corpus", [
+        {"stock_code": STOCK, "source": "news", "title": f"公告{i % (rows // 3)}",
+         "publish_time": f"2024-01-{1 + i % 28:02d}T09:30:00+00:00"}
+        for i in range(rows)
+    ])
+    db.seed("sentiment_results", [
+        {"corpus_id": r["id"], "news_score_raw": 0.1,
+         "summary": "Strong quarterly growth expected" if i % 4 == 0 else "业绩稳健增长"}
+        for i, r in enumerate(corpus)
+    ])
+
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def single_queries(stub, n, make_client):
+    stub.reset_stats()
+    token = fake_jwt("bench-user")
+    times = [timed(lambda: make_client(token).table("raw_corpus").select("id").limit(1).execute())
+             for _ in range(n)]
+    return {"mean_ms": round(statistics.mean(times) * 1000, 2),
+            "p95_ms": round(sorted(times)[int(len(times) * 0.95) - 1] * 1000, 2),
+            "connections": stub.stats["connections"]}
+
+
+def cleanup_run(stub, rows, make_client, parallelism):
+    seed(stub.db, rows)
+    stub.reset_stats()
+    supabase_pool.QUERY_PARALLELISM = parallelism
+    client = make_client(fake_jwt("bench-user"))
+    elapsed = timed(lambda: cleanup.run_cleanup(client, STOCK, full=True))
+    return {"elapsed_ms": round(elapsed * 1000, 1), "queries": stub.stats["requests"],
+            "connections": stub.stats["connections"]}
+
+
+def isolation(stub, pool, users, per_user):
+    stub.reset_stats()
+
+    def run(user):
+        for _ in range(per_user):
+            # The filter value names the user, so the stub log can pair it with the token
+            pool.client(fake_jwt(user)).table("raw_corpus").select("id").eq("stock_code", user).limit(1).execute()
+
+    with ThreadPoolExecutor(max_workers=len(users)) as executor:
+        list(executor.map(run, users))
+    mismatches = sum(1 for _, path, sub in stub.requests_log if f"stock_code=eq.{sub}" not in path)
+    return {"queries": len(stub.requests_log), "users": len(users), "mismatches": mismatches}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=1500, help="raw_corpus rows seeded for cleanup")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds per query round trip")
+    parser.add_argument("--connect-latency", type=float, default=0.05, help="seconds per new connection")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    report = {}
+    with PostgrestStub(latency=args.latency, connect_latency=args.connect_latency) as stub:
+        pool = SupabasePool(stub.url, ANON_KEY)
+        report["single_query"] = {
+            "create_client": single_queries(stub, args.requests, lambda token: fresh_client(stub.url, token)),
+            "pooled": single_queries(stub, args.requests, pool.client),
+        }
+        parallelism = supabase_pool.QUERY_PARALLELISM
+        report["cleanup_data"] = {
+            "create_client, sequential": cleanup_run(stub, args.rows, lambda t: fresh_client(stub.url, t), 1),
+            "pooled, sequential": cleanup_run(stub, args.rows, pool.client, 1),
+            "pooled, parallel": cleanup_run(stub, args.rows, pool.client, parallelism),
+        }
+        supabase_pool.QUERY_PARALLELISM = parallelism
+        report["isolation"] = isolation(stub, pool, [f"user{i}" for i in range(8)], 25)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    fresh, pooled = report["single_query"]["create_client"], report["single_query"]["pooled"]
+    print(f"single query x{args.requests} (latency {args.latency}s, connect {args.connect_latency}s)")
+    for name, r in report["single_query"].items():
+        print(f"  {name:<28}{r['mean_ms']:>8} ms/request  p95 {r['p95_ms']} ms  connections {r['connections']}")
+    print(f"  saving per request: {fresh['mean_ms'] - pooled['mean_ms']:.2f} ms")
+    print(f"cleanup_data ({args.rows} rows)")
+    for name, r in report["cleanup_data"].items():
+        print(f"  {name:<28}{r['elapsed_ms']:>8} ms  queries {r['queries']}  connections {r['connections']}")
+    iso = report["isolation"]
+    print(f"isolation: {iso['queries']} queries from {iso['users']} users, {iso['mismatches']} carried another user's token")
+
+
+if __name__ == "__main__":
+    main()
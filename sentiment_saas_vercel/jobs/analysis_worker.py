@@ -0,0 +1,66 @@
+"""
+Long-lived analysis worker. Drains unanalyzed raw_corpus rows so analysis no longer
+depends on a browser tab looping over /api/analyze_batch.
+
+Usage (from sentiment_saas_vercel/):
+    python jobs/analysis_worker.py --concurrency 20 --batch-size 50
+    python jobs/analysis_worker.py --drain   # exit once the queue is empty
+
+Needs SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY (the worker writes across all users),
+plus DEEPSEEK_API_KEY for real scoring. Run as many copies as you like; row leases
+keep them from analyzing the same row twice.
+"""
+import argparse
+import asyncio
+import os
+import pathlib
+import sys
+
+from dotenv import load_dotenv
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "api"))
+load_dotenv(dotenv_path=ROOT / ".env.local")
+
+from _lib.analysis_worker import AnalysisWorker  # noqa: E402
+from _lib.llm_dispatch import get_dispatcher  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drain unanalyzed raw_corpus rows.")
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get("WORKER_CONCURRENCY", "10")),
+                        help="max in-flight LLM calls")
+    parser.add_argument("--batch-size", type=int, default=20, help="rows claimed per lease")
+    parser.add_argument("--lease-seconds", type=int, default=120)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--drain", action="store_true", help="exit when nothing is left to claim")
+    args = parser.parse_args()
+
+    from supabase import create_client
+    url = os.environ.get("SUPABASE_URL")
+    key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+    if not url or not key:
+        sys.exit("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY.")
+    get_dispatcher().cap(args.concurrency)
+
+    worker = AnalysisWorker(
+        create_client(url, key),
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        lease_seconds=args.lease_seconds,
+        max_attempts=args.max_attempts,
+    )
+    print(f"Worker {worker.worker_id} started (concurrency={args.concurrency}, batch={args.batch_size})")
+    try:
+        if args.drain:
+            stats = asyncio.run(worker.drain())
+        else:
+            asyncio.run(worker.run_forever())
+            stats = worker.stats
+    except KeyboardInterrupt:
+        stats = worker.stats
+    print(f"Worker {worker.worker_id} stopped: {stats}")
+
+
+if __name__ == "__main__":
+    main()
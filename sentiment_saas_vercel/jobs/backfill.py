@@ -0,0 +1,112 @@
+"""
+Historical backfill of news and research reports into raw_corpus, checkpointed per
+(symbol, source) in backfill_state so an interrupted run picks up where it stopped.
+
+Usage (from sentiment_saas_vercel/):
+    python jobs/backfill.py 600519 000001 --start 2024-01-01
+    python jobs/backfill.py --portfolios --start 2024-01-01 --end 2024-06-30
+    python jobs/backfill.py --portfolios --start 2024-01-01 --analysis-workers 2
+
+Backfilled rows are queued for analysis (is_analyzed = FALSE) and drained by
+jobs/analysis_worker.py. With --analysis-workers the job drains them itself,
+alongside ingestion rather than after it.
+Needs SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY, plus DEEPSEEK_API_KEY for scoring.
+"""
+import argparse
+import asyncio
+import os
+import pathlib
+import sys
+from datetime import date
+
+from dotenv import load_dotenv
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "api"))
+load_dotenv(dotenv_path=ROOT / ".env.local")
+
+from _lib.analysis_worker import AnalysisWorker  # noqa: E402
+from _lib.backfill import CHUNK_ROWS, MIN_INTERVAL, Backfill  # noqa: E402
+from _lib.llm_dispatch import get_dispatcher  # noqa: E402
+
+
+def portfolio_codes(client):
+    res = client.table("user_portfolios").select("stock_code").execute()
+    return sorted({r["stock_code"] for r in (res.data or [])})
+
+
+async def drain_alongside(worker, finished):
+    """
+    Keeps `worker` draining while the backfill runs; returns once it has finished
+    and nothing claimable is left.
+    """
+    while True:
+        if await worker.run_once():
+            continue
+        if finished.is_set():
+            return
+        try:
+            await asyncio.wait_for(finished.wait(), worker.idle_sleep)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run(backfill, codes, start, end, workers):
+    """
+    Runs the backfill on a thread while `workers` analyze what it has stored so far.
+    """
+    finished = asyncio.Event()
+    tasks = [asyncio.create_task(drain_alongside(w, finished)) for w in workers]
+    try:
+        return await asyncio.to_thread(backfill.run, codes, start, end)
+    finally:
+        finished.set()
+        await asyncio.gather(*tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill historical news and research reports.")
+    parser.add_argument("stock_codes", nargs="*")
+    parser.add_argument("--portfolios", action="store_true", help="every stock in any user's portfolio")
+    parser.add_argument("--start", required=True, type=date.fromisoformat, help="first day, YYYY-MM-DD")
+    parser.add_argument("--end", type=date.fromisoformat, default=date.today(), help="last day (default today)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="rows per upsert and checkpoint")
+    parser.add_argument("--min-interval", type=float, default=MIN_INTERVAL,
+                        help="seconds between upstream AkShare calls")
+    parser.add_argument("--analysis-workers", type=int, default=0,
+                        help="drain the analysis queue in this process while ingesting")
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get("WORKER_CONCURRENCY", "10")),
+                        help="max in-flight LLM calls per analysis worker")
+    args = parser.parse_args()
+
+    from supabase import create_client
+    url = os.environ.get("SUPABASE_URL")
+    key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+    if not url or not key:
+        sys.exit("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY.")
+    client = create_client(url, key)
+
+    codes = args.stock_codes or (portfolio_codes(client) if args.portfolios else [])
+    if not codes:
+        sys.exit("Pass stock codes or --portfolios.")
+
+    backfill = Backfill(client, chunk_rows=args.chunk_rows, min_interval=args.min_interval)
+    workers = [AnalysisWorker(client, concurrency=args.concurrency) for _ in range(args.analysis_workers)]
+    get_dispatcher().cap(args.concurrency * max(1, args.analysis_workers))
+    print(f"Backfilling {len(codes)} symbols from {args.start} to {args.end}")
+    try:
+        report = asyncio.run(run(backfill, codes, args.start, args.end, workers))
+    except KeyboardInterrupt:
+        print(f"Interrupted: {backfill.stats} (rerun to resume from the checkpoints)")
+        sys.exit(1)
+
+    for key, state in report.items():
+        note = f" ({state['last_error']})" if state.get("last_error") else ""
+        print(f"{key}: {state['status']}, {state['rows_inserted']} new of {state['rows_seen']}{note}")
+    print(f"Backfill: {backfill.stats}")
+    for w in workers:
+        print(f"Worker {w.worker_id}: {w.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Market-wide ingestion scheduler. Keeps every stock in any user's portfolio fresh,
+fetching and analyzing each one once for all of its holders, so dashboards only read.
+
+Usage (from sentiment_saas_vercel/):
+    python jobs/ingest_scheduler.py --stale-minutes 15 --batch-size 10
+    python jobs/ingest_scheduler.py --once   # exit once nothing is due
+
+Needs SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY (it writes across all users), plus
+DEEPSEEK_API_KEY for real scoring. Symbols are leased, so several copies (and
+jobs/analysis_worker.py) can run side by side.
+"""
+import argparse
+import asyncio
+import os
+import pathlib
+import sys
+
+from dotenv import load_dotenv
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "api"))
+load_dotenv(dotenv_path=ROOT / ".env.local")
+
+from _lib.analysis_worker import AnalysisWorker  # noqa: E402
+from _lib.llm_dispatch import get_dispatcher  # noqa: E402
+from _lib.scheduler import STALE_SECONDS, IngestScheduler  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest and analyze every portfolio stock on a schedule.")
+    parser.add_argument("--stale-minutes", type=float, default=STALE_SECONDS / 60,
+                        help="re-ingest a symbol once its last fetch is this old")
+    parser.add_argument("--batch-size", type=int, default=10, help="symbols claimed per round")
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get("WORKER_CONCURRENCY", "10")),
+                        help="max in-flight LLM calls")
+    parser.add_argument("--idle-seconds", type=float, default=30, help="sleep when nothing is due")
+    parser.add_argument("--once", action="store_true", help="exit when no symbol is due")
+    args = parser.parse_args()
+
+    from supabase import create_client
+    url = os.environ.get("SUPABASE_URL")
+    key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+    if not url or not key:
+        sys.exit("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY.")
+
+    client = create_client(url, key)
+    get_dispatcher().cap(args.concurrency)
+    scheduler = IngestScheduler(
+        client,
+        worker=AnalysisWorker(client, concurrency=args.concurrency),
+        batch_size=args.batch_size,
+        stale_seconds=int(args.stale_minutes * 60),
+        idle_sleep=args.idle_seconds,
+    )
+    print(f"Scheduler {scheduler.scheduler_id} started (stale after {args.stale_minutes:g} min, "
+          f"batch={args.batch_size})")
+    try:
+        if args.once:
+            stats = asyncio.run(scheduler.catch_up())
+        else:
+            asyncio.run(scheduler.run_forever())
+            stats = scheduler.stats
+    except KeyboardInterrupt:
+        stats = scheduler.stats
+    print(f"Scheduler {scheduler.scheduler_id} stopped: {stats}, analysis: {scheduler.worker.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Recomputes the sentiment_daily rollups from raw_corpus + sentiment_results.
+
+Usage (from sentiment_saas_vercel/):
+    python jobs/rebuild_rollups.py                  # every stock in any portfolio
+    python jobs/rebuild_rollups.py 600519 000001    # just these
+    python jobs/rebuild_rollups.py --verify         # compare only, write nothing
+
+--verify exits non-zero if any stored rollup differs from the recomputed one.
+Needs SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY.
+"""
+import argparse
+import os
+import pathlib
+import sys
+
+from dotenv import load_dotenv
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "api"))
+load_dotenv(dotenv_path=ROOT / ".env.local")
+
+from _lib import rollups  # noqa: E402
+
+
+def portfolio_codes(client):
+    res = client.table("user_portfolios").select("stock_code").execute()
+    return sorted({r["stock_code"] for r in (res.data or [])})
+
+
+def differences(stored, fresh, tolerance=1e-6):
+    """
+    Returns human-readable mismatches between stored and recomputed rollup rows.
+    """
+    def keyed(rows):
+        return {(str(r["day"])[:10], r["source"]): r for r in rows}
+
+    stored, fresh = keyed(stored), keyed(fresh)
+    problems = []
+    for key in sorted(set(stored) | set(fresh)):
+        a, b = stored.get(key), fresh.get(key)
+        if a is None or b is None:
+            problems.append(f"{key}: {'missing' if a is None else 'unexpected'} row")
+        elif a["item_count"] != b["item_count"] or abs(a["score_sum"] - b["score_sum"]) > tolerance:
+            problems.append(f"{key}: stored {a['score_sum']:.4f}/{a['item_count']}, "
+                            f"recomputed {b['score_sum']:.4f}/{b['item_count']}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild or verify sentiment_daily rollups.")
+    parser.add_argument("stock_codes", nargs="*", help="defaults to every stock in user_portfolios")
+    parser.add_argument("--verify", action="store_true", help="compare with a fresh computation, write nothing")
+    args = parser.parse_args()
+
+    from supabase import create_client
+    url = os.environ.get("SUPABASE_URL")
+    key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+    if not url or not key:
+        sys.exit("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE_KEY.")
+    client = create_client(url, key)
+
+    codes = args.stock_codes or portfolio_codes(client)
+    mismatched = 0
+    for code in codes:
+        if args.verify:
+            problems = differences(rollups.load(client, code), rollups.compute(client, code))
+            mismatched += bool(problems)
+            print(f"{code}: {'OK' if not problems else f'{len(problems)} mismatches'}")
+            for line in problems[:20]:
+                print(f"  {line}")
+        else:
+            fresh = rollups.rebuild(client, code)
+            print(f"{code}: {len(fresh)} rollup rows")
+
+    if args.verify and mismatched:
+        sys.exit(f"{mismatched}/{len(codes)} stocks have stale rollups")
+
+
+if __name__ == "__main__":
+    main()
@@ -101,3 +101,321 @@ create policy "Authenticated users can read sentiment_results"
 
 -- Backend (Service Role) writes.
 
+
+-- 5. Server-side analysis worker (leases + jobs)
+-- Workers run with the service role key and claim rows via claim_analysis_batch().
+alter table raw_corpus add column if not exists lease_owner text;
+alter table raw_corpus add column if not exists lease_expires_at timestamp with time zone;
+alter table raw_corpus add column if not exists analysis_attempts int not null default 0;
+alter table raw_corpus add column if not exists last_error text;
+alter table raw_corpus add column if not exists job_id uuid;
+
+create index if not exists idx_raw_corpus_claimable on raw_corpus(is_analyzed, lease_expires_at) where is_analyzed = false;
+create index if not exists idx_raw_corpus_job on raw_corpus(job_id);
+
+create table analysis_jobs (
+  id uuid default uuid_generate_v4() primary key,
+  user_id uuid references auth.users,
+  stock_code text not null,
+  total int not null default 0,
+  created_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+
+alter table analysis_jobs enable row level security;
+
+create policy "Users can view their own analysis jobs"
+  on analysis_jobs for select
+  using (auth.uid() = user_id);
+
+create policy "Users can create their own analysis jobs"
+  on analysis_jobs for insert
+  with check (auth.uid() = user_id);
+
+-- Backend (Service Role) sets `total` once the rows are tagged.
+
+-- Claims up to p_limit unanalyzed rows for one worker. SKIP LOCKED keeps concurrent
+-- workers from blocking on (or double-claiming) the same rows; an expired lease
+-- (crashed worker, or a failure's retry backoff) makes a row claimable again.
+-- p_ids restricts the claim to given rows (the ingest scheduler analyzes only what it inserted).
+-- Rows someone is waiting on (tagged with a job) go first, then the newest.
+create or replace function claim_analysis_batch(p_worker text, p_limit int, p_lease_seconds int, p_max_attempts int,
+                                                p_ids uuid[] default null)
+returns setof raw_corpus
+language sql
+as $$
+  update raw_corpus r
+     set lease_owner = p_worker,
+         lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+         analysis_attempts = r.analysis_attempts + 1
+   where r.id in (
+     select id from raw_corpus
+      where is_analyzed = false
+        and analysis_attempts < p_max_attempts
+        and (lease_expires_at is null or lease_expires_at < now())
+        and (p_ids is null or id = any(p_ids))
+      order by job_id is null, publish_time desc nulls last, id
+      limit p_limit
+      for update skip locked
+   )
+  returning r.*;
+$$;
+
+create or replace function analysis_job_progress(p_job uuid, p_max_attempts int default 3)
+returns table (total bigint, done bigint, failed bigint)
+language sql stable
+as $$
+  select count(*),
+         count(*) filter (where is_analyzed),
+         count(*) filter (where not is_analyzed and analysis_attempts >= p_max_attempts)
+    from raw_corpus
+   where job_id = p_job;
+$$;
+
+-- Tags a stock's pending rows that no earlier job holds with p_job, in one statement
+-- (no id list through PostgREST). Returns the number of rows tagged.
+create or replace function tag_analysis_job(p_job uuid, p_stock text)
+returns int
+language sql
+as $$
+  with tagged as (
+    update raw_corpus
+       set job_id = p_job
+     where stock_code = p_stock
+       and is_analyzed = false
+       and job_id is null
+    returning 1
+  )
+  select count(*)::int from tagged;
+$$;
+
+-- Worker/job functions are for the backend only (the API checks job ownership first)
+revoke execute on function claim_analysis_batch(text, int, int, int, uuid[]) from public, anon, authenticated;
+revoke execute on function analysis_job_progress(uuid, int) from public, anon, authenticated;
+revoke execute on function tag_analysis_job(uuid, text) from public, anon, authenticated;
+grant execute on function claim_analysis_batch(text, int, int, int, uuid[]) to service_role;
+grant execute on function analysis_job_progress(uuid, int) to service_role;
+grant execute on function tag_analysis_job(uuid, text) to service_role;
+
+-- 6. llm_cache (content-hash keyed LLM results shared across serverless instances)
+create table llm_cache (
+  key text primary key, -- sha256(prompt_version, source, prompt text sent for the item)
+  prompt_version text not null,
+  score float,
+  summary text,
+  created_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+
+create index idx_llm_cache_version on llm_cache(prompt_version);
+
+alter table llm_cache enable row level security;
+
+create policy "Authenticated users can read llm_cache"
+  on llm_cache for select
+  to authenticated
+  using (true);
+
+-- Backend (Service Role) writes.
+
+
+-- 7. raw_corpus dedupe keys (fetch_raw upserts on (stock_code, fingerprint))
+alter table raw_corpus add column if not exists fingerprint text; -- sha256 of the normalized, lower-cased title
+alter table raw_corpus add column if not exists simhash bigint;   -- 64-bit title SimHash for the near-duplicate index
+
+-- Backfill with the same normalization as api/_lib/near_dup.py (NFKC, whitespace collapsed, lower-cased)
+update raw_corpus
+  set fingerprint = encode(sha256(convert_to(
+    lower(btrim(regexp_replace(normalize(title, NFKC), '\s+', ' ', 'g'))), 'UTF8')), 'hex')
+  where fingerprint is null;
+
+-- Drop existing duplicates (keep the newest per title), as cleanup_data would.
+-- Rows without a publish_time are ranked by created_at. sentiment_results.corpus_id
+-- has no ON DELETE CASCADE, so the duplicates' results are deleted with them.
+with duplicates as (
+  select id from (
+    select id, row_number() over (
+             partition by stock_code, fingerprint
+             order by coalesce(publish_time, created_at) desc, id desc) as rank
+      from raw_corpus
+  ) ranked
+  where rank > 1
+), results as (
+  delete from sentiment_results where corpus_id in (select id from duplicates)
+)
+delete from raw_corpus where id in (select id from duplicates);
+
+create unique index if not exists idx_raw_corpus_fingerprint on raw_corpus(stock_code, fingerprint);
+create index if not exists idx_raw_corpus_stock_created on raw_corpus(stock_code, created_at);
+
+
+-- 8. cleanup_state (per-stock high-water marks for incremental cleanup_data)
+create table if not exists cleanup_state (
+  stock_code text primary key,
+  corpus_high_water timestamp with time zone,  -- raw_corpus.created_at scanned up to
+  results_high_water timestamp with time zone, -- sentiment_results.created_at scanned up to
+  updated_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+
+create index if not exists idx_sentiment_results_created on sentiment_results(created_at);
+
+alter table cleanup_state enable row level security;
+
+create policy "Authenticated users can read cleanup_state"
+  on cleanup_state for select
+  to authenticated
+  using (true);
+
+-- Backend (Service Role) writes.
+
+
+-- 9. sentiment_daily (per-stock, per-day, per-source rollups of sentiment_results)
+create table if not exists sentiment_daily (
+  stock_code text not null,
+  day date not null,                -- UTC date of raw_corpus.publish_time
+  source text not null check (source in ('news', 'guba')), -- which score column the items used
+  score_sum float not null default 0,
+  item_count int not null default 0,
+  top_summaries jsonb not null default '[]'::jsonb, -- [{score, summary}], largest |score| first, at most 3
+  updated_at timestamp with time zone default timezone('utc'::text, now()) not null,
+  primary key (stock_code, day, source)
+);
+
+alter table sentiment_daily enable row level security;
+
+create policy "Authenticated users can read sentiment_daily"
+  on sentiment_daily for select
+  to authenticated
+  using (true);
+
+-- Adds a batch of deltas (one row per key) atomically; called by every writer of sentiment_results.
+-- Both rollup functions are security definer, so only the service role may execute them (see grants below).
+create or replace function apply_sentiment_rollup(p_rows jsonb)
+returns void
+language sql
+security definer
+set search_path = public
+as $$
+  insert into sentiment_daily as d (stock_code, day, source, score_sum, item_count, top_summaries)
+  select r.stock_code, r.day, r.source, r.score_sum, r.item_count, r.top_summaries
+  from jsonb_to_recordset(p_rows)
+    as r(stock_code text, day date, source text, score_sum float, item_count int, top_summaries jsonb)
+  on conflict (stock_code, day, source) do update set
+    score_sum = d.score_sum + excluded.score_sum,
+    item_count = d.item_count + excluded.item_count,
+    top_summaries = (
+      select coalesce(jsonb_agg(t.s order by abs((t.s->>'score')::float) desc), '[]'::jsonb)
+      from (
+        select s from jsonb_array_elements(d.top_summaries || excluded.top_summaries) s
+        order by abs((s->>'score')::float) desc
+        limit 3
+      ) t
+    ),
+    updated_at = timezone('utc'::text, now());
+$$;
+
+-- Swaps in a recomputed set of rollup rows for one stock (cleanup_data, jobs/rebuild_rollups.py)
+create or replace function replace_sentiment_rollup(p_stock text, p_rows jsonb)
+returns void
+language sql
+security definer
+set search_path = public
+as $$
+  delete from sentiment_daily where stock_code = p_stock;
+  insert into sentiment_daily (stock_code, day, source, score_sum, item_count, top_summaries)
+  select p_stock, r.day, r.source, r.score_sum, r.item_count, r.top_summaries
+  from jsonb_to_recordset(p_rows)
+    as r(day date, source text, score_sum float, item_count int, top_summaries jsonb);
+$$;
+
+revoke execute on function apply_sentiment_rollup(jsonb) from public, anon, authenticated;
+revoke execute on function replace_sentiment_rollup(text, jsonb) from public, anon, authenticated;
+grant execute on function apply_sentiment_rollup(jsonb) to service_role;
+grant execute on function replace_sentiment_rollup(text, jsonb) to service_role;
+
+
+-- 10. ingest_state (per-symbol freshness kept by the market-wide ingestion scheduler)
+-- jobs/ingest_scheduler.py runs with the service role key; the dashboard only reads.
+create table if not exists ingest_state (
+  stock_code text primary key,
+  holders int not null default 0,              -- portfolios holding it when last claimed
+  last_ingested_at timestamp with time zone,   -- last fetch with at least one source answering
+  last_analyzed_at timestamp with time zone,   -- every row inserted by that fetch analyzed
+  new_items int not null default 0,            -- rows the last fetch added
+  last_error text,
+  lease_owner text,
+  lease_expires_at timestamp with time zone,
+  updated_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+
+create index if not exists idx_user_portfolios_stock on user_portfolios(stock_code);
+
+alter table ingest_state enable row level security;
+
+create policy "Authenticated users can read ingest_state"
+  on ingest_state for select
+  to authenticated
+  using (true);
+
+-- Leases up to p_limit portfolio symbols not ingested within p_stale_seconds. Never-ingested
+-- symbols come first, then the rest by holders x seconds since their last ingest, so popular
+-- stale stocks are refreshed before rarely held ones. SKIP LOCKED + leases as in claim_analysis_batch.
+create or replace function claim_stale_symbols(p_worker text, p_limit int, p_stale_seconds int, p_lease_seconds int)
+returns setof ingest_state
+language sql
+as $$
+  insert into ingest_state (stock_code)
+  select distinct stock_code from user_portfolios
+  on conflict (stock_code) do nothing;
+
+  update ingest_state s
+     set lease_owner = p_worker,
+         lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+         holders = due.holders
+    from (
+      select st.stock_code, h.holders
+        from ingest_state st
+        join (select stock_code, count(distinct user_id)::int as holders
+                from user_portfolios group by stock_code) h on h.stock_code = st.stock_code
+       where (st.last_ingested_at is null or st.last_ingested_at < now() - make_interval(secs => p_stale_seconds))
+         and (st.lease_expires_at is null or st.lease_expires_at < now())
+       order by st.last_ingested_at is not null,
+                h.holders * extract(epoch from now() - coalesce(st.last_ingested_at, now())) desc,
+                h.holders desc
+       limit p_limit
+       for update of st skip locked
+    ) due
+   where s.stock_code = due.stock_code
+  returning s.*;
+$$;
+
+
+-- 11. backfill_state (per-symbol, per-source checkpoints of jobs/backfill.py)
+create table if not exists backfill_state (
+  stock_code text not null,
+  source text not null,            -- 'news' | 'report'
+  range_start date not null,
+  range_end date not null,
+  cursor text,                     -- publish_time of the last stored chunk's newest row
+  rows_seen int not null default 0,
+  rows_inserted int not null default 0,
+  status text not null default 'running' check (status in ('running', 'done', 'failed')),
+  last_error text,
+  updated_at timestamp with time zone default timezone('utc'::text, now()) not null,
+  primary key (stock_code, source)
+);
+
+alter table backfill_state enable row level security;
+
+create policy "Authenticated users can read backfill_state"
+  on backfill_state for select
+  to authenticated
+  using (true);
+
+
+-- 12. Per-item token accounting on sentiment_results (api/_lib/prompt.py)
+-- Zero for rows settled without a model call (cache hits, lexicon). Packed calls
+-- are shared out over their items by prompt share.
+alter table sentiment_results add column if not exists prompt_tokens int not null default 0;
+alter table sentiment_results add column if not exists completion_tokens int not null default 0;
+alter table sentiment_results add column if not exists cached_tokens int not null default 0;    -- prompt tokens served from the provider's prefix cache
+alter table sentiment_results add column if not exists content_tokens int not null default 0;   -- estimated title + content before trimming
+alter table sentiment_results add column if not exists trimmed_tokens int not null default 0;   -- estimated tokens dropped by the per-item budget